@@ -1,13 +1,16 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
+from config import get_backup_subdir, get_home_dir, get_user, ensure_exists
 from utils import copy_dir, copy_file, ensure_dir_owned_by_user
 
+# preferences restores all of ~/Library/Preferences, which includes the Alfred plist
+restore_dependencies = ['preferences']
+# clipboard history and other Alfred databases
+chunked_files = ['*.alfdb', '*.sqlite', '*.db']
+
 
 def get_alfred_backup_dir():
-    return_val = join(get_macprefs_dir(), 'alfred/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('alfred/')
 
 
 def get_alfred_support_dir():
@@ -65,3 +68,19 @@ def restore():
         copy_file(alfred_plist_source, prefs_dir)
         log.debug('Restored Alfred preferences')
         log.info('Alfred settings restored. You may need to restart Alfred.')
+
+
+def get_backup_sources():
+    dest = get_alfred_backup_dir()
+    return [
+        (get_alfred_support_dir(), join(dest, 'ApplicationSupport/')),
+        (join(get_alfred_preferences_dir(), 'com.runningwithcrayons.Alfred.plist'), dest),
+    ]
+
+
+def get_backup_paths():
+    return [get_alfred_backup_dir()]
+
+
+def get_restore_paths():
+    return [get_alfred_support_dir(), join(get_alfred_preferences_dir(), 'com.runningwithcrayons.Alfred.plist')]
@@ -29,3 +29,16 @@ def build_file_list():
     result = execute_shell(command, is_shell=True, suppress_errors=True)
     files = result.strip().split('\n')
     return files
+
+
+def get_backup_sources():
+    dest = get_app_store_preferences_backup_dir()
+    return [(f, dest) for f in build_file_list() if f]
+
+
+def get_backup_paths():
+    return [get_app_store_preferences_backup_dir()]
+
+
+def get_restore_paths():
+    return [get_app_store_preferences_dir()]
@@ -1,52 +1,51 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, ensure_exists
-from utils import execute_shell
+from config import get_backup_subdir
+from utils import run_commands
 
 
 def get_applications_backup_dir():
-    return_val = join(get_macprefs_dir(), 'applications/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('applications/')
 
 
 def backup():
     log.info('Backing up applications list...')
     dest = get_applications_backup_dir()
+    user_apps_dir = join(get_home_dir(), 'Applications/')
+
+    # the listings only change when an app is (un)installed
+    apps, user_apps, mas_apps = run_commands([
+        ['ls', '-1', '/Applications/'],
+        ['ls', '-1', user_apps_dir],
+        ['mas', 'list'],
+    ], cached=True, watch=['/Applications', user_apps_dir])
 
     # List all applications in /Applications
-    try:
-        log.debug('Listing applications in /Applications...')
-        apps = execute_shell(['ls', '-1', '/Applications/'])
+    if apps.ok:
         apps_file = join(dest, 'Applications.txt')
         with open(apps_file, 'w') as f:
-            f.write(apps)
+            f.write(apps.stdout)
         log.debug('Backed up /Applications list')
-    except Exception as e:
-        log.warning('Could not list /Applications: %s', str(e))
+    else:
+        log.warning('Could not list /Applications: %s', apps.stderr)
 
     # List user applications in ~/Applications
-    try:
-        log.debug('Listing applications in ~/Applications...')
-        user_apps = execute_shell(['ls', '-1', join(get_home_dir(), 'Applications/')], suppress_errors=True)
-        if user_apps:
-            user_apps_file = join(dest, 'UserApplications.txt')
-            with open(user_apps_file, 'w') as f:
-                f.write(user_apps)
-            log.debug('Backed up ~/Applications list')
-    except Exception as e:
-        log.debug('No ~/Applications directory or could not list it: %s', str(e))
+    if user_apps.ok and user_apps.stdout:
+        user_apps_file = join(dest, 'UserApplications.txt')
+        with open(user_apps_file, 'w') as f:
+            f.write(user_apps.stdout)
+        log.debug('Backed up ~/Applications list')
+    elif not user_apps.ok:
+        log.debug('No ~/Applications directory or could not list it: %s', user_apps.stderr)
 
     # List Mac App Store applications
-    try:
-        log.debug('Listing Mac App Store applications...')
-        mas_apps = execute_shell(['mas', 'list'], suppress_errors=True)
+    if mas_apps.ok:
         mas_file = join(dest, 'MasApplications.txt')
         with open(mas_file, 'w') as f:
-            f.write(mas_apps)
+            f.write(mas_apps.stdout)
         log.debug('Backed up Mac App Store applications')
-    except Exception as e:
-        log.info('Could not list Mac App Store applications (mas may not be installed): %s', str(e))
+    else:
+        log.info('Could not list Mac App Store applications (mas may not be installed): %s', mas_apps.stderr)
 
 
 def restore():
@@ -70,3 +69,17 @@ def restore():
 def get_home_dir():
     from os import getenv
     return getenv('HOME') + '/'
+
+
+def get_backup_sources():
+    # the application lists are generated, nothing is copied
+    return []
+
+
+def get_backup_paths():
+    return [get_applications_backup_dir()]
+
+
+def get_restore_paths():
+    # informational only, nothing is written on restore
+    return []
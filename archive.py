@@ -0,0 +1,442 @@
+"""
+Archive output mode: instead of thousands of loose files, a snapshot holds
+one compressed archive per module in archives/<module>.mpa, plus the small
+files at its root (RESTORE.md, recorded modes, manifest).
+
+Modules still back up into a local staging mirror of the snapshot (in the
+cache dir), which is then streamed into the archives. Every backup starts
+an empty mirror and hard links unchanged files against the last one, so
+only changed files are copied while deleted files and modules not backed
+up now are left out. Restores extract only the archives of the
+selected modules into a temp dir and restore from there.
+
+Archive layout:
+
+    MAGIC
+    entry data        every file compressed on its own, so it can be read alone
+    index             zlib compressed JSON: codec, dictionary and the entries with their offsets
+    footer            index offset, index length, FOOTER_MAGIC
+
+Small files like plists barely compress on their own, so with a dictionary
+one is trained per module from samples of its files and every file is
+compressed against it. Dictionaries are stored in archives/dictionaries/,
+named by their hash, and the index names the one its entries need.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from os import path
+import hashlib
+import json
+import logging as log
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import zlib
+import config
+import manifest
+import snapshots
+
+MAGIC = b'MPARCH1\n'
+FOOTER_MAGIC = b'MPAINDEX'
+FOOTER = struct.Struct('<QQ8s')
+ARCHIVE_DIR = 'archives'
+ARCHIVE_SUFFIX = '.mpa'
+CHUNK_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 6
+DICTIONARY_DIR = 'dictionaries'
+# zlib only looks at the last 32KB of a dictionary
+DICTIONARY_SIZE = 32 * 1024
+SAMPLE_FILES = 1000
+SAMPLE_BYTES = 4096
+# length and spacing of the substrings the zlib dictionary is built from
+SUBSTRING_LENGTH = 24
+SUBSTRING_STEP = 6
+# which snapshot the staging mirror was last packed into
+STAGING_MARKER = '.macprefs-staging-for'
+PREVIOUS_SUFFIX = '.previous'
+
+
+class ZlibCodec:
+    name = 'zlib'
+
+    def __init__(self, dictionary=None):
+        self.dictionary = dictionary
+
+    def compressor(self):
+        if self.dictionary:
+            return zlib.compressobj(COMPRESSION_LEVEL, zdict=self.dictionary)
+        return zlib.compressobj(COMPRESSION_LEVEL)
+
+    def decompressor(self):
+        if self.dictionary:
+            return zlib.decompressobj(zdict=self.dictionary)
+        return zlib.decompressobj()
+
+    def train(self, samples):
+        return train_zlib_dictionary(samples)
+
+
+class ZstdCodec:
+    """ Needs the optional zstandard package. """
+    name = 'zstd'
+
+    def __init__(self, dictionary=None):
+        import zstandard
+        self.dictionary = dictionary
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        self.compression = zstandard.ZstdCompressor(level=3, dict_data=dict_data)
+        self.decompression = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+    def compressor(self):
+        return self.compression.compressobj()
+
+    def decompressor(self):
+        return self.decompression.decompressobj()
+
+    def train(self, samples):
+        import zstandard
+        try:
+            return zstandard.train_dictionary(DICTIONARY_SIZE, samples).as_bytes()
+        except zstandard.ZstdError:
+            # too few or too small samples
+            return None
+
+
+def get_codec(name, dictionary=None):
+    if name == 'zlib':
+        return ZlibCodec(dictionary)
+    if name == 'zstd':
+        try:
+            return ZstdCodec(dictionary)
+        except ImportError:
+            raise ImportError('zstd compression needs the zstandard package (pip install zstandard)')
+    raise ValueError('Unknown compression: ' + name)
+
+
+def train_zlib_dictionary(samples, size=DICTIONARY_SIZE):
+    """
+    zlib has no trainer, so the dictionary is made of the substrings found in
+    the most samples, the most common last where they're cheapest to refer to.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(sample[i:i + SUBSTRING_LENGTH]
+                          for i in range(0, len(sample) - SUBSTRING_LENGTH + 1, SUBSTRING_STEP)))
+    picked = []
+    total = 0
+    for substring, count in counts.most_common():
+        if count < 2 or total + len(substring) > size:
+            break
+        picked.append(substring)
+        total += len(substring)
+    return b''.join(reversed(picked)) or None
+
+
+def get_samples(file_paths):
+    """ The start of up to SAMPLE_FILES files, spread over all of them. """
+    files = [p for p in file_paths if path.isfile(p) and not path.islink(p)]
+    step = max(1, len(files) // SAMPLE_FILES)
+    samples = []
+    for file_path in files[::step]:
+        with open(file_path, 'rb') as f:
+            sample = f.read(SAMPLE_BYTES)
+        if sample:
+            samples.append(sample)
+    return samples
+
+
+def write_dictionary(dictionary_dir, codec_name, dictionary):
+    """ Stores dictionary under its hash, returns its path. """
+    config.ensure_exists(dictionary_dir)
+    name = '{}-{}.dict'.format(codec_name, hashlib.sha256(dictionary).hexdigest()[:16])
+    dictionary_path = path.join(dictionary_dir, name)
+    if not path.exists(dictionary_path):
+        fd, tmp = tempfile.mkstemp(prefix='.' + name + '-', dir=dictionary_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(dictionary)
+        os.replace(tmp, dictionary_path)
+    return dictionary_path
+
+
+def load_dictionary(archive_path, index):
+    if not index.get('dictionary'):
+        return None
+    dictionary_path = path.join(path.dirname(archive_path), index['dictionary'])
+    with open(dictionary_path, 'rb') as f:
+        dictionary = f.read()
+    if hashlib.sha256(dictionary).hexdigest()[:16] not in path.basename(dictionary_path):
+        raise ValueError(dictionary_path + ' is corrupt')
+    return dictionary
+
+
+def write_archive(archive_path, root, paths, codec, dictionary_dir=None):
+    """
+    Stream everything below `paths` (relative to root) into a new archive at
+    archive_path. With a dictionary_dir, a dictionary is trained from the
+    files first and stored there.
+    """
+    # a codec of its own, zstd compressors can't be used by several threads at once
+    codec = get_codec(codec.name, codec.dictionary)
+    file_paths = [p for relative in paths for p in walk(path.join(root, relative))]
+    dictionary_name = None
+    if dictionary_dir is not None:
+        dictionary = codec.train(get_samples(file_paths))
+        if dictionary:
+            dictionary_path = write_dictionary(dictionary_dir, codec.name, dictionary)
+            dictionary_name = path.relpath(dictionary_path, path.dirname(archive_path))
+            codec = get_codec(codec.name, dictionary)
+    entries = []
+    fd, tmp = tempfile.mkstemp(prefix='.' + path.basename(archive_path) + '-', dir=path.dirname(archive_path))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(MAGIC)
+            for file_path in file_paths:
+                entry = write_entry(out, file_path, path.relpath(file_path, root), codec)
+                if entry is not None:
+                    entries.append(entry)
+            index = zlib.compress(json.dumps({'version': 1, 'codec': codec.name, 'dictionary': dictionary_name,
+                                              'entries': entries}).encode('utf-8'))
+            index_offset = out.tell()
+            out.write(index)
+            out.write(FOOTER.pack(index_offset, len(index), FOOTER_MAGIC))
+        os.replace(tmp, archive_path)
+    except BaseException:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return entries
+
+
+def walk(root):
+    """ root and everything below it, parents before children. """
+    root = root.rstrip('/')
+    if not path.lexists(root):
+        return
+    yield root
+    if path.islink(root) or not path.isdir(root):
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in dirnames + sorted(filenames):
+            yield path.join(dirpath, name)
+
+
+def write_entry(out, file_path, name, codec):
+    st = os.lstat(file_path)
+    entry = {'path': name, 'mode': stat.S_IMODE(st.st_mode), 'mtime': st.st_mtime_ns}
+    if stat.S_ISDIR(st.st_mode):
+        entry['type'] = 'dir'
+    elif stat.S_ISLNK(st.st_mode):
+        entry['type'] = 'symlink'
+        entry['target'] = os.readlink(file_path)
+    elif stat.S_ISREG(st.st_mode):
+        entry['type'] = 'file'
+        entry['offset'] = out.tell()
+        entry['size'] = st.st_size
+        compressor = codec.compressor()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                out.write(compressor.compress(chunk))
+        out.write(compressor.flush())
+        entry['length'] = out.tell() - entry['offset']
+    else:
+        # sockets and fifos can't be archived
+        return None
+    return entry
+
+
+def read_index(archive_path):
+    with open(archive_path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(archive_path + ' is not a macprefs archive')
+        f.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, index_length, footer_magic = FOOTER.unpack(f.read(FOOTER.size))
+        if footer_magic != FOOTER_MAGIC:
+            raise ValueError(archive_path + ' is incomplete')
+        f.seek(index_offset)
+        return json.loads(zlib.decompress(f.read(index_length)).decode('utf-8'))
+
+
+def extract_archive(archive_path, dest_root, prefixes=None):
+    """
+    Extract the entries whose path starts with one of `prefixes` (all when
+    None) into dest_root. Only those entries are read from the archive.
+    """
+    index = read_index(archive_path)
+    codec = get_codec(index['codec'], load_dictionary(archive_path, index))
+    entries = [e for e in index['entries'] if prefixes is None or
+               any(e['path'] == p.rstrip('/') or e['path'].startswith(p.rstrip('/') + '/') for p in prefixes)]
+    dirs = []
+    with open(archive_path, 'rb') as f:
+        for entry in entries:
+            dest = path.join(dest_root, entry['path'])
+            if entry['type'] == 'dir':
+                os.makedirs(dest, exist_ok=True)
+                dirs.append((dest, entry))
+                continue
+            os.makedirs(path.dirname(dest), exist_ok=True)
+            if path.lexists(dest) and not path.isdir(dest):
+                os.remove(dest)
+            if entry['type'] == 'symlink':
+                os.symlink(entry['target'], dest)
+                continue
+            extract_entry(f, entry, dest, codec)
+            os.chmod(dest, entry['mode'])
+            os.utime(dest, ns=(entry['mtime'], entry['mtime']))
+    # directories last, extracting into them changes their mtime
+    for dest, entry in reversed(dirs):
+        os.chmod(dest, entry['mode'])
+        os.utime(dest, ns=(entry['mtime'], entry['mtime']))
+    return entries
+
+
+def extract_entry(f, entry, dest, codec):
+    f.seek(entry['offset'])
+    remaining = entry['length']
+    decompressor = codec.decompressor()
+    with open(dest, 'wb') as out:
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError('Archive ends inside ' + entry['path'])
+            remaining -= len(chunk)
+            out.write(decompressor.decompress(chunk))
+        flush = getattr(decompressor, 'flush', None)
+        if flush is not None:
+            out.write(flush())
+
+
+def read_entry(archive_path, rel_path):
+    """ The content of one file in the archive, None when it isn't in it. """
+    index = read_index(archive_path)
+    for entry in index['entries']:
+        if entry['path'] == rel_path and entry['type'] == 'file':
+            codec = get_codec(index['codec'], load_dictionary(archive_path, index))
+            with open(archive_path, 'rb') as f:
+                f.seek(entry['offset'])
+                decompressor = codec.decompressor()
+                data = decompressor.decompress(f.read(entry['length']))
+                flush = getattr(decompressor, 'flush', None)
+                return data + flush() if flush is not None else data
+    return None
+
+
+def list_archives(snapshot_dir):
+    archive_dir = path.join(snapshot_dir, ARCHIVE_DIR)
+    return [path.join(archive_dir, name) for name in sorted(os.listdir(archive_dir)) if name.endswith(ARCHIVE_SUFFIX)]
+
+
+def get_archive_path(snapshot_dir, name):
+    return path.join(snapshot_dir, ARCHIVE_DIR, name + ARCHIVE_SUFFIX)
+
+
+def is_archive_snapshot(snapshot_dir):
+    return path.isdir(path.join(snapshot_dir, ARCHIVE_DIR))
+
+
+def get_staging_dir(snapshot_dir):
+    """
+    The local mirror archive backups copy into. Dated snapshots of a machine
+    share one, so each backup only copies what changed since the last.
+    """
+    snapshot_dir = get_location(snapshot_dir)
+    if snapshots.SNAPSHOT_NAME.match(path.basename(snapshot_dir)):
+        snapshot_dir = path.dirname(snapshot_dir)
+    key = hashlib.sha1(snapshot_dir.encode('utf-8')).hexdigest()[:16]
+    staging_dir = path.join(config.get_cache_dir(), 'staging', key)
+    config.ensure_exists(staging_dir)
+    return staging_dir
+
+
+def get_location(snapshot_dir):
+    """ snapshot_dir made absolute, URLs of remote targets are kept as they are. """
+    return snapshot_dir if '://' in snapshot_dir else path.abspath(snapshot_dir)
+
+
+def claim_staging_dir(staging_dir, snapshot_dir):
+    """ Marks staging_dir as holding snapshot_dir's backup, returns whether it already did. """
+    marker = path.join(staging_dir, STAGING_MARKER)
+    snapshot_dir = get_location(snapshot_dir)
+    try:
+        with open(marker, 'r') as f:
+            if f.read() == snapshot_dir:
+                return True
+    except OSError:
+        pass
+    with open(marker, 'w') as f:
+        f.write(snapshot_dir)
+    return False
+
+
+def rotate_staging_dir(staging_dir):
+    """
+    Moves the staging mirror aside and starts an empty one, returns where the
+    last mirror is now, None when there was none. Backups hard link unchanged
+    files against it instead of copying them again.
+    """
+    previous_dir = get_previous_staging_dir(staging_dir)
+    if path.exists(previous_dir):
+        shutil.rmtree(previous_dir)
+    if not path.exists(staging_dir):
+        os.makedirs(staging_dir)
+        return None
+    os.rename(staging_dir, previous_dir)
+    os.makedirs(staging_dir)
+    return previous_dir
+
+
+def get_previous_staging_dir(staging_dir):
+    return path.normpath(staging_dir) + PREVIOUS_SUFFIX
+
+
+def pack_snapshot(staging_dir, snapshot_dir, modules, codec, jobs=1, dictionary=False):
+    """
+    Write an archive for each (name, paths) module, paths being the module's
+    backup folders in staging_dir, then copy the files and metadata folders
+    at the staging root. Other folders belong to modules not being packed.
+    With dictionary, each module's files are compressed against a dictionary
+    trained from them.
+    """
+    archive_dir = path.join(snapshot_dir, ARCHIVE_DIR)
+    config.ensure_exists(archive_dir)
+    dictionary_dir = path.join(archive_dir, DICTIONARY_DIR) if dictionary else None
+    jobs_args = []
+    for name, paths in modules:
+        relative = [path.relpath(p, staging_dir) for p in paths]
+        jobs_args.append((get_archive_path(snapshot_dir, name), relative))
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(write_archive, archive_path, staging_dir, relative, codec, dictionary_dir)
+                   for archive_path, relative in jobs_args]
+        for future in futures:
+            future.result()
+    for name in os.listdir(staging_dir):
+        if name == STAGING_MARKER:
+            continue
+        src = path.join(staging_dir, name)
+        dest = path.join(snapshot_dir, name)
+        if path.isdir(src) and not path.islink(src):
+            if name.startswith(manifest.METADATA_PREFIX):
+                shutil.copytree(src, dest, symlinks=True, dirs_exist_ok=True)
+        else:
+            shutil.copy2(src, dest, follow_symlinks=False)
+    log.debug('Packed %s modules into %s', len(jobs_args), archive_dir)
+
+
+def unpack_snapshot(snapshot_dir, dest_dir, names):
+    """ Extract the archives of the `names` modules and the snapshot's root files into dest_dir. """
+    for name in os.listdir(snapshot_dir):
+        if name == ARCHIVE_DIR:
+            continue
+        src = path.join(snapshot_dir, name)
+        if path.isdir(src) and not path.islink(src):
+            shutil.copytree(src, path.join(dest_dir, name), symlinks=True, dirs_exist_ok=True)
+        else:
+            shutil.copy2(src, path.join(dest_dir, name), follow_symlinks=False)
+    for name in names:
+        archive_path = get_archive_path(snapshot_dir, name)
+        if path.exists(archive_path):
+            extract_archive(archive_path, dest_dir)
+        else:
+            log.debug('No archive for %s in %s', name, snapshot_dir)
@@ -0,0 +1,172 @@
+"""
+Atomic snapshot commits: a backup writes into a hidden sibling of its
+snapshot, Backup/{machine}/.{date}.partial, which is only renamed into
+place once every module succeeded. Dropbox never sees half-written files
+under the snapshot's name and a crashed run leaves the partial folder,
+which `backup --resume` picks up again.
+
+Before the rename the data is made durable with one barrier for the whole
+tree rather than an fsync per copy, and a `.macprefs-complete` marker is
+written, so complete snapshots can be told from ones made before this
+existed or by hand.
+
+Replacing an earlier snapshot of the same day takes two renames, the old
+one is moved aside as .{date}.replaced first. A crash between them leaves
+no snapshot under its name, so the next backup or restore puts the
+replaced one back (see recover).
+"""
+from datetime import datetime
+from os import path
+import fcntl
+import json
+import logging as log
+import os
+import re
+import shutil
+import chunks
+
+MARKER_NAME = '.macprefs-complete'
+PARTIAL_NAME = re.compile(r'^\.\d{4}-\d{2}-\d{2}\.partial$')
+
+
+def get_partial_dir(snapshot_dir):
+    parent, name = path.split(path.normpath(snapshot_dir))
+    return path.join(parent, '.' + name + '.partial')
+
+
+def get_replaced_dir(snapshot_dir):
+    parent, name = path.split(path.normpath(snapshot_dir))
+    return path.join(parent, '.' + name + '.replaced')
+
+
+def recover(snapshot_dir):
+    """
+    Puts back the snapshot a crashed commit_snapshot moved aside, or deletes
+    it when the new one was committed. Returns whether it was put back.
+    """
+    replaced_dir = get_replaced_dir(snapshot_dir)
+    if not path.isdir(replaced_dir):
+        return False
+    if path.isdir(snapshot_dir) and os.listdir(snapshot_dir):
+        discard(replaced_dir)
+        return False
+    if path.isdir(snapshot_dir):
+        # created empty when the backup folder was resolved
+        os.rmdir(snapshot_dir)
+    os.rename(replaced_dir, snapshot_dir)
+    log.info('Recovered %s, a backup crashed while replacing it', snapshot_dir)
+    return True
+
+
+def list_partial_dirs(machine_dir):
+    """ Partial folders of machine_dir's backups that haven't been committed, e.g. after a crash. """
+    try:
+        names = os.listdir(machine_dir)
+    except FileNotFoundError:
+        return []
+    return [path.join(machine_dir, name) for name in sorted(names)
+            if PARTIAL_NAME.match(name) and path.isdir(path.join(machine_dir, name))]
+
+
+def is_complete(snapshot_dir):
+    return path.exists(path.join(snapshot_dir, MARKER_NAME))
+
+
+def discard(partial_dir):
+    if path.exists(partial_dir):
+        shutil.rmtree(partial_dir)
+
+
+def read_modules(snapshot_dir):
+    """ Modules the marker of a complete snapshot lists, empty for other snapshots. """
+    try:
+        with open(path.join(snapshot_dir, MARKER_NAME), 'r') as f:
+            return json.load(f)['modules']
+    except (OSError, ValueError, KeyError):
+        return []
+
+
+def carry_over(snapshot_dir, partial_dir, rel_paths):
+    """
+    Hard links rel_paths (files or folders relative to snapshot_dir) into
+    partial_dir, so a backup of some modules keeps the other modules of an
+    earlier backup the same day. Files already in partial_dir are kept.
+    """
+    for rel_path in rel_paths:
+        src = path.join(snapshot_dir, rel_path)
+        dest = path.join(partial_dir, rel_path)
+        if not path.lexists(src):
+            continue
+        os.makedirs(path.dirname(dest), exist_ok=True)
+        if not path.isdir(src) or path.islink(src):
+            link_missing(src, dest)
+            continue
+        for dirpath, dirnames, filenames in os.walk(src):
+            target_dir = path.join(dest, path.relpath(dirpath, src))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in filenames + [d for d in dirnames if path.islink(path.join(dirpath, d))]:
+                link_missing(path.join(dirpath, name), path.join(target_dir, name))
+
+
+def link_missing(src, dest):
+    if path.lexists(dest):
+        return
+    if path.islink(src):
+        os.symlink(os.readlink(src), dest)
+    else:
+        chunks.link_or_copy(src, dest)
+
+
+def write_marker(snapshot_dir, modules):
+    with open(path.join(snapshot_dir, MARKER_NAME), 'w') as f:
+        json.dump({'finished': datetime.now().isoformat(), 'modules': modules}, f)
+
+
+def barrier(root):
+    """ Makes everything written below root durable. """
+    if not hasattr(fcntl, 'F_FULLFSYNC'):
+        # waits for every dirty page of every filesystem in one call
+        os.sync()
+        return
+    # macOS: fsync only hands the data to the drive, one F_FULLFSYNC then flushes the drive's cache for all of it
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames + dirnames:
+            entry_path = path.join(dirpath, name)
+            if path.islink(entry_path):
+                continue
+            try:
+                fsync_path(entry_path)
+            except PermissionError:
+                # copied with a mode we can't read, it's written back by the kernel on its own
+                log.debug('Could not fsync %s', entry_path)
+    fd = os.open(root, os.O_RDONLY)
+    try:
+        fcntl.fcntl(fd, fcntl.F_FULLFSYNC)
+    finally:
+        os.close(fd)
+
+
+def fsync_path(entry_path):
+    fd = os.open(entry_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit_snapshot(partial_dir, snapshot_dir, modules):
+    """ Marks partial_dir complete, makes it durable and renames it to snapshot_dir, replacing what's there. """
+    write_marker(partial_dir, modules)
+    barrier(partial_dir)
+    parent = path.dirname(path.normpath(snapshot_dir))
+    if path.exists(snapshot_dir):
+        # a second backup the same day
+        replaced_dir = get_replaced_dir(snapshot_dir)
+        discard(replaced_dir)
+        os.rename(snapshot_dir, replaced_dir)
+        os.rename(partial_dir, snapshot_dir)
+        shutil.rmtree(replaced_dir)
+    else:
+        os.rename(partial_dir, snapshot_dir)
+    fsync_path(parent)
+    log.debug('Committed %s', snapshot_dir)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Compares archive compression of small config files: every file on its own,
+every file against a trained dictionary (backup --dictionary), and all files
+as one stream, which compresses best but can't read a file without the ones
+before it.
+
+    python benchmark_compression.py [folder, default ~/Library/Preferences]
+
+Without the folder, generated XML plists are used.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import archive
+
+
+def generate_plists(root, count):
+    words = ['Enabled', 'ShowAll', 'LastWindowFrame', 'RecentDocuments', 'NSNavPanel', 'Version',
+             'AutomaticallyCheck', 'TabbingMode', 'FontSize', 'Theme', 'SidebarWidth', 'WindowState']
+    rand = random.Random(1)
+    for i in range(count):
+        keys = rand.sample(words, 6)
+        body = ''.join('\t<key>{}</key>\n\t<{}/>\n'.format(k, rand.choice(['true', 'false'])) if j % 2 else
+                       '\t<key>{}</key>\n\t<integer>{}</integer>\n'.format(k, rand.randint(0, 100000))
+                       for j, k in enumerate(keys))
+        with open(os.path.join(root, 'com.example.app{}.plist'.format(i)), 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" '
+                    '"http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n'
+                    '<plist version="1.0">\n<dict>\n' + body + '</dict>\n</plist>\n')
+
+
+def read_files(root):
+    data = []
+    for file_path in archive.walk(root):
+        if os.path.isfile(file_path) and not os.path.islink(file_path):
+            try:
+                with open(file_path, 'rb') as f:
+                    data.append(f.read())
+            except OSError:
+                continue
+    return data
+
+
+def per_file(codec, data):
+    total = 0
+    for content in data:
+        compressor = codec.compressor()
+        total += len(compressor.compress(content)) + len(compressor.flush())
+    return total
+
+
+def whole_stream(codec, data):
+    compressor = codec.compressor()
+    total = sum(len(compressor.compress(content)) for content in data)
+    return total + len(compressor.flush())
+
+
+def measure(label, func, raw_size):
+    start = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - start
+    print('  {:<32}{:>12,} bytes {:>7.2f}x {:>9.1f} MB/s'.format(
+        label, size, raw_size / max(size, 1), raw_size / elapsed / 1024 / 1024))
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.expanduser('~/Library/Preferences')
+    generated = None
+    if not os.path.isdir(root):
+        generated = root = tempfile.mkdtemp(prefix='macprefs-bench-')
+        generate_plists(root, 2000)
+    try:
+        data = read_files(root)
+        raw_size = sum(len(content) for content in data)
+        print('{} files, {:,} bytes in {}'.format(len(data), raw_size, root))
+        for name in ['zlib', 'zstd']:
+            try:
+                codec = archive.get_codec(name)
+            except ImportError:
+                print('{}: zstandard not installed, skipping it'.format(name))
+                continue
+            start = time.perf_counter()
+            dictionary = codec.train(archive.get_samples(list(archive.walk(root))))
+            print('{}: dictionary of {:,} bytes trained in {:.3f} s'.format(
+                name, len(dictionary or b''), time.perf_counter() - start))
+            measure('per file', lambda: per_file(codec, data), raw_size)
+            if dictionary:
+                # the dictionary is stored once per module
+                dict_codec = archive.get_codec(name, dictionary)
+                measure('per file with dictionary', lambda: per_file(dict_codec, data) + len(dictionary), raw_size)
+            measure('whole archive', lambda: whole_stream(codec, data), raw_size)
+        print('zlib level {}, the index isn\'t counted'.format(archive.COMPRESSION_LEVEL))
+    finally:
+        if generated is not None:
+            shutil.rmtree(generated)
+
+
+if __name__ == '__main__':
+    main()
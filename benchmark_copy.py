@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Compares the per-file overhead of the rsync and python copy engines, the way
+git_config, vscode_settings and env_configs call utils.copy_file in a loop.
+
+    python benchmark_copy.py [number of files] [file size in bytes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import utils
+
+
+def create_files(root, count, size):
+    files = []
+    data = os.urandom(size)
+    for i in range(count):
+        file_path = os.path.join(root, 'file{}.plist'.format(i))
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        files.append(file_path)
+    return files
+
+
+def time_engine(engine, files, dest):
+    utils.set_copy_engine(engine)
+    os.makedirs(dest)
+    start = time.perf_counter()
+    for fle in files:
+        utils.copy_file(fle, dest)
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    root = tempfile.mkdtemp(prefix='macprefs-bench-')
+    try:
+        src = os.path.join(root, 'src')
+        os.makedirs(src)
+        files = create_files(src, count, size)
+        results = {}
+        for engine in ['rsync', 'python']:
+            if engine == 'rsync' and shutil.which('rsync') is None:
+                print('rsync not found, skipping it')
+                continue
+            results[engine] = time_engine(engine, files, os.path.join(root, engine) + '/')
+        print('{} files of {} bytes, one copy_file call per file'.format(count, size))
+        for engine, elapsed in results.items():
+            print('  {:<8}{:>10.3f} s total {:>10.3f} ms/file'.format(engine, elapsed, elapsed / count * 1000))
+        if 'rsync' in results:
+            print('  per-file overhead removed: {:.3f} ms'.format((results['rsync'] - results['python']) / count * 1000))
+    finally:
+        utils.set_copy_engine('rsync')
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
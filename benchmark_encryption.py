@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Measures the throughput of encrypted backups and restores (see
+encryption.py) of one large file, with one encryption thread and with one
+per core.
+
+    python benchmark_encryption.py [file size in MB]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import encryption
+
+
+def time_workers(workers, src, root, key):
+    encryption.WORKERS = workers
+    encryption._executor = None
+    encrypted = os.path.join(root, 'encrypted-{}'.format(workers))
+    decrypted = os.path.join(root, 'decrypted-{}'.format(workers))
+    start = time.perf_counter()
+    encryption.encrypt_file(src, encrypted, key, os.stat(src))
+    encrypt_time = time.perf_counter() - start
+    start = time.perf_counter()
+    encryption.decrypt_file(encrypted, decrypted, key)
+    decrypt_time = time.perf_counter() - start
+    os.remove(encrypted)
+    os.remove(decrypted)
+    return encrypt_time, decrypt_time
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 256 * 1024 * 1024
+    root = tempfile.mkdtemp(prefix='macprefs-bench-')
+    cores = os.cpu_count() or 1
+    try:
+        src = os.path.join(root, 'src')
+        with open(src, 'wb') as f:
+            for _ in range(size // encryption.CHUNK_SIZE):
+                f.write(os.urandom(encryption.CHUNK_SIZE))
+        size = os.path.getsize(src)
+        key = os.urandom(encryption.KEY_SIZE)
+        print('{} MB file, {} byte chunks, {} cores'.format(size // (1024 * 1024), encryption.CHUNK_SIZE, cores))
+        for workers in sorted({1, cores}):
+            encrypt_time, decrypt_time = time_workers(workers, src, root, key)
+            print('  {:>3} threads  encrypt {:>8.1f} MB/s  decrypt {:>8.1f} MB/s'.format(
+                workers, size / encrypt_time / 1024 / 1024, size / decrypt_time / 1024 / 1024))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
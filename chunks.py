@@ -0,0 +1,322 @@
+"""
+Content-defined chunking of large files that change a little every day,
+like the Accounts and Alfred SQLite databases or the .sfl2 stores.
+
+Modules list the names of such files in `chunked_files`. After a module
+backs up, each of them bigger than MIN_FILE_SIZE is cut into chunks where a
+rolling (gear) hash of the content says so, so an edit only changes the
+chunks around it. Chunks are stored once by their SHA-256 in the chunk
+store shared by the machine's snapshots (Backup/{machine}/chunks/) and the
+file is replaced by a `<name>.macprefs-recipe` listing them. Restores put
+the files back together in a temp copy of the modules' backup folders.
+
+The cut points are found by a per-byte loop, a few MB/s in Python, so a
+file with the size and mtime of the previous snapshot's recipe reuses it
+without being read, like rsync's quick check.
+"""
+from os import path
+import fnmatch
+import hashlib
+import json
+import logging as log
+import os
+import random
+import shutil
+import stat
+import tempfile
+import threading
+import config
+import manifest
+
+RECIPE_SUFFIX = '.macprefs-recipe'
+MIN_FILE_SIZE = 256 * 1024
+MIN_CHUNK = 2 * 1024
+AVERAGE_CHUNK = 8 * 1024
+MAX_CHUNK = 64 * 1024
+# a cut point is where the hash's top bits are zero, on average every AVERAGE_CHUNK bytes
+MASK = (AVERAGE_CHUNK - 1) << (64 - (AVERAGE_CHUNK - 1).bit_length())
+HASH_BITS = 0xFFFFFFFFFFFFFFFF
+GEAR = [random.Random(index).getrandbits(64) for index in range(256)]
+READ_SIZE = 1024 * 1024
+
+
+class ChunkStats:
+    """ What the chunked files of a run took and how much of it was already stored. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.new_bytes = 0
+
+    def add(self, size, new_bytes, chunks):
+        with self.lock:
+            self.files += 1
+            self.chunks += chunks
+            self.bytes += size
+            self.new_bytes += new_bytes
+
+    @property
+    def saved_bytes(self):
+        return self.bytes - self.new_bytes
+
+
+_stats = ChunkStats()
+
+
+def get_stats():
+    return _stats
+
+
+def reset_stats():
+    global _stats
+    _stats = ChunkStats()
+
+
+def cut_points(data):
+    """ Lengths of the chunks data splits into. """
+    lengths = []
+    start = 0
+    end = len(data)
+    while start < end:
+        length = find_cut(data, start, min(end, start + MAX_CHUNK))
+        lengths.append(length)
+        start += length
+    return lengths
+
+
+def find_cut(data, start, limit, gear=GEAR, mask=MASK, hash_bits=HASH_BITS):
+    if limit - start <= MIN_CHUNK:
+        return limit - start
+    fingerprint = 0
+    # the first MIN_CHUNK bytes are never a cut point, so they aren't hashed
+    position = start + MIN_CHUNK
+    # iterating over a slice with locals is the fastest loop CPython has for this
+    for byte in data[position:limit]:
+        fingerprint = ((fingerprint << 1) + gear[byte]) & hash_bits
+        position += 1
+        if not fingerprint & mask:
+            return position - start
+    return limit - start
+
+
+def iter_chunks(file_path):
+    """ Chunks of a file, read a buffer at a time. """
+    with open(file_path, 'rb') as f:
+        buffer = b''
+        start = 0
+        eof = False
+        while True:
+            # keep MAX_CHUNK buffered so a chunk is never cut by the end of a read
+            if not eof and len(buffer) - start < MAX_CHUNK:
+                data = f.read(READ_SIZE)
+                eof = not data
+                buffer = buffer[start:] + data
+                start = 0
+                continue
+            if start >= len(buffer):
+                return
+            length = find_cut(buffer, start, min(len(buffer), start + MAX_CHUNK))
+            yield buffer[start:start + length]
+            start += length
+
+
+def get_chunk_path(store_dir, digest):
+    return path.join(store_dir, digest[:2], digest)
+
+
+def store_chunk(store_dir, chunk):
+    """ Stores chunk unless it's already there, returns its hash and whether it was new. """
+    digest = hashlib.sha256(chunk).hexdigest()
+    chunk_path = get_chunk_path(store_dir, digest)
+    if path.exists(chunk_path):
+        return digest, False
+    os.makedirs(path.dirname(chunk_path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.' + digest[:8] + '-', dir=path.dirname(chunk_path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(chunk)
+    os.replace(tmp, chunk_path)
+    return digest, True
+
+
+def load_recipe(recipe_path):
+    try:
+        with open(recipe_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def matches_recipe(recipe, file_path, st):
+    """ Whether file_path has recipe's content: same size and mtime, or else the same hash. """
+    if recipe['size'] != st.st_size:
+        return False
+    # whole seconds, some rsync versions don't copy the rest
+    if recipe['mtime'] // 10 ** 9 == int(st.st_mtime):
+        return True
+    return recipe['hash'] == manifest.hash_file(file_path)
+
+
+def chunk_file(file_path, store_dir, stats=None, previous_recipe=None):
+    """
+    Moves file_path's content into the chunk store and replaces it with a
+    recipe. A file with the same content as the previous snapshot's
+    previous_recipe reuses its chunks without being chunked again.
+    """
+    st = os.stat(file_path)
+    previous = load_recipe(previous_recipe) if previous_recipe is not None else None
+    if previous is not None and matches_recipe(previous, file_path, st):
+        chunks = previous['chunks']
+        file_hash = previous['hash']
+        new_bytes = 0
+    else:
+        digest = hashlib.sha256()
+        chunks = []
+        new_bytes = 0
+        for chunk in iter_chunks(file_path):
+            digest.update(chunk)
+            chunk_hash, new = store_chunk(store_dir, chunk)
+            chunks.append([chunk_hash, len(chunk)])
+            if new:
+                new_bytes += len(chunk)
+        file_hash = digest.hexdigest()
+    recipe = {'size': st.st_size, 'mode': stat.S_IMODE(st.st_mode), 'mtime': st.st_mtime_ns,
+              'hash': file_hash, 'chunks': chunks}
+    manifest.write_atomic(file_path + RECIPE_SUFFIX, lambda f: json.dump(recipe, f))
+    os.remove(file_path)
+    if stats is not None:
+        stats.add(st.st_size, new_bytes, len(chunks))
+    return recipe
+
+
+def read_chunk(store_dir, digest):
+    with open(get_chunk_path(store_dir, digest), 'rb') as f:
+        return f.read()
+
+
+def assemble_file(recipe_path, dest, store_dir):
+    """ Writes the file recipe_path describes to dest, checking its hash. """
+    with open(recipe_path, 'r') as f:
+        recipe = json.load(f)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(prefix='.' + path.basename(dest) + '-', dir=path.dirname(dest))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk_hash, _ in recipe['chunks']:
+                chunk = read_chunk(store_dir, chunk_hash)
+                digest.update(chunk)
+                out.write(chunk)
+        if digest.hexdigest() != recipe['hash']:
+            raise ValueError('Chunks of ' + recipe_path + ' are corrupt')
+        os.chmod(tmp, recipe['mode'])
+        os.utime(tmp, ns=(recipe['mtime'], recipe['mtime']))
+        os.replace(tmp, dest)
+    except BaseException:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return recipe
+
+
+def is_chunked(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def chunk_paths(paths, patterns, store_dir, stats=None, snapshot_dir=None, previous_dir=None):
+    """
+    Chunks the files below paths that match patterns and are big enough.
+    Files unchanged since previous_dir, the snapshot before snapshot_dir,
+    reuse its recipes.
+    """
+    chunked = []
+    for root in paths:
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                file_path = path.join(dirpath, name)
+                if not is_chunked(name, patterns) or path.islink(file_path):
+                    continue
+                if os.path.getsize(file_path) < MIN_FILE_SIZE:
+                    continue
+                previous_recipe = None
+                if previous_dir is not None:
+                    previous_recipe = path.join(previous_dir, path.relpath(file_path, snapshot_dir)) + RECIPE_SUFFIX
+                chunk_file(file_path, store_dir, stats, previous_recipe)
+                chunked.append(file_path)
+    return chunked
+
+
+def chunk_tasks(tasks, get_paths, get_patterns, store_dir):
+    """ Wrap (name, func) backup tasks so the module's chunked_files are chunked into store_dir after it ran. """
+    return [(name, chunk_task(name, func, get_paths, get_patterns, store_dir)) for name, func in tasks]
+
+
+def chunk_task(name, func, get_paths, get_patterns, store_dir):
+    def run():
+        func()
+        patterns = get_patterns(name)
+        if patterns:
+            chunked = chunk_paths(get_paths(name), patterns, store_dir, _stats,
+                                  config.get_macprefs_dir(), config.get_previous_snapshot_dir())
+            log.debug('Chunked %s files of %s', len(chunked), name)
+    return run
+
+
+def format_stats(stats):
+    return 'Chunked {} files ({} bytes in {} chunks), {} bytes new, {} bytes saved by dedup'.format(
+        stats.files, stats.bytes, stats.chunks, stats.new_bytes, stats.saved_bytes)
+
+
+def has_recipes(paths):
+    for root in paths:
+        for _, _, filenames in os.walk(root):
+            if any(name.endswith(RECIPE_SUFFIX) for name in filenames):
+                return True
+    return False
+
+
+def assemble_recipes(root, store_dir):
+    """ Replaces every recipe below root with the file it describes. """
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(RECIPE_SUFFIX):
+                recipe_path = path.join(dirpath, name)
+                assemble_file(recipe_path, recipe_path[:-len(RECIPE_SUFFIX)], store_dir)
+                os.remove(recipe_path)
+
+
+def materialize(snapshot_dir, dest_dir, paths, store_dir):
+    """
+    Rebuilds paths (below snapshot_dir) and the snapshot's root files in
+    dest_dir with every recipe assembled back into its file. Other files are
+    hard linked when possible.
+    """
+    for name in os.listdir(snapshot_dir):
+        src = path.join(snapshot_dir, name)
+        if name.startswith(manifest.METADATA_PREFIX) and path.isdir(src):
+            shutil.copytree(src, path.join(dest_dir, name), symlinks=True, dirs_exist_ok=True)
+        elif path.isfile(src):
+            link_or_copy(src, path.join(dest_dir, name))
+    for root in paths:
+        root = root.rstrip('/')
+        if not path.exists(root):
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            target_dir = path.join(dest_dir, path.relpath(dirpath, snapshot_dir))
+            os.makedirs(target_dir, exist_ok=True)
+            shutil.copystat(dirpath, target_dir)
+            for name in filenames + [d for d in dirnames if path.islink(path.join(dirpath, d))]:
+                src = path.join(dirpath, name)
+                if name.endswith(RECIPE_SUFFIX):
+                    assemble_file(src, path.join(target_dir, name[:-len(RECIPE_SUFFIX)]), store_dir)
+                elif path.islink(src):
+                    os.symlink(os.readlink(src), path.join(target_dir, name))
+                else:
+                    link_or_copy(src, path.join(target_dir, name))
+
+
+def link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
@@ -1,13 +1,11 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
+from config import get_backup_subdir, get_home_dir, get_user, ensure_exists
 from utils import copy_dir, ensure_dir_owned_by_user
 
 
 def get_cloud_credentials_backup_dir():
-    return_val = join(get_macprefs_dir(), 'cloud_credentials/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('cloud_credentials/')
 
 
 def backup():
@@ -80,3 +78,22 @@ def restore():
         log.debug('Restored .docker/')
     else:
         log.debug('No .docker/ backup found... skipping.')
+
+
+def get_backup_sources():
+    home_dir = get_home_dir()
+    dest = get_cloud_credentials_backup_dir()
+    return [
+        (join(home_dir, '.aws/'), join(dest, 'aws/')),
+        (join(home_dir, '.kube/'), join(dest, 'kube/')),
+        (join(home_dir, '.docker/'), join(dest, 'docker/')),
+    ]
+
+
+def get_backup_paths():
+    return [get_cloud_credentials_backup_dir()]
+
+
+def get_restore_paths():
+    home_dir = get_home_dir()
+    return [join(home_dir, '.aws/'), join(home_dir, '.kube/'), join(home_dir, '.docker/')]
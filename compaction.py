@@ -0,0 +1,117 @@
+"""
+Packs old snapshots into per-module archives, used by `macprefs compact`.
+
+A compacted snapshot has the same layout as one made with `backup
+--archive`: archives/<module>.mpa next to the root files. Restores read it
+the same way and `macprefs show` reads a single file out of it, so any old
+snapshot can still be restored with a fraction of the files Dropbox has to
+index. The packed copy is built next to the snapshot and swapped in with
+renames, so an interrupted compaction leaves the snapshot as it was.
+"""
+from datetime import date, timedelta
+from os import path
+import json
+import logging as log
+import os
+import re
+import shutil
+import archive
+import chunks
+import config
+import manifest
+import objects
+import snapshots
+from registry import get_module, preference_choices
+
+AGE_UNITS = {'d': 1, 'w': 7}
+
+
+def parse_age(value):
+    """ '30d' or '4w' as a timedelta. """
+    match = re.match(r'^\s*(\d+)\s*([dw])\s*$', value)
+    if match is None:
+        raise ValueError('Invalid age: ' + value + ', use days (30d) or weeks (4w)')
+    return timedelta(days=int(match.group(1)) * AGE_UNITS[match.group(2)])
+
+
+def is_packed(snapshot_dir):
+    return archive.is_archive_snapshot(snapshot_dir) or objects.is_object_snapshot(snapshot_dir)
+
+
+def find_old_snapshots(machine_dir, older_than, today=None):
+    """ Loose snapshots of machine_dir older than the timedelta older_than, never the newest one. """
+    today = today or date.today()
+    all_snapshots = snapshots.list_snapshots(machine_dir)
+    return [s for s in all_snapshots[:-1]
+            if date.fromisoformat(path.basename(s)) <= today - older_than and not is_packed(s)]
+
+
+def get_module_paths(snapshot_dir):
+    """ (name, backup paths) of every module, resolved inside snapshot_dir without creating them. """
+    context = config.get_context()
+    config.set_context(config.BackupContext(snapshot_dir, None, None, create=False))
+    try:
+        return [(name, [p for p in get_module(name).get_backup_paths() if path.exists(p)])
+                for name in preference_choices]
+    finally:
+        config.set_context(context)
+
+
+def compact_snapshot(snapshot_dir, codec, jobs=1):
+    """ Replaces a loose snapshot with its archives, returns (files before, files after). """
+    snapshot_dir = path.normpath(snapshot_dir)
+    parent, name = path.split(snapshot_dir)
+    packed_dir = path.join(parent, '.' + name + '.compacting')
+    old_dir = path.join(parent, '.' + name + '.loose')
+    for leftover in [packed_dir, old_dir]:
+        if path.exists(leftover):
+            shutil.rmtree(leftover)
+    files_before = count_files(snapshot_dir)
+    os.makedirs(packed_dir)
+    modules = [(module, paths) for module, paths in get_module_paths(snapshot_dir) if paths]
+    archive.pack_snapshot(snapshot_dir, packed_dir, modules, codec, jobs)
+    os.rename(snapshot_dir, old_dir)
+    os.rename(packed_dir, snapshot_dir)
+    shutil.rmtree(old_dir)
+    log.debug('Compacted %s', snapshot_dir)
+    return files_before, count_files(snapshot_dir)
+
+
+def count_files(root):
+    return sum(len(filenames) for _, _, filenames in os.walk(root))
+
+
+def read_file(snapshot_dir, rel_path):
+    """
+    The content of one backed up file (relative to the snapshot) from a
+    loose, chunked, archived, compacted or object store snapshot, None when
+    the snapshot doesn't have it.
+    """
+    data = read_stored(snapshot_dir, rel_path)
+    if data is not None:
+        return data
+    recipe = read_stored(snapshot_dir, rel_path + chunks.RECIPE_SUFFIX)
+    if recipe is None:
+        return None
+    store_dir = snapshots.get_chunk_store_dir(snapshot_dir)
+    return b''.join(chunks.read_chunk(store_dir, chunk_hash) for chunk_hash, _ in json.loads(recipe)['chunks'])
+
+
+def read_stored(snapshot_dir, rel_path):
+    """ One file as it's stored in the snapshot, recipes aren't assembled. """
+    file_path = path.join(snapshot_dir, rel_path)
+    if path.isfile(file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+    if objects.is_object_snapshot(snapshot_dir):
+        entry = manifest.load_manifest(snapshot_dir).get(rel_path)
+        if entry is None or 'target' in entry:
+            return None
+        with open(objects.get_object_path(objects.get_store_dir(snapshot_dir), entry['hash']), 'rb') as f:
+            return f.read()
+    if archive.is_archive_snapshot(snapshot_dir):
+        for archive_path in archive.list_archives(snapshot_dir):
+            data = archive.read_entry(archive_path, rel_path)
+            if data is not None:
+                return data
+    return None
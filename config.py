@@ -1,44 +1,122 @@
 from os import environ, makedirs, path, getenv
 import getpass
 import socket
+import threading
 from datetime import datetime
-
-
-def get_macprefs_dir():
-    backup_dir = ''
+import snapshots
+
+
+class BackupContext:
+    """
+    Where a run backs up to, resolved once so every module sees the same
+    machine name and date even when the run crosses midnight. Backup
+    directories are created the first time they're asked for, unless create
+    is False (--plan, reading existing snapshots).
+    previous_dir is the snapshot unchanged files are hard linked against.
+    """
+    __slots__ = ('backup_dir', 'machine_name', 'date', 'previous_dir', 'create', '_dirs', '_lock')
+
+    def __init__(self, backup_dir, machine_name, date, previous_dir=None, create=True):
+        object.__setattr__(self, 'backup_dir', backup_dir)
+        object.__setattr__(self, 'machine_name', machine_name)
+        object.__setattr__(self, 'date', date)
+        object.__setattr__(self, 'previous_dir', previous_dir)
+        object.__setattr__(self, 'create', create)
+        object.__setattr__(self, '_dirs', {})
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BackupContext is immutable')
+
+    @classmethod
+    def resolve(cls, with_previous=True):
+        """ The context of this run, previous_dir is only looked up with_previous. """
+        backup_dir, machine_name, today = resolve_backup_dir()
+        return cls(backup_dir, machine_name, today, snapshots.find_previous(backup_dir) if with_previous else None)
+
+    def get_dir(self, relative=''):
+        """ The backup dir joined with relative, created on first use. """
+        with self._lock:
+            if relative not in self._dirs:
+                dir_path = path.join(self.backup_dir, relative) if relative else self.backup_dir
+                if self.create:
+                    ensure_exists(dir_path)
+                self._dirs[relative] = dir_path
+            return self._dirs[relative]
+
+
+def resolve_backup_dir():
+    # Get machine name (hostname without domain)
+    machine_name = socket.gethostname().split('.')[0]
+    today = datetime.now().strftime('%Y-%m-%d')
     if 'MACPREFS_BACKUP_DIR' in environ:
         backup_dir = environ['MACPREFS_BACKUP_DIR']
+        if '://' in backup_dir:
+            # an object store URL (see remote.py) names the Backup root, like the Dropbox folder
+            backup_dir = '/'.join([backup_dir.rstrip('/'), machine_name, today])
     else:
-        # Get machine name (hostname without domain)
-        machine_name = socket.gethostname().split('.')[0]
         # Add machine name and date to backup path for automatic versioning
-        today = datetime.now().strftime('%Y-%m-%d')
         backup_dir = path.join(get_home_dir(), 'Dropbox', 'Configuration', 'Backup', machine_name, today)
+    return backup_dir, machine_name, today
+
+
+_context = None
+
+
+def set_context(context):
+    """ Makes every get_*_backup_dir() use context, None goes back to resolving on each call. """
+    global _context
+    _context = context
+
+
+def get_context():
+    return _context
+
+
+def get_backup_location():
+    """ The snapshot this run backs up to or restores from, a folder or a URL, without creating it. """
+    if _context is not None:
+        return _context.backup_dir
+    return resolve_backup_dir()[0]
+
+
+def get_macprefs_dir():
+    if _context is not None:
+        return _context.get_dir()
+    backup_dir = resolve_backup_dir()[0]
     ensure_exists(backup_dir)
     return backup_dir
 
 
+def get_previous_snapshot_dir():
+    if _context is not None:
+        return _context.previous_dir
+    return snapshots.find_previous(resolve_backup_dir()[0])
+
+
+def get_backup_subdir(relative):
+    if _context is not None:
+        return _context.get_dir(relative)
+    return_val = path.join(get_macprefs_dir(), relative)
+    ensure_exists(return_val)
+    return return_val
+
+
 def get_preferences_dir():
     return_val = path.join(get_home_dir(), 'Library/Preferences/')
     return return_val
 
 
 def get_preferences_backup_dir():
-    return_val = path.join(get_macprefs_dir(), 'preferences/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('preferences/')
 
 
 def get_sys_preferences_backup_dir():
-    return_val = path.join(get_macprefs_dir(), 'system_preferences/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('system_preferences/')
 
 
 def get_shared_file_lists_backup_dir():
-    return_val = path.join(get_macprefs_dir(), 'shared_file_lists/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('shared_file_lists/')
 
 
 def get_shared_file_lists_dir():
@@ -46,9 +124,7 @@ def get_shared_file_lists_dir():
 
 
 def get_dotfiles_backup_dir():
-    return_val = path.join(get_macprefs_dir(), 'dotfiles/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('dotfiles/')
 
 
 def get_dotfile_excludes():
@@ -59,15 +135,28 @@ def get_home_dir():
     return getenv('HOME') + '/'
 
 
+def get_cache_dir():
+    cache_dir = getenv('MACPREFS_CACHE_DIR') or path.join(get_home_dir(), 'Library/Caches/macprefs/')
+    ensure_exists(cache_dir)
+    return cache_dir
+
+
+def get_probe_cache_path():
+    return path.join(get_cache_dir(), 'probe-cache.json')
+
+
+def get_hash_cache_path():
+    return path.join(get_cache_dir(), 'hash-cache.json')
+
+
 def ensure_exists(input_dir):
     if not path.exists(input_dir):
-        makedirs(input_dir)
+        # exist_ok guards against modules creating the same dir concurrently
+        makedirs(input_dir, exist_ok=True)
 
 
 def get_ssh_backup_dir():
-    return_val = path.join(get_macprefs_dir(), 'ssh/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('ssh/')
 
 
 def get_ssh_user_dir():
@@ -84,10 +173,7 @@ def get_internet_accounts_dir():
 
 
 def get_internet_accounts_backup_dir():
-    return_val = path.join(
-        get_macprefs_dir(), 'Accounts/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('Accounts/')
 
 
 def get_user_launch_agents_dir():
@@ -95,10 +181,7 @@ def get_user_launch_agents_dir():
 
 
 def get_user_launch_agents_backup_dir():
-    return_val = path.join(
-        get_macprefs_dir(), 'StartupItems/LaunchAgents/User/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('StartupItems/LaunchAgents/User/')
 
 
 def get_system_launch_agents_dir():
@@ -106,10 +189,7 @@ def get_system_launch_agents_dir():
 
 
 def get_system_launch_agents_backup_dir():
-    return_val = path.join(
-        get_macprefs_dir(), 'StartupItems/LaunchAgents/AllUsers/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('StartupItems/LaunchAgents/AllUsers/')
 
 
 def get_system_launch_daemons_dir():
@@ -117,10 +197,7 @@ def get_system_launch_daemons_dir():
 
 
 def get_system_launch_daemons_backup_dir():
-    return_val = path.join(
-        get_macprefs_dir(), 'StartupItems/LaunchDaemons/AllUsers/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('StartupItems/LaunchDaemons/AllUsers/')
 
 
 def get_app_store_preferences_dir():
@@ -129,6 +206,4 @@ def get_app_store_preferences_dir():
 
 
 def get_app_store_preferences_backup_dir():
-    return_val = path.join(get_macprefs_dir(), 'app_store_preferences/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('app_store_preferences/')
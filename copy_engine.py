@@ -0,0 +1,270 @@
+"""
+In-process replacement for `rsync -a` used by utils.copy_dir/copy_file/copy_files
+when MACPREFS_COPY_ENGINE=python (or --copy-engine python) is set.
+
+Files are skipped when the destination has the same size and mtime (rsync's
+quick check), otherwise the data is copied with copy_file_range/sendfile on
+Linux (fcopyfile on macOS, through shutil.copyfile) into a temp file that is
+renamed into place.
+Modes, timestamps and extended attributes are preserved. Directory copies
+skip what the running module's filters.Matcher excludes.
+Given a link_dest (like rsync --link-dest), files that are unchanged there
+are hard linked instead of copied.
+"""
+from os import path
+import errno
+import logging as log
+import os
+import shutil
+import stat
+import sys
+import filters
+import manifest
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class CopyStats:
+    def __init__(self):
+        self.copied = 0
+        self.skipped = 0
+        self.linked = 0
+        self.bytes = 0
+
+
+def copy_dir(src, dest, matcher=None, link_dest=None):
+    """ Same semantics as `rsync -a src dest`: a trailing slash on src copies its contents. """
+    if matcher is None:
+        matcher = filters.get_matcher()
+    stats = CopyStats()
+    if not src.endswith('/'):
+        dest = path.join(dest, path.basename(src))
+        if link_dest is not None:
+            link_dest = path.join(link_dest, path.basename(src))
+    copy_tree(src.rstrip('/') or '/', dest, matcher, stats, link_dest)
+    return stats
+
+
+def copy_files(files, dest, link_dest=None):
+    stats = CopyStats()
+    os.makedirs(dest, exist_ok=True)
+    for fle in files:
+        name = path.basename(fle)
+        link = path.join(link_dest, name) if link_dest is not None else None
+        copy_entry(fle, path.join(dest, name), os.lstat(fle), None, stats, link)
+    return stats
+
+
+def copy_file(fle, dest, link_dest=None):
+    link = None
+    if path.isdir(dest) or dest.endswith('/'):
+        dest = path.join(dest, path.basename(fle))
+        if link_dest is not None:
+            link = path.join(link_dest, path.basename(fle))
+    stats = CopyStats()
+    copy_entry(fle, dest, os.lstat(fle), None, stats, link)
+    return stats
+
+
+def copy_tree(src, dest, matcher, stats, link=None):
+    src_st = os.lstat(src)
+    if not stat.S_ISDIR(src_st.st_mode):
+        copy_entry(src, dest, src_st, matcher, stats, link)
+        return
+    os.makedirs(dest, exist_ok=True)
+    with os.scandir(src) as it:
+        entries = list(it)
+    for entry in entries:
+        entry_st = entry.stat(follow_symlinks=False)
+        if matcher is not None and matcher.is_excluded(entry.path, entry_st):
+            continue
+        entry_link = path.join(link, entry.name) if link is not None else None
+        copy_entry(entry.path, path.join(dest, entry.name), entry_st, matcher, stats, entry_link)
+    # directory metadata last, copying the children changes its mtime
+    copy_metadata(src, dest, src_st)
+
+
+def copy_entry(src, dest, src_st, matcher, stats, link=None):
+    """ link is where dest was in the previous snapshot, if anywhere. """
+    mode = src_st.st_mode
+    if stat.S_ISDIR(mode):
+        copy_tree(src, dest, matcher, stats, link)
+    elif stat.S_ISLNK(mode):
+        copy_symlink(src, dest, src_st, stats)
+    elif stat.S_ISREG(mode):
+        if is_up_to_date(src_st, dest):
+            stats.skipped += 1
+            return
+        if link is not None and link_unchanged(src, src_st, link, dest):
+            stats.linked += 1
+            return
+        copy_regular_file(src, dest, src_st)
+        stats.copied += 1
+        stats.bytes += src_st.st_size
+    else:
+        # sockets, fifos and devices can't be copied
+        log.debug('Skipping special file %s', src)
+
+
+def is_up_to_date(src_st, dest):
+    try:
+        dest_st = os.lstat(dest)
+    except OSError:
+        return False
+    return stat.S_ISREG(dest_st.st_mode) and dest_st.st_size == src_st.st_size and \
+        int(dest_st.st_mtime) == int(src_st.st_mtime)
+
+
+def link_unchanged(src, src_st, link, dest):
+    """
+    Hard link dest to link when link has src's size, mtime and mode, like
+    rsync --link-dest. When only the mtime differs the contents are compared
+    by hash (cached, see manifest.py) so touched files aren't copied again.
+    """
+    try:
+        link_st = os.lstat(link)
+    except OSError:
+        return False
+    if not stat.S_ISREG(link_st.st_mode) or link_st.st_size != src_st.st_size or \
+            stat.S_IMODE(link_st.st_mode) != stat.S_IMODE(src_st.st_mode):
+        return False
+    if int(link_st.st_mtime) != int(src_st.st_mtime) and not manifest.same_content(src, src_st, link, link_st):
+        return False
+    tmp = path.join(path.dirname(dest), '.' + path.basename(dest) + '.macprefs-tmp')
+    try:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        os.link(link, tmp)
+        os.replace(tmp, dest)
+    except OSError as e:
+        # other file system, too many links, ...
+        log.debug('Could not link %s to %s: %s', dest, link, str(e))
+        if path.lexists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def copy_regular_file(src, dest, src_st):
+    dest_dir = path.dirname(dest)
+    tmp = path.join(dest_dir, '.' + path.basename(dest) + '.macprefs-tmp')
+    try:
+        copy_data(src, tmp)
+        copy_metadata(src, tmp, src_st)
+        os.replace(tmp, dest)
+    except BaseException:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def copy_data(src, dest):
+    if not sys.platform.startswith('linux'):
+        # shutil.copyfile uses fcopyfile (and APFS clones) on macOS
+        shutil.copyfile(src, dest, follow_symlinks=False)
+        return
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        infd = fsrc.fileno()
+        outfd = fdst.fileno()
+        try:
+            copy_with(os.copy_file_range, infd, outfd)
+            return
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            reset(fsrc, fdst)
+        try:
+            copy_with(lambda i, o, n: os.sendfile(o, i, None, n), infd, outfd)
+            return
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+            reset(fsrc, fdst)
+        shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+
+
+def copy_with(func, infd, outfd):
+    while func(infd, outfd, CHUNK_SIZE) > 0:
+        pass
+
+
+def reset(fsrc, fdst):
+    fsrc.seek(0)
+    fdst.seek(0)
+    fdst.truncate()
+
+
+def copy_symlink(src, dest, src_st, stats):
+    target = os.readlink(src)
+    if path.lexists(dest):
+        if path.islink(dest) and os.readlink(dest) == target:
+            stats.skipped += 1
+            return
+        if path.isdir(dest) and not path.islink(dest):
+            shutil.rmtree(dest)
+        else:
+            os.remove(dest)
+    os.symlink(target, dest)
+    if os.utime in os.supports_follow_symlinks:
+        os.utime(dest, ns=(src_st.st_atime_ns, src_st.st_mtime_ns), follow_symlinks=False)
+    stats.copied += 1
+
+
+def copy_metadata(src, dest, src_st):
+    copy_xattrs(src, dest)
+    if os.geteuid() == 0:
+        os.chown(dest, src_st.st_uid, src_st.st_gid)
+    os.chmod(dest, stat.S_IMODE(src_st.st_mode))
+    os.utime(dest, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+
+
+def copy_xattrs(src, dest):
+    try:
+        for name in list_xattrs(src):
+            set_xattr(dest, name, get_xattr(src, name))
+    except OSError as e:
+        if e.errno not in (errno.ENOTSUP, errno.EOPNOTSUPP, errno.EPERM, errno.EACCES):
+            raise
+        log.debug('Could not copy extended attributes of %s: %s', src, str(e))
+
+
+if hasattr(os, 'listxattr'):
+    def list_xattrs(file_path):
+        return os.listxattr(file_path)
+
+    def get_xattr(file_path, name):
+        return os.getxattr(file_path, name)
+
+    def set_xattr(file_path, name, value):
+        os.setxattr(file_path, name, value)
+else:
+    # macOS doesn't expose xattrs through the os module, call libc directly
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    def _check(result):
+        if result < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return result
+
+    def list_xattrs(file_path):
+        raw = os.fsencode(file_path)
+        size = _check(_libc.listxattr(raw, None, 0, 0))
+        if size == 0:
+            return []
+        buf = ctypes.create_string_buffer(size)
+        size = _check(_libc.listxattr(raw, buf, size, 0))
+        return [os.fsdecode(name) for name in buf.raw[:size].split(b'\0') if name]
+
+    def get_xattr(file_path, name):
+        raw = os.fsencode(file_path)
+        raw_name = os.fsencode(name)
+        size = _check(_libc.getxattr(raw, raw_name, None, 0, 0, 0))
+        buf = ctypes.create_string_buffer(size)
+        size = _check(_libc.getxattr(raw, raw_name, buf, size, 0, 0))
+        return buf.raw[:size]
+
+    def set_xattr(file_path, name, value):
+        _check(_libc.setxattr(os.fsencode(file_path), os.fsencode(name), value, len(value), 0, 0))
@@ -1,13 +1,11 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
+from config import get_backup_subdir, get_home_dir, get_user, ensure_exists
 from utils import copy_dir, ensure_dir_owned_by_user
 
 
 def get_fonts_backup_dir():
-    return_val = join(get_macprefs_dir(), 'fonts/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('fonts/')
 
 
 def get_user_fonts_dir():
@@ -44,3 +42,15 @@ def restore():
     ensure_dir_owned_by_user(dest, get_user())
     log.debug('Restored fonts to ~/Library/Fonts/')
     log.info('Font cache will be rebuilt automatically by the system.')
+
+
+def get_backup_sources():
+    return [(get_user_fonts_dir(), join(get_fonts_backup_dir(), 'UserFonts/'))]
+
+
+def get_backup_paths():
+    return [get_fonts_backup_dir()]
+
+
+def get_restore_paths():
+    return [get_user_fonts_dir()]
@@ -33,3 +33,17 @@ def get_dot_files(home_dir, excludes=None):
         if f[0] == '.' and path.isfile(full_file_path) and f not in excludes:
             files.append(full_file_path)
     return files
+
+
+def get_backup_sources():
+    dest = get_dotfiles_backup_dir()
+    return [(f, dest) for f in get_dot_files(get_home_dir(), get_dotfile_excludes())]
+
+
+def get_backup_paths():
+    return [get_dotfiles_backup_dir()]
+
+
+def get_restore_paths():
+    home_dir = get_home_dir()
+    return [path.join(home_dir, path.basename(f)) for f in get_dot_files(get_dotfiles_backup_dir())]
@@ -0,0 +1,347 @@
+"""
+Encryption at rest for modules holding secrets (ssh_files, gpg_keys,
+cloud_credentials), turned on per module in the config file:
+
+    [modules.ssh_files]
+    encrypt = true
+
+Copies such a module makes into the backup encrypt every file as it's read
+instead of copying it, and a backup folder holding encrypted files has a
+`.macprefs-encrypted` marker naming the key. Restores decrypt straight into
+the destination. File names, folders and symlinks are kept as they are.
+
+Each file is written as a header followed by CHUNK_SIZE chunks sealed with
+AES-256-GCM under a key derived from the backup key and the header's random
+salt. A chunk's nonce is its index plus a flag on the last one, and the
+header is authenticated with every chunk, so reordered, truncated or
+modified files fail to decrypt. Chunks are encrypted and decrypted on a
+thread pool with a bounded number in flight, so large files are spread
+over the cores without being held in memory.
+
+The header also keeps the plaintext's size, mtime and mode, so a file that
+didn't change is hard linked to the previous snapshot's copy instead of
+being encrypted again.
+
+The key is 32 random bytes in ~/.config/macprefs/backup.key (or the file
+MACPREFS_KEY_FILE points to), created by the first encrypted backup. It's
+never written to the backup, keep a copy of it somewhere else.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from os import environ, path
+import base64
+import hashlib
+import hmac
+import json
+import logging as log
+import os
+import stat
+import struct
+import tempfile
+import threading
+import copy_engine
+import filters
+
+MARKER_NAME = '.macprefs-encrypted'
+MAGIC = b'MPENC1\n\0'
+# salt, chunk size, plaintext size, mtime_ns, mode
+HEADER = struct.Struct('>8s16sIQqI')
+CHUNK_SIZE = 1024 * 1024
+TAG_SIZE = 16
+KEY_SIZE = 32
+WORKERS = os.cpu_count() or 1
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_aesgcm():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise ImportError('Encrypted backups need the cryptography package (pip install cryptography)')
+    return AESGCM
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='macprefs-crypt')
+        return _executor
+
+
+def is_enabled(name):
+    """ Whether module `name` encrypts its backup. """
+    return name is not None and bool(filters.get_module_config(name).get('encrypt', False))
+
+
+def is_encrypted(backup_dir):
+    return path.isfile(path.join(backup_dir, MARKER_NAME))
+
+
+def get_key_path():
+    return environ.get('MACPREFS_KEY_FILE') or path.join(environ.get('HOME', '/'), '.config/macprefs/backup.key')
+
+
+def load_key(create=False):
+    key_path = get_key_path()
+    if not path.exists(key_path):
+        if not create:
+            raise ValueError('The backup is encrypted but there is no key in ' + key_path)
+        os.makedirs(path.dirname(key_path), exist_ok=True)
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(base64.b64encode(os.urandom(KEY_SIZE)).decode('ascii') + '\n')
+        log.warning('Created the backup key %s, keep a copy of it outside the backup, '
+                    'encrypted modules can\'t be restored without it', key_path)
+    with open(key_path, 'r') as f:
+        key = base64.b64decode(f.read().strip())
+    if len(key) != KEY_SIZE:
+        raise ValueError(key_path + ' is not a macprefs backup key')
+    return key
+
+
+def get_key_id(key):
+    """ Names the key in markers without giving it away. """
+    return hmac.new(key, b'macprefs key id', hashlib.sha256).hexdigest()[:16]
+
+
+def derive_file_key(key, salt):
+    """ HKDF-SHA256 (RFC 5869) of one 32 byte key. """
+    prk = hmac.new(salt, key, hashlib.sha256).digest()
+    return hmac.new(prk, b'macprefs file key\x01', hashlib.sha256).digest()
+
+
+def get_nonce(index, last):
+    return index.to_bytes(11, 'big') + (b'\x01' if last else b'\x00')
+
+
+def read_header(file_path):
+    """ (header bytes, fields) of an encrypted file, None when it isn't one. """
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(data) != HEADER.size or not data.startswith(MAGIC):
+        return None
+    _, salt, chunk_size, size, mtime_ns, mode = HEADER.unpack(data)
+    return data, {'salt': salt, 'chunk_size': chunk_size, 'size': size, 'mtime_ns': mtime_ns, 'mode': mode}
+
+
+def matches(file_path, st):
+    """ Whether the encrypted file_path holds the content of a file with lstat result st. """
+    header = read_header(file_path)
+    if header is None:
+        return False
+    fields = header[1]
+    return fields['size'] == st.st_size and fields['mtime_ns'] == st.st_mtime_ns and \
+        fields['mode'] == stat.S_IMODE(st.st_mode)
+
+
+def iter_blocks(f, size):
+    while True:
+        data = f.read(size)
+        if not data:
+            return
+        yield data
+
+
+def run_pipeline(blocks, work, write):
+    """
+    Applies work(index, block) to the blocks on the thread pool and writes
+    the results in order, with at most twice the pool's size in flight.
+    work gets whether a block is the last one, so the next block is read first.
+    """
+    executor = get_executor()
+    window = 2 * WORKERS
+    pending = deque()
+    index = 0
+    blocks = iter(blocks)
+    block = next(blocks, None)
+    while block is not None:
+        next_block = next(blocks, None)
+        pending.append(executor.submit(work, index, block, next_block is None))
+        index += 1
+        block = next_block
+        if len(pending) >= window:
+            write(pending.popleft().result())
+    while pending:
+        write(pending.popleft().result())
+    return index
+
+
+def encrypt_file(src, dest, key, src_st, chunk_size=CHUNK_SIZE):
+    """ Writes src encrypted to dest, through a temp file renamed into place. """
+    aesgcm = get_aesgcm()
+    salt = os.urandom(16)
+    header = HEADER.pack(MAGIC, salt, chunk_size, src_st.st_size, src_st.st_mtime_ns, stat.S_IMODE(src_st.st_mode))
+    cipher = aesgcm(derive_file_key(key, salt))
+
+    def seal(index, block, last):
+        return cipher.encrypt(get_nonce(index, last), block, header)
+
+    fd, tmp = tempfile.mkstemp(prefix='.' + path.basename(dest) + '-', dir=path.dirname(dest))
+    try:
+        with os.fdopen(fd, 'wb') as out, open(src, 'rb') as f:
+            out.write(header)
+            if not run_pipeline(iter_blocks(f, chunk_size), seal, out.write):
+                # an empty file is one empty last chunk, so it can't be truncated either
+                out.write(seal(0, b'', True))
+        os.chmod(tmp, stat.S_IMODE(src_st.st_mode))
+        os.utime(tmp, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+        os.replace(tmp, dest)
+    except BaseException:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def decrypt_file(src, dest, key):
+    """ Writes the plaintext of the encrypted src to dest, with its mode and mtime. """
+    aesgcm = get_aesgcm()
+    header = read_header(src)
+    if header is None:
+        raise ValueError(src + ' is not an encrypted macprefs file')
+    header, fields = header
+    cipher = aesgcm(derive_file_key(key, fields['salt']))
+
+    def open_block(index, block, last):
+        try:
+            return cipher.decrypt(get_nonce(index, last), block, header)
+        except Exception:
+            raise ValueError(src + ' is corrupt, truncated or was encrypted with another key')
+
+    fd, tmp = tempfile.mkstemp(prefix='.' + path.basename(dest) + '-', dir=path.dirname(dest))
+    try:
+        with os.fdopen(fd, 'wb') as out, open(src, 'rb') as f:
+            f.seek(HEADER.size)
+            if not run_pipeline(iter_blocks(f, fields['chunk_size'] + TAG_SIZE), open_block, out.write):
+                raise ValueError(src + ' is truncated')
+            if out.tell() != fields['size']:
+                raise ValueError(src + ' is truncated')
+        os.chmod(tmp, fields['mode'])
+        os.utime(tmp, ns=(fields['mtime_ns'], fields['mtime_ns']))
+        os.replace(tmp, dest)
+    except BaseException:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_marker(backup_dir, key):
+    marker_path = path.join(backup_dir, MARKER_NAME)
+    with open(marker_path, 'w') as f:
+        json.dump({'cipher': 'AES-256-GCM', 'chunk_size': CHUNK_SIZE, 'key': get_key_id(key)}, f)
+    os.chmod(marker_path, 0o600)
+
+
+def check_key(backup_dir, key):
+    with open(path.join(backup_dir, MARKER_NAME), 'r') as f:
+        key_id = json.load(f).get('key')
+    if key_id != get_key_id(key):
+        raise ValueError(backup_dir + ' was encrypted with another key than ' + get_key_path())
+
+
+def resolve_dest(src, dest, link_dest):
+    """ rsync semantics: without a trailing slash src itself is copied into dest. """
+    if src.endswith('/'):
+        return dest, link_dest
+    name = path.basename(src)
+    return path.join(dest, name), path.join(link_dest, name) if link_dest is not None else None
+
+
+def encrypt_dir(src, dest, matcher=None, link_dest=None):
+    """
+    Like copy_engine.copy_dir, but every file is encrypted into dest.
+    Files unchanged since the last copy are skipped, or hard linked to
+    their copy in link_dest (the previous snapshot).
+    """
+    if matcher is None:
+        matcher = filters.get_matcher()
+    key = load_key(create=True)
+    stats = copy_engine.CopyStats()
+    dest, link_dest = resolve_dest(src, dest, link_dest)
+    os.makedirs(dest, exist_ok=True)
+    write_marker(dest, key)
+    walk(src.rstrip('/') or '/', dest, matcher, lambda src_path, dest_path, st, link:
+         encrypt_entry(src_path, dest_path, st, link, key, stats), link_dest)
+    return stats
+
+
+def encrypt_entry(src, dest, st, link, key, stats):
+    if matches(dest, st):
+        stats.skipped += 1
+        return
+    if link is not None and matches(link, st):
+        if path.lexists(dest):
+            os.remove(dest)
+        os.link(link, dest)
+        stats.linked += 1
+        return
+    encrypt_file(src, dest, key, st)
+    stats.copied += 1
+    stats.bytes += st.st_size
+
+
+def decrypt_dir(src, dest, matcher=None):
+    """ Restores the encrypted backup folder src into dest, with copy_dir's semantics. """
+    if matcher is None:
+        matcher = filters.get_matcher()
+    root = src.rstrip('/') or '/'
+    key = load_key()
+    check_key(root, key)
+    stats = copy_engine.CopyStats()
+    dest, _ = resolve_dest(src, dest, None)
+    os.makedirs(dest, exist_ok=True)
+    walk(root, dest, matcher, lambda src_path, dest_path, st, link:
+         decrypt_entry(src_path, dest_path, key, stats))
+    return stats
+
+
+def decrypt_entry(src, dest, key, stats):
+    header = read_header(src)
+    if header is None:
+        raise ValueError(src + ' is not an encrypted macprefs file')
+    fields = header[1]
+    try:
+        dest_st = os.lstat(dest)
+        if stat.S_ISREG(dest_st.st_mode) and dest_st.st_size == fields['size'] and \
+                dest_st.st_mtime_ns == fields['mtime_ns']:
+            stats.skipped += 1
+            return
+    except OSError:
+        pass
+    decrypt_file(src, dest, key)
+    stats.copied += 1
+    stats.bytes += fields['size']
+
+
+def walk(src, dest, matcher, copy_file, link=None):
+    """ Mirrors the folders and symlinks of src in dest, calling copy_file for regular files. """
+    src_st = os.lstat(src)
+    with os.scandir(src) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.name == MARKER_NAME:
+            continue
+        entry_st = entry.stat(follow_symlinks=False)
+        if matcher is not None and matcher.is_excluded(entry.path, entry_st):
+            continue
+        entry_dest = path.join(dest, entry.name)
+        entry_link = path.join(link, entry.name) if link is not None else None
+        if stat.S_ISDIR(entry_st.st_mode):
+            os.makedirs(entry_dest, exist_ok=True)
+            walk(entry.path, entry_dest, matcher, copy_file, entry_link)
+        elif stat.S_ISLNK(entry_st.st_mode):
+            if path.lexists(entry_dest):
+                os.remove(entry_dest)
+            os.symlink(os.readlink(entry.path), entry_dest)
+        elif stat.S_ISREG(entry_st.st_mode):
+            copy_file(entry.path, entry_dest, entry_st, entry_link)
+        else:
+            log.debug('Skipping special file %s', entry.path)
+    # directory metadata last, writing the children changes its mtime
+    os.chmod(dest, stat.S_IMODE(src_st.st_mode))
+    os.utime(dest, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
@@ -1,13 +1,20 @@
 from os.path import exists, join, isfile
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
-from utils import copy_file, copy_dir, ensure_files_owned_by_user, ensure_dir_owned_by_user
+from config import get_backup_subdir, get_home_dir, get_user, ensure_exists
+from utils import queue_copy, flush_copies, copy_dir, ensure_files_owned_by_user, ensure_dir_owned_by_user
+from filters import get_includes
+
+CONFIG_FILES = ['.aliases', '.exports', '.env', '.functions', '.path', '.extra']
+IMPORTANT_CONFIGS = ['direnv', 'gh', 'starship.toml', 'bat', 'htop']
 
 
 def get_env_configs_backup_dir():
-    return_val = join(get_macprefs_dir(), 'env_configs/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('env_configs/')
+
+
+def get_important_configs():
+    """ Entries of ~/.config, [modules.env_configs] include = [...] in the config file overrides them. """
+    return get_includes('env_configs', IMPORTANT_CONFIGS)
 
 
 def backup():
@@ -16,19 +23,12 @@ def backup():
     dest = get_env_configs_backup_dir()
 
     # List of individual config files to backup
-    config_files = [
-        '.aliases',
-        '.exports',
-        '.env',
-        '.functions',
-        '.path',
-        '.extra',
-    ]
+    config_files = CONFIG_FILES
 
     for config_file in config_files:
         file_path = join(home_dir, config_file)
         if exists(file_path) and isfile(file_path):
-            copy_file(file_path, dest)
+            queue_copy(file_path, dest)
             log.debug('Backed up %s', config_file)
 
     # Backup .config directory (selective)
@@ -38,13 +38,13 @@ def backup():
         ensure_exists(config_backup_dir)
 
         # Backup important directories from .config
-        important_configs = ['direnv', 'gh', 'starship.toml', 'bat', 'htop']
+        important_configs = get_important_configs()
 
         for config_name in important_configs:
             config_path = join(config_dir, config_name)
             if exists(config_path):
                 if isfile(config_path):
-                    copy_file(config_path, config_backup_dir)
+                    queue_copy(config_path, config_backup_dir)
                     log.debug('Backed up .config/%s', config_name)
                 else:
                     config_dest = join(config_backup_dir, config_name + '/')
@@ -60,19 +60,12 @@ def restore():
     files_to_fix = []
 
     # List of individual config files to restore
-    config_files = [
-        '.aliases',
-        '.exports',
-        '.env',
-        '.functions',
-        '.path',
-        '.extra',
-    ]
+    config_files = CONFIG_FILES
 
     for config_file in config_files:
         file_source = join(source, config_file)
         if exists(file_source):
-            copy_file(file_source, home_dir)
+            queue_copy(file_source, home_dir)
             files_to_fix.append(join(home_dir, config_file))
             log.debug('Restored %s', config_file)
 
@@ -83,13 +76,13 @@ def restore():
         ensure_exists(config_dest_dir)
 
         # Restore backed up configs
-        important_configs = ['direnv', 'gh', 'starship.toml', 'bat', 'htop']
+        important_configs = get_important_configs()
 
         for config_name in important_configs:
             config_source = join(config_backup_dir, config_name)
             if exists(config_source):
                 if isfile(config_source):
-                    copy_file(config_source, config_dest_dir)
+                    queue_copy(config_source, config_dest_dir)
                     files_to_fix.append(join(config_dest_dir, config_name))
                     log.debug('Restored .config/%s', config_name)
                 else:
@@ -100,4 +93,33 @@ def restore():
 
     # Fix ownership of files
     if files_to_fix:
+        flush_copies()
         ensure_files_owned_by_user(get_user(), files_to_fix)
+
+
+def get_backup_sources():
+    home_dir = get_home_dir()
+    dest = get_env_configs_backup_dir()
+    config_files = CONFIG_FILES
+    important_configs = get_important_configs()
+    sources = [(join(home_dir, f), dest) for f in config_files]
+    config_backup_dir = join(dest, 'config/')
+    for config_name in important_configs:
+        config_path = join(home_dir, '.config/', config_name)
+        if isfile(config_path):
+            sources.append((config_path, config_backup_dir))
+        else:
+            sources.append((config_path + '/', join(config_backup_dir, config_name + '/')))
+    return sources
+
+
+def get_backup_paths():
+    return [get_env_configs_backup_dir()]
+
+
+def get_restore_paths():
+    home_dir = get_home_dir()
+    config_files = CONFIG_FILES
+    important_configs = get_important_configs()
+    return [join(home_dir, f) for f in config_files] + \
+        [join(home_dir, '.config/', f) for f in important_configs]
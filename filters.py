@@ -0,0 +1,216 @@
+"""
+Include/exclude rules from the user's config file, ~/.config/macprefs/config.toml
+(or $MACPREFS_CONFIG):
+
+    [defaults]
+    exclude = ["*.sock", "*.socket", ".DS_Store"]
+    max_size = "200MB"
+
+    [modules.vscode_settings]
+    exclude = ["History", "*.vsix"]
+
+    [modules.env_configs]
+    include = ["direnv", "gh", "starship.toml", "nvim"]
+
+Patterns without a slash match file and directory names. Patterns with one
+match the path relative to the home folder, or the absolute path when they
+start with /. As with rsync, `*` and `?` don't match a slash and `**` matches
+anything. `include` replaces the built-in list of what a module picks
+(env_configs, jetbrains_settings). Module rules are added to the defaults
+and compiled once into a Matcher, which every copy and the backup planner
+use for the module that's running. The rules only apply to backups: restores
+run outside of filter_tasks and copy everything the snapshot has.
+"""
+from os import environ, path
+import os
+import re
+import stat
+import threading
+
+# rsync can't copy sockets
+DEFAULT_EXCLUDES = ['*.sock', '*.socket']
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2,
+              'G': 1024 ** 3, 'GB': 1024 ** 3}
+
+_current = threading.local()
+_lock = threading.Lock()
+_config = None
+_matchers = {}
+
+
+class Matcher:
+    """ Compiled exclude patterns and size limit of one module. """
+
+    def __init__(self, excludes=None, max_size=None, home_dir=None):
+        if home_dir is None:
+            home_dir = environ.get('HOME', '/')
+        self.excludes = list(DEFAULT_EXCLUDES if excludes is None else excludes)
+        self.max_size = max_size
+        name_patterns = [p.rstrip('/') for p in self.excludes if '/' not in p.rstrip('/')]
+        self.path_patterns = [path.join(home_dir, p.rstrip('/')) for p in self.excludes
+                              if '/' in p.rstrip('/')]
+        self.name_regex = compile_patterns(name_patterns)
+        self.path_regex = compile_patterns(self.path_patterns)
+
+    def is_excluded(self, file_path, st=None):
+        """ st is the entry's lstat result, needed for the size limit. """
+        file_path = file_path.rstrip('/')
+        if self.name_regex is not None and self.name_regex.match(path.basename(file_path)):
+            return True
+        if self.path_regex is not None and self.path_regex.match(file_path):
+            return True
+        if self.max_size is not None:
+            if st is None:
+                try:
+                    st = os.lstat(file_path)
+                except OSError:
+                    return False
+            return stat.S_ISREG(st.st_mode) and st.st_size > self.max_size
+        return False
+
+    def filter_files(self, files):
+        return [fle for fle in files if not self.is_excluded(fle)]
+
+    def rsync_args(self, src):
+        """ The same rules as rsync arguments for copying src. """
+        args = ['--exclude=' + p for p in self.excludes if '/' not in p.rstrip('/')]
+        root = path.normpath(src)
+        # rsync anchors patterns at the transfer root, which includes src's name without a trailing slash
+        anchor = '/' if src.endswith('/') else '/' + path.basename(root) + '/'
+        for pattern in self.path_patterns:
+            if pattern.startswith(root + '/'):
+                args.append('--exclude=' + anchor + pattern[len(root) + 1:])
+        if self.max_size is not None:
+            args.append('--max-size=' + str(self.max_size))
+        return args
+
+
+def compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:' + translate(p) + ')' for p in patterns))
+
+
+def translate(pattern):
+    """ Like fnmatch.translate, but * and ? stop at slashes and ** doesn't, as in rsync. """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+            continue
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '[':
+            # a ] right after [ or [! is part of the set
+            j = i + 1 if pattern[i:i + 1] == '!' else i
+            end = pattern.find(']', j + 1 if pattern[j:j + 1] == ']' else j)
+            if end == -1:
+                parts.append(re.escape(c))
+                continue
+            body = pattern[i:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            elif body.startswith('^'):
+                body = '\\' + body
+            parts.append('[' + body + ']')
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+    return '(?s:' + ''.join(parts) + r')\Z'
+
+
+def parse_size(value):
+    if value is None or isinstance(value, int):
+        return value
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*$', str(value))
+    if match is None or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError('Invalid size: ' + str(value))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def get_config_path():
+    return environ.get('MACPREFS_CONFIG') or path.join(environ.get('HOME', '/'), '.config/macprefs/config.toml')
+
+
+def load_config(config_path):
+    if not path.exists(config_path):
+        return {}
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ImportError('Reading ' + config_path + ' needs Python 3.11 or the tomli package (pip install tomli)')
+    with open(config_path, 'rb') as f:
+        return tomllib.load(f)
+
+
+def get_config():
+    global _config
+    if _config is None:
+        _config = load_config(get_config_path())
+    return _config
+
+
+def set_config(config):
+    """ Replaces the loaded config file, None reloads it on next use. """
+    global _config
+    with _lock:
+        _config = config
+        _matchers.clear()
+
+
+def get_module_config(name):
+    return get_config().get('modules', {}).get(name, {})
+
+
+def get_current_name():
+    """ The module running on this thread, None outside of filter_tasks. """
+    return getattr(_current, 'name', None)
+
+
+def get_matcher(name=None):
+    """
+    The matcher of module `name`, or of the module running on this thread.
+    Outside of a module (restores) only sockets are excluded.
+    """
+    if name is None:
+        name = get_current_name()
+    with _lock:
+        if name is None and name not in _matchers:
+            _matchers[name] = Matcher()
+        elif name not in _matchers:
+            defaults = get_config().get('defaults', {})
+            module = get_module_config(name)
+            excludes = defaults.get('exclude', DEFAULT_EXCLUDES) + module.get('exclude', [])
+            max_size = parse_size(module.get('max_size', defaults.get('max_size')))
+            _matchers[name] = Matcher(excludes, max_size)
+        return _matchers[name]
+
+
+def get_includes(name, default):
+    """ The names module `name` picks, `default` unless the config file lists them. """
+    return list(get_module_config(name).get('include', default))
+
+
+def filter_tasks(tasks):
+    """ Wrap (name, func) tasks so copies made while they run use the module's rules. """
+    return [(name, filter_task(name, func)) for name, func in tasks]
+
+
+def filter_task(name, func):
+    def run():
+        previous = getattr(_current, 'name', None)
+        _current.name = name
+        try:
+            func()
+        finally:
+            _current.name = previous
+    return run
@@ -1,13 +1,11 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
-from utils import copy_file, ensure_files_owned_by_user
+from config import get_backup_subdir, get_home_dir, get_user
+from utils import queue_copy, flush_copies, ensure_files_owned_by_user
 
 
 def get_git_config_backup_dir():
-    return_val = join(get_macprefs_dir(), 'git_config/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('git_config/')
 
 
 def backup():
@@ -18,7 +16,7 @@ def backup():
     # Backup .gitconfig
     gitconfig = join(home_dir, '.gitconfig')
     if exists(gitconfig):
-        copy_file(gitconfig, dest)
+        queue_copy(gitconfig, dest)
         log.debug('Backed up .gitconfig')
     else:
         log.info('No .gitconfig found... skipping.')
@@ -26,13 +24,13 @@ def backup():
     # Backup .gitconfig.local if exists
     gitconfig_local = join(home_dir, '.gitconfig.local')
     if exists(gitconfig_local):
-        copy_file(gitconfig_local, dest)
+        queue_copy(gitconfig_local, dest)
         log.debug('Backed up .gitconfig.local')
 
     # Backup .gitignore_global if exists
     gitignore_global = join(home_dir, '.gitignore_global')
     if exists(gitignore_global):
-        copy_file(gitignore_global, dest)
+        queue_copy(gitignore_global, dest)
         log.debug('Backed up .gitignore_global')
 
 
@@ -45,7 +43,7 @@ def restore():
     # Restore .gitconfig
     gitconfig = join(source, '.gitconfig')
     if exists(gitconfig):
-        copy_file(gitconfig, dest)
+        queue_copy(gitconfig, dest)
         files_to_restore.append(join(dest, '.gitconfig'))
         log.debug('Restored .gitconfig')
     else:
@@ -54,17 +52,33 @@ def restore():
     # Restore .gitconfig.local if exists
     gitconfig_local = join(source, '.gitconfig.local')
     if exists(gitconfig_local):
-        copy_file(gitconfig_local, dest)
+        queue_copy(gitconfig_local, dest)
         files_to_restore.append(join(dest, '.gitconfig.local'))
         log.debug('Restored .gitconfig.local')
 
     # Restore .gitignore_global if exists
     gitignore_global = join(source, '.gitignore_global')
     if exists(gitignore_global):
-        copy_file(gitignore_global, dest)
+        queue_copy(gitignore_global, dest)
         files_to_restore.append(join(dest, '.gitignore_global'))
         log.debug('Restored .gitignore_global')
 
     # Ensure proper ownership
     if files_to_restore:
+        flush_copies()
         ensure_files_owned_by_user(get_user(), files_to_restore)
+
+
+def get_backup_sources():
+    home_dir = get_home_dir()
+    dest = get_git_config_backup_dir()
+    return [(join(home_dir, f), dest) for f in ['.gitconfig', '.gitconfig.local', '.gitignore_global']]
+
+
+def get_backup_paths():
+    return [get_git_config_backup_dir()]
+
+
+def get_restore_paths():
+    home_dir = get_home_dir()
+    return [join(home_dir, f) for f in ['.gitconfig', '.gitconfig.local', '.gitignore_global']]
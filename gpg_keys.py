@@ -1,13 +1,11 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
+from config import get_backup_subdir, get_home_dir, get_user
 from utils import copy_dir, ensure_dir_owned_by_user
 
 
 def get_gpg_backup_dir():
-    return_val = join(get_macprefs_dir(), 'gnupg/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('gnupg/')
 
 
 def backup():
@@ -29,3 +27,15 @@ def restore():
     dest = join(get_home_dir(), '.gnupg/')
     copy_dir(source, dest, with_sudo=True)
     ensure_dir_owned_by_user(dest, get_user(), mode='700')
+
+
+def get_backup_sources():
+    return [(join(get_home_dir(), '.gnupg/'), get_gpg_backup_dir())]
+
+
+def get_backup_paths():
+    return [get_gpg_backup_dir()]
+
+
+def get_restore_paths():
+    return [join(get_home_dir(), '.gnupg/')]
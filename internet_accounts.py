@@ -2,6 +2,9 @@ import logging as log
 from utils import copy_dir, ensure_dir_owned_by_user
 import config
 
+# the Accounts SQLite databases change a little with every account change
+chunked_files = ['*.sqlite', '*.sqlite-wal']
+
 
 def backup():
     log.info('Backing up internet accounts db files...')
@@ -24,3 +27,15 @@ def restore_internet_accounts():
     dest = config.get_internet_accounts_dir()
     copy_dir(source, dest, with_sudo=True)
     ensure_dir_owned_by_user(dest, config.get_user())
+
+
+def get_backup_sources():
+    return [(config.get_internet_accounts_dir(), config.get_internet_accounts_backup_dir())]
+
+
+def get_backup_paths():
+    return [config.get_internet_accounts_backup_dir()]
+
+
+def get_restore_paths():
+    return [config.get_internet_accounts_dir()]
@@ -2,14 +2,20 @@ from os import listdir
 from os.path import exists, join, isdir
 import logging as log
 import re
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
+from config import get_backup_subdir, get_home_dir, get_user, ensure_exists
 from utils import copy_dir, ensure_dir_owned_by_user
+from filters import get_includes
+
+IMPORTANT_DIRS = ['keymaps', 'colors', 'codestyles', 'fileTemplates', 'templates', 'options', 'tools']
 
 
 def get_jetbrains_backup_dir():
-    return_val = join(get_macprefs_dir(), 'jetbrains/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('jetbrains/')
+
+
+def get_important_dirs():
+    """ Settings folders of each IDE, [modules.jetbrains_settings] include = [...] in the config file overrides them. """
+    return get_includes('jetbrains_settings', IMPORTANT_DIRS)
 
 
 def get_jetbrains_base_dir():
@@ -33,8 +39,7 @@ def has_settings(ide_path):
     Check if an IDE directory has actual settings (not empty/newly created).
     Returns True if any of the important settings directories exist.
     """
-    important_dirs = ['keymaps', 'colors', 'codestyles', 'fileTemplates', 'templates', 'options', 'tools']
-    for subdir in important_dirs:
+    for subdir in get_important_dirs():
         if exists(join(ide_path, subdir)):
             return True
     return False
@@ -101,15 +106,7 @@ def backup():
         ensure_exists(ide_backup_path)
 
         # Backup important subdirectories for each IDE
-        important_dirs = [
-            'keymaps',
-            'colors',
-            'codestyles',
-            'fileTemplates',
-            'templates',
-            'options',
-            'tools',
-        ]
+        important_dirs = get_important_dirs()
 
         backed_up = False
         for subdir in important_dirs:
@@ -163,3 +160,25 @@ def restore():
             log.debug('Restored %s/%s', ide_dir, subdir)
 
         log.info('Restored settings for %s', ide_dir)
+
+
+def get_backup_sources():
+    base_dir = get_jetbrains_base_dir()
+    if not exists(base_dir):
+        return []
+    dest = get_jetbrains_backup_dir()
+    all_ide_dirs = [d for d in listdir(base_dir) if isdir(join(base_dir, d))]
+    important_dirs = get_important_dirs()
+    sources = []
+    for ide_dir in get_latest_ide_versions(base_dir, all_ide_dirs):
+        for subdir in important_dirs:
+            sources.append((join(base_dir, ide_dir, subdir + '/'), join(dest, ide_dir, subdir + '/')))
+    return sources
+
+
+def get_backup_paths():
+    return [get_jetbrains_backup_dir()]
+
+
+def get_restore_paths():
+    return [get_jetbrains_base_dir()]
@@ -0,0 +1,71 @@
+from os import path, remove, fsync
+from datetime import datetime
+import json
+import logging as log
+import threading
+
+_lock = threading.Lock()
+
+
+def get_journal_path(backup_dir):
+    return path.join(backup_dir, '.macprefs-journal.jsonl')
+
+
+def reset(journal_path):
+    if path.exists(journal_path):
+        remove(journal_path)
+
+
+def load_completed(journal_path):
+    """ Returns the modules whose latest journal entry finished successfully. """
+    outcomes = {}
+    if not path.exists(journal_path):
+        return set()
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line may be cut off if the run died while writing it
+                log.debug('Ignoring corrupt journal line: %s', line.strip())
+                continue
+            outcomes[entry['module']] = entry['status']
+    return set(name for name, status in outcomes.items() if status == 'ok')
+
+
+def record(journal_path, name, status, error=None):
+    entry = {'module': name, 'status': status, 'finished': datetime.now().isoformat()}
+    if error is not None:
+        entry['error'] = error
+    with _lock:
+        with open(journal_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            fsync(f.fileno())
+
+
+def skip_completed(tasks, journal_path):
+    completed = load_completed(journal_path)
+    remaining = []
+    for name, func in tasks:
+        if name in completed:
+            log.info('Skipping %s (already backed up in this snapshot)', name)
+        else:
+            remaining.append((name, func))
+    return remaining
+
+
+def journal_tasks(tasks, journal_path):
+    """ Wrap (name, func) tasks so the outcome of every run is appended to the journal. """
+    return [(name, journal_task(name, func, journal_path)) for name, func in tasks]
+
+
+def journal_task(name, func, journal_path):
+    def run():
+        try:
+            func()
+        except Exception as e:
+            record(journal_path, name, 'failed', str(e))
+            raise
+        record(journal_path, name, 'ok')
+    return run
@@ -0,0 +1,204 @@
+"""
+Per-snapshot manifest of every backed up file, and the persistent hash
+cache that keeps it cheap.
+
+The manifest, .macprefs-manifest.jsonl in the snapshot, has one line per
+file with its path (relative to the snapshot), size, mtime, inode, mode and
+content hash (and target, for symlinks). Hashes come from a cache keyed by device and inode and
+checked against size and mtime, like git's index, so files hard linked
+from the previous snapshot or otherwise unchanged are never read again.
+Before a backup the cache is seeded from the previous snapshot's manifest,
+so a lost or expired cache doesn't mean reading every file again.
+"""
+from os import path
+import hashlib
+import json
+import logging as log
+import os
+import stat
+import tempfile
+import threading
+import time
+import config
+
+MANIFEST_NAME = '.macprefs-manifest.jsonl'
+# journal, recorded modes, manifest... are about the snapshot, not part of it
+METADATA_PREFIX = '.macprefs-'
+CHUNK_SIZE = 1024 * 1024
+# cache entries not used for this long are dropped when the cache is saved
+CACHE_EXPIRY = 30 * 24 * 60 * 60
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class HashCache:
+    """ Content hashes keyed by 'dev:inode', valid while size and mtime match. """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.entries = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_hash(self, file_path, st=None):
+        if st is None:
+            st = os.stat(file_path)
+        key = '{}:{}'.format(st.st_dev, st.st_ino)
+        with self.lock:
+            entry = self.load().get(key)
+            if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                entry[3] = int(time.time())
+                self.hits += 1
+                return entry[2]
+        digest = hash_file(file_path)
+        with self.lock:
+            self.entries[key] = [st.st_size, st.st_mtime_ns, digest, int(time.time())]
+            self.misses += 1
+        return digest
+
+    def seed(self, snapshot_dir):
+        """ Adds the hashes in snapshot_dir's manifest for the inodes the cache doesn't have. """
+        entries = load_manifest(snapshot_dir)
+        if not entries:
+            return 0
+        dev = os.stat(snapshot_dir).st_dev
+        now = int(time.time())
+        added = 0
+        with self.lock:
+            cached = self.load()
+            for entry in entries.values():
+                key = '{}:{}'.format(dev, entry['inode'])
+                if 'target' not in entry and key not in cached:
+                    cached[key] = [entry['size'], entry['mtime'], entry['hash'], now]
+                    added += 1
+        return added
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.cache_path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        with self.lock:
+            entries = self.load()
+            oldest = time.time() - CACHE_EXPIRY
+            for key in [k for k, entry in entries.items() if entry[3] < oldest]:
+                del entries[key]
+            write_atomic(self.cache_path, lambda f: json.dump(entries, f))
+
+
+def get_hash_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HashCache(config.get_hash_cache_path())
+        return _cache
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_content(first, first_st, second, second_st):
+    """ Whether two files of the same size have the same bytes, using the hash cache. """
+    if first_st.st_size != second_st.st_size:
+        return False
+    cache = get_hash_cache()
+    return cache.get_hash(first, first_st) == cache.get_hash(second, second_st)
+
+
+def build_manifest(snapshot_dir, cache):
+    """ Manifest entries of every file in snapshot_dir, sorted by path. """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(snapshot_dir):
+        if dirpath == snapshot_dir:
+            dirnames[:] = [d for d in dirnames if not d.startswith(METADATA_PREFIX)]
+            filenames = [f for f in filenames if not f.startswith(METADATA_PREFIX)]
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = path.join(dirpath, filename)
+            st = os.lstat(file_path)
+            if stat.S_ISREG(st.st_mode):
+                digest = cache.get_hash(file_path, st)
+            elif stat.S_ISLNK(st.st_mode):
+                target = os.readlink(file_path)
+                digest = hashlib.sha256(os.fsencode(target)).hexdigest()
+            else:
+                continue
+            entry = {
+                'path': path.relpath(file_path, snapshot_dir),
+                'size': st.st_size,
+                'mtime': st.st_mtime_ns,
+                'inode': st.st_ino,
+                'mode': stat.S_IMODE(st.st_mode),
+                'hash': digest,
+            }
+            if stat.S_ISLNK(st.st_mode):
+                entry['target'] = target
+            entries.append(entry)
+    return entries
+
+
+def write_manifest(snapshot_dir, cache=None):
+    if cache is None:
+        cache = get_hash_cache()
+    entries = build_manifest(snapshot_dir, cache)
+
+    def write(f):
+        for entry in entries:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+    manifest_path = path.join(snapshot_dir, MANIFEST_NAME)
+    write_atomic(manifest_path, write)
+    cache.save()
+    log.debug('Wrote manifest of %s files to %s (%s hashes cached, %s read)',
+              len(entries), manifest_path, cache.hits, cache.misses)
+    return entries
+
+
+def merge_manifest(snapshot_dir, other_dir, prefixes):
+    """ Adds the entries of other_dir's manifest below prefixes that snapshot_dir's manifest doesn't have. """
+    entries = load_manifest(snapshot_dir)
+    for rel_path, entry in load_manifest(other_dir).items():
+        if rel_path not in entries and any(rel_path.startswith(prefix + '/') for prefix in prefixes):
+            entries[rel_path] = entry
+
+    def write(f):
+        for rel_path in sorted(entries):
+            f.write(json.dumps(entries[rel_path], sort_keys=True) + '\n')
+    write_atomic(path.join(snapshot_dir, MANIFEST_NAME), write)
+
+
+def load_manifest(snapshot_dir):
+    """ Manifest entries of a snapshot keyed by path, empty when it has none. """
+    manifest_path = path.join(snapshot_dir, MANIFEST_NAME)
+    entries = {}
+    if not path.exists(manifest_path):
+        return entries
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry['path']] = entry
+    return entries
+
+
+def write_atomic(file_path, write):
+    fd, tmp = tempfile.mkstemp(prefix='.' + path.basename(file_path) + '-', dir=path.dirname(file_path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+        os.replace(tmp, file_path)
+    except BaseException:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        raise
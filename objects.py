@@ -0,0 +1,195 @@
+"""
+Content-addressed object store shared by every machine under the Backup
+root (Backup/objects/), used by `backup --objects`.
+
+Modules back up into the local staging mirror as with archives. Every file
+in it is then stored once as objects/<hash[:2]>/<hash>, the SHA-256 the
+manifest already records, and the snapshot only keeps the manifest and the
+small files at its root. Files identical across machines (fonts, code
+styles, Alfred workflows, most dotfiles) are stored once for the whole
+fleet. Restores copy the selected modules' files out of the store into a
+temp dir and restore from there.
+
+Objects are never touched once stored, a synced folder would upload them
+again. Prune instead records in objects/.macprefs-unused.json when it first
+found an object no snapshot uses, and only deletes it once that and the
+object itself are older than GRACE_PERIOD: a backup that reused it may have
+a manifest that hasn't synced yet. Backups store objects listed there
+again, so one reused after being found unused gets a new grace period.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+import logging as log
+import os
+import shutil
+import tempfile
+import threading
+import time
+import json
+import archive
+import manifest
+import snapshots
+
+OBJECTS_DIR = 'objects'
+# marks a snapshot whose files are in the object store
+MARKER_NAME = '.macprefs-objects'
+# unused objects are only deleted once they're this old, another machine's
+# manifest listing them may still be syncing
+GRACE_PERIOD = 7 * 24 * 60 * 60
+# hash -> when prune first found the object unused
+UNUSED_NAME = '.macprefs-unused.json'
+
+
+class StoreStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.new_files = 0
+        self.new_bytes = 0
+
+    def add(self, size, new):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            if new:
+                self.new_files += 1
+                self.new_bytes += size
+
+
+def get_store_dir(snapshot_dir):
+    """ Backup/objects for dated snapshots, a folder inside snapshot_dir otherwise. """
+    backup_root = snapshots.get_backup_root(snapshot_dir)
+    if backup_root is None:
+        return path.join(snapshot_dir, '.macprefs-' + OBJECTS_DIR)
+    return path.join(backup_root, OBJECTS_DIR)
+
+
+def get_object_path(store_dir, digest):
+    return path.join(store_dir, digest[:2], digest)
+
+
+def put_object(store_dir, src, digest, replace=False):
+    """
+    Copies src into the store unless an object with its hash is there (or
+    replace), returns whether it was new.
+    """
+    object_path = get_object_path(store_dir, digest)
+    exists = path.exists(object_path)
+    if exists and not replace:
+        return False
+    os.makedirs(path.dirname(object_path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.' + digest[:8] + '-', dir=path.dirname(object_path))
+    try:
+        with os.fdopen(fd, 'wb') as out, open(src, 'rb') as f:
+            shutil.copyfileobj(f, out, manifest.CHUNK_SIZE)
+        os.replace(tmp, object_path)
+    except BaseException:
+        if path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return not exists
+
+
+def is_object_snapshot(snapshot_dir):
+    return path.exists(path.join(snapshot_dir, MARKER_NAME))
+
+
+def store_snapshot(staging_dir, snapshot_dir, store_dir, jobs=1):
+    """
+    Stores the files of staging_dir's manifest in the object store and
+    writes the snapshot: the manifest, the root files and the marker.
+    """
+    entries = manifest.load_manifest(staging_dir)
+    # stored again so prune's grace period starts over for them
+    unused = load_unused(store_dir)
+    stats = StoreStats()
+
+    def store(entry):
+        if 'target' in entry:
+            return
+        new = put_object(store_dir, path.join(staging_dir, entry['path']), entry['hash'], entry['hash'] in unused)
+        stats.add(entry['size'], new)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for _ in executor.map(store, entries.values()):
+            pass
+    copy_root_files(staging_dir, snapshot_dir)
+    with open(path.join(snapshot_dir, MARKER_NAME), 'w') as f:
+        f.write(path.relpath(store_dir, snapshot_dir))
+    log.debug('Stored %s files in %s, %s of them new', stats.files, store_dir, stats.new_files)
+    return stats
+
+
+def copy_root_files(staging_dir, snapshot_dir):
+    """ Copies the files and metadata folders at the root of staging_dir, what a snapshot keeps besides its manifest. """
+    for name in os.listdir(staging_dir):
+        src = path.join(staging_dir, name)
+        if name.startswith(manifest.METADATA_PREFIX) and path.isdir(src):
+            shutil.copytree(src, path.join(snapshot_dir, name), symlinks=True, dirs_exist_ok=True)
+        elif path.isfile(src) and not path.islink(src) and name not in [MARKER_NAME, archive.STAGING_MARKER]:
+            shutil.copy2(src, path.join(snapshot_dir, name))
+
+
+def materialize(snapshot_dir, dest_dir, paths, store_dir):
+    """ Copies the snapshot's files below paths (below snapshot_dir) and its root files into dest_dir. """
+    prefixes = [path.relpath(p.rstrip('/'), snapshot_dir) for p in paths]
+    for name in os.listdir(snapshot_dir):
+        src = path.join(snapshot_dir, name)
+        if name.startswith(manifest.METADATA_PREFIX) and path.isdir(src):
+            shutil.copytree(src, path.join(dest_dir, name), symlinks=True, dirs_exist_ok=True)
+        elif path.isfile(src):
+            shutil.copy2(src, path.join(dest_dir, name))
+    for rel_path, entry in sorted(manifest.load_manifest(snapshot_dir).items()):
+        if not any(rel_path == p or rel_path.startswith(p + '/') for p in prefixes):
+            continue
+        dest = path.join(dest_dir, rel_path)
+        os.makedirs(path.dirname(dest), exist_ok=True)
+        if 'target' in entry:
+            os.symlink(entry['target'], dest)
+            continue
+        # copied rather than linked, restores change the mode of what they're given
+        shutil.copyfile(get_object_path(store_dir, entry['hash']), dest)
+        os.chmod(dest, entry['mode'])
+        os.utime(dest, ns=(entry['mtime'], entry['mtime']))
+
+
+def load_unused(store_dir):
+    try:
+        with open(path.join(store_dir, UNUSED_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_unused(store_dir, unused_since):
+    manifest.write_atomic(path.join(store_dir, UNUSED_NAME), lambda f: json.dump(unused_since, f, sort_keys=True))
+
+
+def get_unused_objects(store_dir, snapshot_dirs, unused_since, grace_period=GRACE_PERIOD):
+    """
+    (object path, bytes) of the objects none of snapshot_dirs' manifests use,
+    found unused and stored more than grace_period seconds ago. unused_since
+    (see load_unused) is updated with the objects found unused now.
+    """
+    if not path.isdir(store_dir):
+        return []
+    used = set()
+    for snapshot_dir in snapshot_dirs:
+        if is_object_snapshot(snapshot_dir):
+            used.update(entry['hash'] for entry in manifest.load_manifest(snapshot_dir).values())
+    now = time.time()
+    oldest = now - grace_period
+    found = set()
+    unused = []
+    for dirpath, _, filenames in os.walk(store_dir):
+        for name in filenames:
+            if name not in used and not name.startswith('.'):
+                found.add(name)
+                since = unused_since.setdefault(name, now)
+                object_path = path.join(dirpath, name)
+                st = os.lstat(object_path)
+                if since < oldest and st.st_mtime < oldest:
+                    unused.append((object_path, st.st_blocks * 512))
+    for name in set(unused_since) - found:
+        del unused_since[name]
+    return unused
@@ -1,50 +1,52 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, get_home_dir, ensure_exists
-from utils import execute_shell, copy_file
+from config import get_backup_subdir, get_home_dir
+from utils import execute_shell, queue_copy, run_commands
 
 
 def get_package_managers_backup_dir():
-    return_val = join(get_macprefs_dir(), 'package_managers/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('package_managers/')
 
 
 def backup():
     log.info('Backing up package manager lists...')
     dest = get_package_managers_backup_dir()
 
+    # brew and npm don't depend on each other, list both at once
+    brewfile_path = join(dest, 'Brewfile')
+    log.debug('Creating Homebrew bundle and listing npm global packages...')
+    brew, npm = run_commands([
+        ['brew', 'bundle', 'dump', '--file=' + brewfile_path, '--force'],
+        ['npm', 'list', '-g', '--depth=0', '--json'],
+    ], timeout=600)
+
     # Backup Homebrew bundle
-    try:
-        log.debug('Creating Homebrew bundle...')
-        brewfile_path = join(dest, 'Brewfile')
-        execute_shell(['brew', 'bundle', 'dump', '--file=' + brewfile_path, '--force'])
+    if brew.ok:
         log.debug('Backed up Homebrew packages to Brewfile')
-    except Exception as e:
-        log.info('Could not backup Homebrew packages (brew may not be installed): %s', str(e))
+    else:
+        log.info('Could not backup Homebrew packages (brew may not be installed): %s', brew.stderr)
 
     # Backup npm global packages
-    try:
-        log.debug('Listing npm global packages...')
-        npm_list = execute_shell(['npm', 'list', '-g', '--depth=0', '--json'], suppress_errors=True)
+    # npm list exits with 1 on peer dependency problems but still prints the list
+    if npm.returncode is not None and npm.stdout:
         npm_file = join(dest, 'npm-global.json')
         with open(npm_file, 'w') as f:
-            f.write(npm_list)
+            f.write(npm.stdout)
         log.debug('Backed up npm global packages')
-    except Exception as e:
-        log.info('Could not backup npm global packages (npm may not be installed): %s', str(e))
+    else:
+        log.info('Could not backup npm global packages (npm may not be installed): %s', npm.stderr)
 
     # Backup asdf .tool-versions if exists
     tool_versions = join(get_home_dir(), '.tool-versions')
     if exists(tool_versions):
-        copy_file(tool_versions, dest)
+        queue_copy(tool_versions, dest)
         log.debug('Backed up .tool-versions')
 
     # Backup other version manager configs
     for config_file in ['.nvmrc', '.node-version', '.python-version', '.ruby-version']:
         config_path = join(get_home_dir(), config_file)
         if exists(config_path):
-            copy_file(config_path, dest)
+            queue_copy(config_path, dest)
             log.debug('Backed up %s', config_file)
 
 
@@ -58,7 +60,7 @@ def restore():
         try:
             log.info('Installing Homebrew packages from Brewfile...')
             log.info('This may take a while...')
-            execute_shell(['brew', 'bundle', '--file=' + brewfile])
+            execute_shell(['brew', 'bundle', '--file=' + brewfile], stream=True, keep_output=False)
             log.debug('Restored Homebrew packages')
         except Exception as e:
             log.warning('Could not restore Homebrew packages: %s', str(e))
@@ -76,7 +78,7 @@ def restore():
     tool_versions_source = join(source, '.tool-versions')
     if exists(tool_versions_source):
         tool_versions_dest = join(get_home_dir(), '.tool-versions')
-        copy_file(tool_versions_source, get_home_dir())
+        queue_copy(tool_versions_source, get_home_dir())
         log.debug('Restored .tool-versions')
 
     # Restore other version manager configs
@@ -84,5 +86,23 @@ def restore():
     for config_file in ['.nvmrc', '.node-version', '.python-version', '.ruby-version']:
         config_source = join(source, config_file)
         if exists(config_source):
-            copy_file(config_source, home_dir)
+            queue_copy(config_source, home_dir)
             log.debug('Restored %s', config_file)
+
+
+def get_backup_sources():
+    # Brewfile and npm-global.json are generated, only the version files are copied
+    home_dir = get_home_dir()
+    dest = get_package_managers_backup_dir()
+    config_files = ['.tool-versions', '.nvmrc', '.node-version', '.python-version', '.ruby-version']
+    return [(join(home_dir, f), dest) for f in config_files]
+
+
+def get_backup_paths():
+    return [get_package_managers_backup_dir()]
+
+
+def get_restore_paths():
+    home_dir = get_home_dir()
+    config_files = ['.tool-versions', '.nvmrc', '.node-version', '.python-version', '.ruby-version']
+    return [join(home_dir, f) for f in config_files]
@@ -0,0 +1,159 @@
+"""
+Records file modes at backup time and reapplies them, together with the
+owner, in a single privileged pass on restore.
+
+Backups write one `.macprefs-modes/<module>.json` per module to the backup
+dir, mapping paths relative to it to their modes. Dropbox doesn't keep most
+permission bits, so these records are the source of truth on restore.
+
+Run as `sudo python3 permissions.py <plan.json>` by utils.ensure_*_owned_by_user.
+"""
+from os import path
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+
+MODES_DIR = '.macprefs-modes'
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def record_modes(backup_dir, name, paths):
+    modes = {}
+    for root in paths:
+        for entry_path in walk(root):
+            st = os.lstat(entry_path)
+            if not stat.S_ISLNK(st.st_mode):
+                modes[path.relpath(entry_path, backup_dir)] = stat.S_IMODE(st.st_mode)
+    modes_dir = path.join(backup_dir, MODES_DIR)
+    os.makedirs(modes_dir, exist_ok=True)
+    with open(path.join(modes_dir, name + '.json'), 'w') as f:
+        json.dump(modes, f, indent=0, sort_keys=True)
+
+
+def record_tasks(tasks, backup_dir, get_paths):
+    """ Wrap (name, func) backup tasks so the modes of each module's backup are recorded. """
+    return [(name, record_task(name, func, backup_dir, get_paths)) for name, func in tasks]
+
+
+def record_task(name, func, backup_dir, get_paths):
+    def run():
+        func()
+        record_modes(backup_dir, name, get_paths(name))
+    return run
+
+
+def load_modes(backup_dir):
+    """ Returns the recorded modes of every module keyed by absolute backup path. """
+    with _cache_lock:
+        if backup_dir in _cache:
+            return _cache[backup_dir]
+        modes = {}
+        modes_dir = path.join(backup_dir, MODES_DIR)
+        if path.isdir(modes_dir):
+            for fle in sorted(os.listdir(modes_dir)):
+                if not fle.endswith('.json'):
+                    continue
+                with open(path.join(modes_dir, fle), 'r') as f:
+                    for rel_path, mode in json.load(f).items():
+                        modes[path.normpath(path.join(backup_dir, rel_path))] = mode
+        _cache[backup_dir] = modes
+        return modes
+
+
+def walk(root):
+    """ Yields root and everything below it without following symlinks. """
+    root = root.rstrip('/') or '/'
+    if not path.lexists(root):
+        return
+    yield root
+    if not path.isdir(root) or path.islink(root):
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            yield path.join(dirpath, name)
+
+
+def get_dir_entries(dest, source, modes, fallback_mode):
+    """
+    (path, mode) pairs for everything a copy of `source` wrote into `dest`, or
+    for all of `dest` when the source isn't known. Recorded modes win over
+    the fallback, which is only used for entries that weren't recorded.
+    """
+    entries = []
+    if source is None:
+        for dest_path in walk(dest):
+            entries.append((dest_path, default_mode(dest_path, fallback_mode)))
+        return entries
+    source = source.rstrip('/') or '/'
+    for src_path in walk(source):
+        dest_path = path.join(dest, path.relpath(src_path, source)) if src_path != source else dest
+        mode = modes.get(path.normpath(src_path))
+        if mode is None:
+            mode = default_mode(src_path, fallback_mode)
+        entries.append((path.normpath(dest_path), mode))
+    return entries
+
+
+def get_file_entries(files, sources, modes, fallback_mode):
+    entries = []
+    for fle in files:
+        mode = None
+        source = sources.get(path.normpath(fle))
+        if source is not None:
+            mode = modes.get(path.normpath(source))
+        if mode is None:
+            mode = int(str(fallback_mode), 8)
+        entries.append((fle, mode))
+    return entries
+
+
+def default_mode(entry_path, fallback_mode):
+    mode = int(str(fallback_mode), 8)
+    if path.isdir(entry_path) and not path.islink(entry_path):
+        # directories have to stay listable (chmod a+X)
+        mode |= 0o111
+    return mode
+
+
+def write_plan(owner, entries):
+    with tempfile.NamedTemporaryFile('w', prefix='macprefs-permissions-', suffix='.json', delete=False) as f:
+        json.dump({'owner': owner, 'entries': entries}, f)
+        return f.name
+
+
+def get_fix_command(plan_path):
+    return ['sudo', sys.executable, path.abspath(__file__), plan_path]
+
+
+def resolve_owner(owner):
+    import grp
+    import pwd
+    user, _, group = owner.partition(':')
+    uid = pwd.getpwnam(user).pw_uid if user else -1
+    gid = grp.getgrnam(group).gr_gid if group else -1
+    return uid, gid
+
+
+def apply_plan(plan_path):
+    """ The privileged side: chown and chmod every entry in one pass. """
+    with open(plan_path, 'r') as f:
+        plan = json.load(f)
+    uid, gid = resolve_owner(plan['owner'])
+    fixed = 0
+    for entry_path, mode in plan['entries']:
+        try:
+            os.lchown(entry_path, uid, gid)
+            if not path.islink(entry_path):
+                os.chmod(entry_path, mode)
+            fixed += 1
+        except FileNotFoundError:
+            continue
+    return fixed
+
+
+if __name__ == '__main__':
+    print('fixed ownership and mode of {} entries'.format(apply_plan(sys.argv[1])))
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os import scandir, lstat, path, cpu_count
+import stat
+import filters
+
+
+class ModulePlan:
+    """ Files and bytes a module would copy, and how many differ from the snapshot. """
+
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.bytes = 0
+        self.changed = 0
+        self.dirs = {}
+
+
+def plan_modules(modules, workers=None):
+    """
+    Size the backup of `modules`, a list of (name, sources) where sources are
+    (source, dest) pairs as returned by a module's get_backup_sources().
+    Directories are walked with scandir from a pool of threads, one directory
+    per job, so large trees are scanned in parallel. Each module's
+    filters.Matcher is applied like the copies apply it.
+    """
+    if workers is None:
+        workers = min(32, (cpu_count() or 1) * 4)
+    plans = []
+    jobs = []
+    for name, sources in modules:
+        plan = ModulePlan(name)
+        plans.append(plan)
+        matcher = filters.get_matcher(name)
+        for source, dest in sources:
+            if path.isdir(source):
+                dir_dest = dest if source.endswith('/') else path.join(dest, path.basename(source))
+                jobs.append((plan, matcher, source.rstrip('/'), dir_dest))
+            elif path.lexists(source) and not matcher.is_excluded(source):
+                add_file(plan, source, lstat(source), path.join(dest, path.basename(source)), source)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {executor.submit(scan_dir, src, dest, matcher): (plan, matcher, src, True)
+                   for plan, matcher, src, dest in jobs}
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                plan, matcher, group, is_top = running.pop(future)
+                files, subdirs = future.result()
+                for src, st, dest in files:
+                    add_file(plan, src, st, dest, group)
+                for src, dest in subdirs:
+                    # sizes are grouped by the top level entries of each source to spot runaway directories
+                    sub_group = src if is_top else group
+                    running[executor.submit(scan_dir, src, dest, matcher)] = (plan, matcher, sub_group, False)
+    return plans
+
+
+def scan_dir(src, dest, matcher=None):
+    files = []
+    subdirs = []
+    try:
+        with scandir(src) as it:
+            for entry in it:
+                entry_dest = path.join(dest, entry.name)
+                entry_st = entry.stat(follow_symlinks=False)
+                if matcher is not None and matcher.is_excluded(entry.path, entry_st):
+                    continue
+                if stat.S_ISDIR(entry_st.st_mode):
+                    subdirs.append((entry.path, entry_dest))
+                elif stat.S_ISREG(entry_st.st_mode) or stat.S_ISLNK(entry_st.st_mode):
+                    files.append((entry.path, entry_st, entry_dest))
+                # sockets, fifos and devices are skipped like copy_dir does
+    except PermissionError:
+        pass
+    return files, subdirs
+
+
+def add_file(plan, src, st, dest, group):
+    if not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+        return
+    plan.files += 1
+    plan.bytes += st.st_size
+    plan.dirs[group] = plan.dirs.get(group, 0) + st.st_size
+    if is_changed(st, dest):
+        plan.changed += 1
+
+
+def is_changed(st, dest):
+    try:
+        dest_st = lstat(dest)
+    except OSError:
+        return True
+    return dest_st.st_size != st.st_size or int(dest_st.st_mtime) != int(st.st_mtime)
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} TB'.format(size)
+
+
+def format_plan(plans, largest=10):
+    lines = ['{:<24}{:>10}{:>12}{:>10}'.format('module', 'files', 'size', 'changed')]
+    for plan in plans:
+        lines.append('{:<24}{:>10}{:>12}{:>10}'.format(
+            plan.name, plan.files, format_size(plan.bytes), plan.changed))
+    lines.append('{:<24}{:>10}{:>12}{:>10}'.format(
+        'total', sum(p.files for p in plans), format_size(sum(p.bytes for p in plans)),
+        sum(p.changed for p in plans)))
+    dirs = [(size, plan.name, group) for plan in plans for group, size in plan.dirs.items()]
+    dirs.sort(reverse=True)
+    if dirs:
+        lines.append('')
+        lines.append('Largest sources:')
+        for size, name, group in dirs[:largest]:
+            lines.append('  {:>10}  {:<24}{}'.format(format_size(size), name, group))
+    return '\n'.join(lines)
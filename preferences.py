@@ -16,3 +16,15 @@ def restore():
     dest = get_preferences_dir()
     copy_dir(source, dest, with_sudo=True)
     ensure_dir_owned_by_user(dest, get_user())
+
+
+def get_backup_sources():
+    return [(get_preferences_dir(), get_preferences_backup_dir())]
+
+
+def get_backup_paths():
+    return [get_preferences_backup_dir()]
+
+
+def get_restore_paths():
+    return [get_preferences_dir()]
@@ -0,0 +1,109 @@
+"""
+On-disk cache for the output of probe commands like `node --version` or
+`code --list-extensions`, used by utils.execute_cached.
+
+Entries are keyed by the command, the resolved path of its binary and the
+inode/mtime/size of that binary and of any watched directories, so
+upgrading a tool or installing an extension invalidates them. Entries also
+expire after a TTL and the least recently used ones are evicted.
+
+Version manager shims (pyenv, rbenv, asdf, mise, volta) run whichever
+version is selected without changing themselves, so their output is never
+cached.
+"""
+from os import path
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+TTL = 7 * 24 * 60 * 60
+MAX_ENTRIES = 256
+SHIM_DIR = 'shims'
+SHIM_BINARIES = ['volta-shim']
+
+
+def fingerprint(command, watch=None):
+    """ Cache key for command, or None when its binary can't be found or is a shim. """
+    binary = shutil.which(command[0])
+    if binary is None:
+        return None
+    binary = path.realpath(binary)
+    if is_shim(binary):
+        return None
+    parts = [list(command), binary, stat_key(binary)]
+    for watched in watch or []:
+        parts.append([watched, stat_key(watched)])
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def is_shim(binary):
+    return path.basename(path.dirname(binary)) == SHIM_DIR or path.basename(binary) in SHIM_BINARIES
+
+
+def stat_key(file_path):
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+
+class ProbeCache:
+    """ Command outputs stored in one JSON file, loaded on first use. """
+
+    def __init__(self, cache_path, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entries = self.load()
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry['created'] > self.ttl:
+                del entries[key]
+                return None
+            entry['used'] = now
+            self.save()
+            return entry['output']
+
+    def put(self, key, output):
+        with self.lock:
+            entries = self.load()
+            now = time.time()
+            entries[key] = {'output': output, 'created': now, 'used': now}
+            if len(entries) > self.max_entries:
+                by_use = sorted(entries, key=lambda k: entries[k]['used'])
+                for old_key in by_use[:len(entries) - self.max_entries]:
+                    del entries[old_key]
+            self.save()
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.cache_path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        cache_dir = path.dirname(self.cache_path)
+        fd, tmp = tempfile.mkstemp(prefix='.probe-cache-', dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.cache_path)
+        except BaseException:
+            if path.lexists(tmp):
+                os.remove(tmp)
+            raise
@@ -0,0 +1,117 @@
+from os import path, walk
+import json
+import logging as log
+import resource
+import sys
+import threading
+import time
+
+_current = threading.local()
+
+
+class ModuleProfile:
+    """ Resource usage of a single module run. """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        # ru_maxrss is a process wide high-water mark: how much this module raised it, and where it stood after
+        self.rss_increase = 0
+        self.process_peak_rss = 0
+        self.child_processes = 0
+        self.bytes_written = None
+
+    def to_dict(self):
+        return {
+            'module': self.name,
+            'wall_time': round(self.wall_time, 3),
+            'cpu_time': round(self.cpu_time, 3),
+            'rss_increase': self.rss_increase,
+            'process_peak_rss': self.process_peak_rss,
+            'child_processes': self.child_processes,
+            'bytes_written': self.bytes_written,
+        }
+
+
+def count_child_process():
+    """ Called by utils.execute_shell for every process it starts. """
+    profile = getattr(_current, 'profile', None)
+    if profile is not None:
+        profile.child_processes += 1
+
+
+def profile_tasks(tasks, profiles, get_paths=None):
+    """
+    Wrap (name, func) tasks so each run appends a ModuleProfile to `profiles`.
+    `get_paths(name)` returns the folders whose size is reported as bytes written.
+    """
+    return [(name, profile_task(name, func, profiles, get_paths)) for name, func in tasks]
+
+
+def profile_task(name, func, profiles, get_paths):
+    def run():
+        profile = ModuleProfile(name)
+        _current.profile = profile
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        rss_before = get_max_rss(resource.getrusage(resource.RUSAGE_SELF), children_before)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            func()
+        finally:
+            profile.wall_time = time.perf_counter() - wall_start
+            children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            # child cpu time is process wide, so it's only exact when modules run one at a time
+            profile.cpu_time = time.thread_time() - cpu_start + \
+                (children_after.ru_utime - children_before.ru_utime) + \
+                (children_after.ru_stime - children_before.ru_stime)
+            profile.process_peak_rss = get_max_rss(resource.getrusage(resource.RUSAGE_SELF), children_after)
+            profile.rss_increase = profile.process_peak_rss - rss_before
+            if get_paths is not None:
+                profile.bytes_written = sum(get_size(p) for p in get_paths(name))
+            _current.profile = None
+            profiles.append(profile)
+    return run
+
+
+def get_max_rss(self_usage, children_usage):
+    return max_rss_bytes(max(self_usage.ru_maxrss, children_usage.ru_maxrss))
+
+
+def max_rss_bytes(max_rss):
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return max_rss
+    return max_rss * 1024
+
+
+def get_size(root):
+    total = 0
+    for dirpath, _, filenames in walk(root):
+        for filename in filenames:
+            file_path = path.join(dirpath, filename)
+            if not path.islink(file_path):
+                total += path.getsize(file_path)
+    return total
+
+
+def format_report(profiles):
+    rows = sorted(profiles, key=lambda p: p.wall_time, reverse=True)
+    lines = ['{:<24}{:>10}{:>10}{:>12}{:>10}{:>14}'.format(
+        'module', 'wall (s)', 'cpu (s)', 'rss +(MB)', 'procs', 'bytes')]
+    for p in rows:
+        written = '-' if p.bytes_written is None else str(p.bytes_written)
+        lines.append('{:<24}{:>10.2f}{:>10.2f}{:>12.1f}{:>10}{:>14}'.format(
+            p.name, p.wall_time, p.cpu_time, p.rss_increase / 1024 / 1024, p.child_processes, written))
+    peak = max([p.process_peak_rss for p in profiles] or [0])
+    lines.append('Peak RSS of the whole run: {:.1f} MB, rss + is how much each module raised it'.format(
+        peak / 1024 / 1024))
+    return '\n'.join(lines)
+
+
+def save_report(profiles, report_path):
+    rows = sorted(profiles, key=lambda p: p.wall_time, reverse=True)
+    with open(report_path, 'w') as f:
+        json.dump([p.to_dict() for p in rows], f, indent=2)
+    log.debug('Saved profile to %s', report_path)
@@ -0,0 +1,48 @@
+import importlib
+
+# Maps every -t choice to the module implementing it, in the order they run.
+# Modules are only imported when they are selected so that `macprefs --version`,
+# `-h` or `backup -t dotfiles` don't pay for importing all of them.
+preference_choices = [
+    'system_preferences',
+    'startup_items',
+    'dotfiles',
+    'shared_file_lists',
+    'ssh_files',
+    'preferences',
+    'app_store_preferences',
+    'internet_accounts',
+    'git_config',
+    'cloud_credentials',
+    'gpg_keys',
+    'package_managers',
+    'vscode_settings',
+    'env_configs',
+    'jetbrains_settings',
+    'custom_fonts',
+    'applications_list',
+    'runtime_versions',
+    'alfred_settings',
+    'sublime_settings'
+]
+
+
+def get_selected(choices=None):
+    return [name for name in preference_choices if not choices or name in choices]
+
+
+def get_module(name):
+    if name not in preference_choices:
+        raise ValueError('Unknown preference type: ' + name)
+    return importlib.import_module(name)
+
+
+def get_tasks(choices, action):
+    """ Returns (name, func) pairs for the selected modules. The module is imported when func is called. """
+    return [(name, get_action(name, action)) for name in get_selected(choices)]
+
+
+def get_action(name, action):
+    def run():
+        return getattr(get_module(name), action)()
+    return run
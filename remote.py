@@ -0,0 +1,180 @@
+"""
+S3-compatible object stores as the backup target. MACPREFS_BACKUP_DIR can be
+an s3://bucket/prefix URL, which then takes the place of the Backup folder:
+snapshots go to <prefix>/{machine}/{date}/ without a synced folder in
+between. MACPREFS_S3_ENDPOINT points the client at another store than AWS
+(MinIO, R2, B2...), credentials come from the usual AWS settings.
+
+Backups work like `backup --objects`: modules back up into the local
+staging mirror, every file is uploaded once as <prefix>/objects/<hash[:2]>/<hash>
+and the snapshot only holds the manifest and the files at its root. The
+object names are listed once per backup, so files whose hash is already
+there aren't uploaded again. Uploads run on one transfer manager sharing a
+pool of connections, large files are sent as multipart uploads with their
+parts in parallel. The `.macprefs-complete` marker is uploaded last, a
+snapshot without it is ignored.
+
+Restores download the manifest and the objects of the selected modules into
+a temp dir and restore from there.
+"""
+from os import environ, path
+import logging as log
+import os
+import manifest
+import objects
+from atomic import MARKER_NAME
+
+SCHEME = 's3://'
+# parallel requests, and connections kept open for them
+MAX_CONCURRENCY = 16
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+
+class UploadStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.new_files = 0
+        self.new_bytes = 0
+
+
+def is_remote(location):
+    return location.startswith(SCHEME)
+
+
+def parse_url(url):
+    """ (bucket, key prefix without slashes around it) of an s3:// URL. """
+    if not is_remote(url):
+        raise ValueError('Not an ' + SCHEME + ' URL: ' + url)
+    bucket, _, prefix = url[len(SCHEME):].partition('/')
+    if not bucket:
+        raise ValueError('No bucket in ' + url)
+    return bucket, prefix.strip('/')
+
+
+def join_key(*parts):
+    return '/'.join(part.strip('/') for part in parts if part.strip('/'))
+
+
+def get_root_prefix(snapshot_prefix):
+    """ The prefix holding every machine's snapshots and the objects, like snapshots.get_backup_root. """
+    return '/'.join(snapshot_prefix.split('/')[:-2])
+
+
+def create_client():
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError:
+        raise ImportError('Backing up to ' + SCHEME + ' URLs needs the boto3 package (pip install boto3)')
+    return boto3.client('s3', endpoint_url=environ.get('MACPREFS_S3_ENDPOINT') or None,
+                        config=Config(max_pool_connections=MAX_CONCURRENCY,
+                                      retries={'max_attempts': 5, 'mode': 'standard'}))
+
+
+def create_transfer_manager(client):
+    from boto3.s3.transfer import TransferConfig, create_transfer_manager as create
+    return create(client, TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
+                                         multipart_chunksize=MULTIPART_CHUNKSIZE,
+                                         max_concurrency=MAX_CONCURRENCY))
+
+
+class Target:
+    """ One snapshot in a bucket, snapshot_url being s3://bucket/prefix/{machine}/{date}. """
+
+    def __init__(self, snapshot_url, client=None):
+        self.url = snapshot_url
+        self.bucket, self.prefix = parse_url(snapshot_url)
+        self.client = client or create_client()
+
+    def get_object_key(self, digest):
+        return join_key(get_root_prefix(self.prefix), objects.OBJECTS_DIR, digest[:2], digest)
+
+    def list_keys(self, prefix):
+        """ Names of the keys below prefix, relative to it. """
+        names = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        prefix = prefix + '/' if prefix else ''
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            names.extend(item['Key'][len(prefix):] for item in page.get('Contents', []))
+        return names
+
+    def list_objects(self):
+        """ Hashes of the objects already in the bucket. """
+        return set(path.basename(name) for name in
+                   self.list_keys(join_key(get_root_prefix(self.prefix), objects.OBJECTS_DIR)))
+
+    def upload_snapshot(self, staging_dir, snapshot_dir):
+        """
+        Uploads the objects of staging_dir's manifest the bucket doesn't have,
+        then the files below snapshot_dir (the manifest and root files) with
+        the marker last.
+        """
+        stats = UploadStats()
+        existing = self.list_objects()
+        files = [os.path.relpath(path.join(dirpath, name), snapshot_dir)
+                 for dirpath, _, filenames in os.walk(snapshot_dir) for name in filenames]
+        with create_transfer_manager(self.client) as transfers:
+            futures = []
+            for entry in manifest.load_manifest(staging_dir).values():
+                if 'target' in entry:
+                    continue
+                stats.files += 1
+                stats.bytes += entry['size']
+                if entry['hash'] in existing:
+                    continue
+                existing.add(entry['hash'])
+                stats.new_files += 1
+                stats.new_bytes += entry['size']
+                futures.append(transfers.upload(path.join(staging_dir, entry['path']), self.bucket,
+                                                self.get_object_key(entry['hash'])))
+            for future in futures:
+                future.result()
+            # the snapshot only lists objects that are stored by now
+            futures = [transfers.upload(path.join(snapshot_dir, name), self.bucket, join_key(self.prefix, name))
+                       for name in files if name != MARKER_NAME]
+            for future in futures:
+                future.result()
+        if MARKER_NAME in files:
+            self.client.upload_file(path.join(snapshot_dir, MARKER_NAME), self.bucket, join_key(self.prefix, MARKER_NAME))
+        log.debug('Uploaded %s of %s files to %s', stats.new_files, stats.files, self.url)
+        return stats
+
+    def download_metadata(self, dest_dir):
+        """ Downloads the snapshot's own files (manifest, root files, marker) into dest_dir. """
+        names = self.list_keys(self.prefix)
+        with create_transfer_manager(self.client) as transfers:
+            futures = []
+            for name in names:
+                dest = path.join(dest_dir, name)
+                os.makedirs(path.dirname(dest), exist_ok=True)
+                futures.append(transfers.download(self.bucket, join_key(self.prefix, name), dest))
+            for future in futures:
+                future.result()
+        return names
+
+    def download_snapshot(self, dest_dir, prefixes):
+        """
+        Downloads the snapshot's own files and its files below prefixes
+        (relative to the snapshot) into dest_dir, with their modes and mtimes.
+        """
+        if MARKER_NAME not in self.download_metadata(dest_dir):
+            raise ValueError('There is no complete backup at ' + self.url)
+        entries = [entry for rel_path, entry in sorted(manifest.load_manifest(dest_dir).items())
+                   if any(rel_path == p or rel_path.startswith(p + '/') for p in prefixes)]
+        with create_transfer_manager(self.client) as transfers:
+            futures = []
+            for entry in entries:
+                dest = path.join(dest_dir, entry['path'])
+                os.makedirs(path.dirname(dest), exist_ok=True)
+                if 'target' in entry:
+                    os.symlink(entry['target'], dest)
+                    continue
+                futures.append((entry, transfers.download(self.bucket, self.get_object_key(entry['hash']), dest)))
+            for entry, future in futures:
+                future.result()
+                dest = path.join(dest_dir, entry['path'])
+                os.chmod(dest, entry['mode'])
+                os.utime(dest, ns=(entry['mtime'], entry['mtime']))
+        log.debug('Downloaded %s files from %s', len(entries), self.url)
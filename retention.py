@@ -0,0 +1,214 @@
+"""
+Retention policy for the dated snapshots of every machine under the Backup
+root, used by `macprefs prune`.
+
+A snapshot is kept when it's one of the newest `daily` days, the newest of
+one of the newest `weekly` ISO weeks or the newest of one of the newest
+`monthly` months. The newest snapshot is always kept.
+
+Freed space is counted from the snapshots being deleted only: a file frees
+its blocks once every one of its hard links is in a deleted snapshot, which
+its link count tells without looking at the kept snapshots. Chunks are
+freed once no kept snapshot's recipe uses them, found through the kept
+snapshots' manifests, nor the recipes of a partial backup `--resume` may
+still commit, and they're older than objects.GRACE_PERIOD. Objects of the store shared by all machines are freed
+once no snapshot or partial backup of any machine lists them and they were
+stored and first found unused more than objects.GRACE_PERIOD ago, since
+another machine's objects can sync before the manifest that lists them.
+"""
+from datetime import date
+from os import path
+import json
+import logging as log
+import os
+import shutil
+import stat
+import time
+import archive
+import atomic
+import chunks
+import compaction
+import manifest
+import objects
+import snapshots
+
+
+def get_snapshot_date(snapshot_dir):
+    return date.fromisoformat(path.basename(snapshot_dir))
+
+
+def select_keep(snapshot_dirs, daily, weekly, monthly):
+    """ The snapshot dirs the policy keeps. """
+    rules = [
+        (daily, lambda day: day),
+        (weekly, lambda day: tuple(day.isocalendar())[:2]),
+        (monthly, lambda day: (day.year, day.month)),
+    ]
+    kept_keys = [[] for _ in rules]
+    keep = set()
+    newest_first = sorted(snapshot_dirs, key=path.basename, reverse=True)
+    for snapshot_dir in newest_first:
+        day = get_snapshot_date(snapshot_dir)
+        for (count, get_key), keys in zip(rules, kept_keys):
+            key = get_key(day)
+            if len(keys) < count and key not in keys:
+                keys.append(key)
+                keep.add(snapshot_dir)
+    if newest_first:
+        keep.add(newest_first[0])
+    return keep
+
+
+def list_machines(backup_root):
+    """ Folders of backup_root holding dated snapshots. """
+    machines = []
+    if not path.isdir(backup_root):
+        return machines
+    for name in sorted(os.listdir(backup_root)):
+        machine_dir = path.join(backup_root, name)
+        if path.isdir(machine_dir) and snapshots.list_snapshots(machine_dir):
+            machines.append(machine_dir)
+    return machines
+
+
+def disk_usage(st):
+    return st.st_blocks * 512
+
+
+def measure_deletions(delete_dirs):
+    """
+    (snapshot_dir, freed bytes) for deleting delete_dirs in order. A file
+    shared by hard links counts for the deletion that removes its last link.
+    """
+    remaining = {}
+    freed = []
+    for snapshot_dir in delete_dirs:
+        freed_bytes = 0
+        for dirpath, dirnames, filenames in os.walk(snapshot_dir):
+            for name in filenames + dirnames:
+                st = os.lstat(path.join(dirpath, name))
+                if stat.S_ISDIR(st.st_mode):
+                    freed_bytes += disk_usage(st)
+                    continue
+                key = (st.st_dev, st.st_ino)
+                links = remaining.get(key, st.st_nlink) - 1
+                remaining[key] = links
+                if links == 0:
+                    freed_bytes += disk_usage(st)
+        freed.append((snapshot_dir, freed_bytes))
+    return freed
+
+
+def get_recipe_paths(snapshot_dir):
+    """ Recipes in a snapshot relative to it, from its manifest when it has one. """
+    entries = manifest.load_manifest(snapshot_dir)
+    if entries:
+        return [p for p in entries if p.endswith(chunks.RECIPE_SUFFIX)]
+    if archive.is_archive_snapshot(snapshot_dir):
+        return [entry['path'] for archive_path in archive.list_archives(snapshot_dir)
+                for entry in archive.read_index(archive_path)['entries'] if entry['path'].endswith(chunks.RECIPE_SUFFIX)]
+    recipes = []
+    for dirpath, _, filenames in os.walk(snapshot_dir):
+        recipes.extend(path.relpath(path.join(dirpath, name), snapshot_dir)
+                       for name in filenames if name.endswith(chunks.RECIPE_SUFFIX))
+    return recipes
+
+
+def get_used_chunks(snapshot_dirs):
+    used = set()
+    for snapshot_dir in snapshot_dirs:
+        for recipe_path in get_recipe_paths(snapshot_dir):
+            # compacted snapshots keep their recipes in archives
+            recipe = compaction.read_stored(snapshot_dir, recipe_path)
+            if recipe is not None:
+                used.update(chunk_hash for chunk_hash, _ in json.loads(recipe)['chunks'])
+    return used
+
+
+def get_unused_chunks(store_dir, keep_dirs, grace_period=objects.GRACE_PERIOD):
+    """
+    (chunk path, bytes) of the chunks no kept snapshot or partial backup
+    needs and that weren't stored within grace_period seconds.
+    """
+    if not path.isdir(store_dir):
+        return []
+    used = get_used_chunks(keep_dirs)
+    oldest = time.time() - grace_period
+    unused = []
+    for dirpath, _, filenames in os.walk(store_dir):
+        for name in filenames:
+            if name not in used and not name.startswith('.'):
+                chunk_path = path.join(dirpath, name)
+                st = os.lstat(chunk_path)
+                if st.st_mtime < oldest:
+                    unused.append((chunk_path, disk_usage(st)))
+    return unused
+
+
+def prune_machine(machine_dir, daily, weekly, monthly, dry_run=False):
+    """ Applies the policy to one machine, returns what was (or would be) deleted and freed. """
+    all_snapshots = snapshots.list_snapshots(machine_dir)
+    keep = select_keep(all_snapshots, daily, weekly, monthly)
+    delete_dirs = [s for s in all_snapshots if s not in keep]
+    deletions = measure_deletions(delete_dirs)
+    # a crashed backup's recipes point at chunks too, until it's resumed
+    in_use = sorted(keep) + atomic.list_partial_dirs(machine_dir)
+    unused_chunks = get_unused_chunks(path.join(machine_dir, snapshots.CHUNK_STORE), in_use) if delete_dirs else []
+    if not dry_run:
+        for snapshot_dir in delete_dirs:
+            log.debug('Deleting %s', snapshot_dir)
+            shutil.rmtree(snapshot_dir)
+        for chunk_path, _ in unused_chunks:
+            os.remove(chunk_path)
+    return {
+        'machine': path.basename(machine_dir),
+        'kept': [path.basename(s) for s in sorted(keep)],
+        'deleted': [(path.basename(s), freed_bytes) for s, freed_bytes in deletions],
+        'chunks': len(unused_chunks),
+        'chunk_bytes': sum(size for _, size in unused_chunks),
+    }
+
+
+def prune_objects(backup_root, reports, dry_run=False):
+    """
+    Deletes the objects of the shared store that no snapshot left after the
+    prune_machine `reports` nor a partial backup uses, returns them.
+    """
+    store_dir = path.join(backup_root, objects.OBJECTS_DIR)
+    if not path.isdir(store_dir):
+        return []
+    kept = dict((report['machine'], report['kept']) for report in reports)
+    remaining = []
+    for name in sorted(os.listdir(backup_root)):
+        machine_dir = path.join(backup_root, name)
+        if not path.isdir(machine_dir):
+            continue
+        names = kept.get(name)
+        for snapshot_dir in snapshots.list_snapshots(machine_dir):
+            if names is None or path.basename(snapshot_dir) in names:
+                remaining.append(snapshot_dir)
+        remaining.extend(atomic.list_partial_dirs(machine_dir))
+    unused_since = objects.load_unused(store_dir)
+    unused = objects.get_unused_objects(store_dir, remaining, unused_since)
+    if not dry_run:
+        for object_path, _ in unused:
+            os.remove(object_path)
+            del unused_since[path.basename(object_path)]
+        objects.save_unused(store_dir, unused_since)
+    return unused
+
+
+def format_report(reports, dry_run=False):
+    verb = 'Would delete' if dry_run else 'Deleted'
+    lines = []
+    total = 0
+    for report in reports:
+        lines.append('{}: keeping {} snapshots'.format(report['machine'], len(report['kept'])))
+        for name, freed_bytes in report['deleted']:
+            lines.append('  {} {} ({} bytes freed)'.format(verb, name, freed_bytes))
+            total += freed_bytes
+        if report['chunks']:
+            lines.append('  {} {} unused chunks ({} bytes freed)'.format(verb, report['chunks'], report['chunk_bytes']))
+            total += report['chunk_bytes']
+    lines.append('{} bytes {}'.format(total, 'would be freed' if dry_run else 'freed'))
+    return '\n'.join(lines)
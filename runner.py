@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os import path
+import logging as log
+import threading
+
+
+class GroupedLogHandler(log.Handler):
+    """
+    Buffers log records emitted by module worker threads and replays them
+    through the original handlers once the module finishes, so the output of
+    modules running in parallel doesn't interleave.
+    """
+
+    def __init__(self, handlers):
+        super().__init__()
+        self.handlers = handlers
+        self.buffers = {}
+        self.buffer_lock = threading.Lock()
+
+    def start(self, thread_id):
+        with self.buffer_lock:
+            self.buffers[thread_id] = []
+
+    def flush_thread(self, thread_id):
+        with self.buffer_lock:
+            records = self.buffers.pop(thread_id, [])
+            for record in records:
+                self.forward(record)
+
+    def emit(self, record):
+        with self.buffer_lock:
+            if record.thread in self.buffers:
+                self.buffers[record.thread].append(record)
+                return
+            self.forward(record)
+
+    def forward(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def run_modules(tasks, jobs=1, prerequisites=None):
+    """
+    Run a list of (name, func) tasks using at most `jobs` worker threads.
+    `prerequisites` maps a task name to the names that have to finish first.
+    Output is grouped per module. Raises the first failure once every
+    started module has finished.
+    """
+    if prerequisites is None:
+        prerequisites = {}
+    if jobs is None or jobs < 1:
+        jobs = 1
+    if jobs == 1 or len(tasks) <= 1:
+        for _, func in order_tasks(tasks, prerequisites):
+            func()
+        return
+
+    root = log.getLogger()
+    grouped = GroupedLogHandler(root.handlers[:])
+    root.handlers = [grouped]
+    try:
+        failures = run_parallel(grouped, tasks, jobs, prerequisites)
+    finally:
+        root.handlers = grouped.handlers
+    if failures:
+        raise failures[0]
+
+
+def run_parallel(grouped, tasks, jobs, prerequisites):
+    names = set(name for name, _ in tasks)
+    pending = list(tasks)
+    running = {}
+    done = set()
+    failed = set()
+    failures = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for task in pending[:]:
+                if len(running) >= jobs:
+                    break
+                name, func = task
+                blockers = prerequisites.get(name, set()) & names
+                if blockers & failed:
+                    log.error('Skipping %s because %s failed', name, ', '.join(sorted(blockers & failed)))
+                    pending.remove(task)
+                    failed.add(name)
+                elif blockers <= done:
+                    pending.remove(task)
+                    running[executor.submit(run_grouped, grouped, name, func)] = name
+            if not running:
+                if pending:
+                    raise ValueError('Circular module dependencies: ' + ', '.join(name for name, _ in pending))
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    log.error('%s failed: %s', name, str(error))
+                    failures.append(error)
+                    failed.add(name)
+                else:
+                    done.add(name)
+    return failures
+
+
+def run_grouped(grouped, name, func):
+    thread_id = threading.get_ident()
+    grouped.start(thread_id)
+    try:
+        log.debug('Started %s', name)
+        func()
+    finally:
+        grouped.flush_thread(thread_id)
+
+
+def order_tasks(tasks, prerequisites):
+    """ Stable topological sort: keeps the given order wherever prerequisites allow it. """
+    names = set(name for name, _ in tasks)
+    pending = list(tasks)
+    ordered = []
+    done = set()
+    while pending:
+        for task in pending:
+            if prerequisites.get(task[0], set()) & names <= done:
+                break
+        else:
+            raise ValueError('Circular module dependencies: ' + ', '.join(name for name, _ in pending))
+        pending.remove(task)
+        ordered.append(task)
+        done.add(task[0])
+    return ordered
+
+
+def build_prerequisites(names, dependencies, paths):
+    """
+    Combine declared dependencies with write conflicts. When two modules write
+    overlapping paths, the one listed first in `names` has to finish first.
+    """
+    prerequisites = {}
+    for index, name in enumerate(names):
+        required = set(dependencies.get(name, []))
+        for earlier in names[:index]:
+            if paths_overlap(paths.get(name, []), paths.get(earlier, [])):
+                required.add(earlier)
+        prerequisites[name] = required
+    return prerequisites
+
+
+def paths_overlap(paths_a, paths_b):
+    for a in paths_a:
+        for b in paths_b:
+            if is_same_or_inside(a, b) or is_same_or_inside(b, a):
+                return True
+    return False
+
+
+def is_same_or_inside(child, parent):
+    child = path.normpath(child)
+    parent = path.normpath(parent)
+    return child == parent or child.startswith(parent.rstrip(path.sep) + path.sep)
@@ -1,99 +1,85 @@
-from os.path import exists, join
+from os import listdir
+from os.path import dirname, exists, isdir, join, realpath
 import logging as log
-from config import get_macprefs_dir, ensure_exists
-from utils import execute_shell
+import shutil
+from config import get_backup_subdir
+from utils import run_commands
 
 
 def get_runtime_versions_backup_dir():
-    return_val = join(get_macprefs_dir(), 'runtime_versions/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('runtime_versions/')
+
+
+# name -> command, probed concurrently on backup
+PROBES = {
+    'dotnet': ['dotnet', '--version'],
+    'dotnet-sdks': ['dotnet', '--list-sdks'],
+    'dotnet-runtimes': ['dotnet', '--list-runtimes'],
+    'node': ['node', '--version'],
+    'npm': ['npm', '--version'],
+    'python3': ['python3', '--version'],
+    'ruby': ['ruby', '--version'],
+    'go': ['go', 'version'],
+}
+
+
+def get_watched_dirs(command):
+    """
+    Folders whose changes invalidate the cached output of command. SDKs and
+    runtimes are installed next to the same dotnet binary, into sdk/ and
+    shared/<framework>/.
+    """
+    if command[0] != 'dotnet':
+        return []
+    binary = shutil.which('dotnet')
+    if binary is None:
+        return []
+    dotnet_root = dirname(realpath(binary))
+    shared_dir = join(dotnet_root, 'shared')
+    frameworks = [join(shared_dir, d) for d in sorted(listdir(shared_dir))] if isdir(shared_dir) else []
+    return [join(dotnet_root, 'sdk'), shared_dir] + frameworks
 
 
 def backup():
     log.info('Backing up runtime versions...')
     dest = get_runtime_versions_backup_dir()
     versions_info = []
+    results = dict(zip(PROBES, run_commands(list(PROBES.values()), cached=True, watch=get_watched_dirs)))
 
     # Check .NET version
-    try:
-        log.debug('Checking dotnet version...')
-        dotnet_version = execute_shell(['dotnet', '--version'], suppress_errors=True)
-        if dotnet_version:
-            versions_info.append(f"dotnet: {dotnet_version.strip()}")
-
-            # List all installed SDKs
-            dotnet_sdks = execute_shell(['dotnet', '--list-sdks'], suppress_errors=True)
-            if dotnet_sdks:
-                dotnet_file = join(dest, 'dotnet-sdks.txt')
-                with open(dotnet_file, 'w') as f:
-                    f.write(dotnet_sdks)
-                log.debug('Backed up dotnet SDKs list')
-
-            # List all installed runtimes
-            dotnet_runtimes = execute_shell(['dotnet', '--list-runtimes'], suppress_errors=True)
-            if dotnet_runtimes:
-                dotnet_runtime_file = join(dest, 'dotnet-runtimes.txt')
-                with open(dotnet_runtime_file, 'w') as f:
-                    f.write(dotnet_runtimes)
-                log.debug('Backed up dotnet runtimes list')
-    except Exception as e:
-        log.info('dotnet not found or could not check version: %s', str(e))
+    dotnet = results['dotnet']
+    if dotnet.ok and dotnet.stdout:
+        versions_info.append(f"dotnet: {dotnet.stdout}")
+
+        # List all installed SDKs
+        dotnet_sdks = results['dotnet-sdks']
+        if dotnet_sdks.ok and dotnet_sdks.stdout:
+            dotnet_file = join(dest, 'dotnet-sdks.txt')
+            with open(dotnet_file, 'w') as f:
+                f.write(dotnet_sdks.stdout)
+            log.debug('Backed up dotnet SDKs list')
+
+        # List all installed runtimes
+        dotnet_runtimes = results['dotnet-runtimes']
+        if dotnet_runtimes.ok and dotnet_runtimes.stdout:
+            dotnet_runtime_file = join(dest, 'dotnet-runtimes.txt')
+            with open(dotnet_runtime_file, 'w') as f:
+                f.write(dotnet_runtimes.stdout)
+            log.debug('Backed up dotnet runtimes list')
+    else:
+        log.info('dotnet not found or could not check version: %s', dotnet.stderr)
         versions_info.append('dotnet: not installed')
 
-    # Check Node.js version
-    try:
-        log.debug('Checking node version...')
-        node_version = execute_shell(['node', '--version'], suppress_errors=True)
-        if node_version:
-            versions_info.append(f"node: {node_version.strip()}")
-            log.debug('Backed up node version')
-    except Exception as e:
-        log.info('node not found or could not check version: %s', str(e))
-        versions_info.append('node: not installed')
-
-    # Check npm version
-    try:
-        log.debug('Checking npm version...')
-        npm_version = execute_shell(['npm', '--version'], suppress_errors=True)
-        if npm_version:
-            versions_info.append(f"npm: {npm_version.strip()}")
-            log.debug('Backed up npm version')
-    except Exception as e:
-        log.info('npm not found or could not check version: %s', str(e))
-        versions_info.append('npm: not installed')
-
-    # Check Python version
-    try:
-        log.debug('Checking python version...')
-        python_version = execute_shell(['python3', '--version'], suppress_errors=True)
-        if python_version:
-            versions_info.append(f"python3: {python_version.strip()}")
-            log.debug('Backed up python version')
-    except Exception as e:
-        log.debug('python3 not found: %s', str(e))
-        versions_info.append('python3: not installed')
-
-    # Check Ruby version
-    try:
-        log.debug('Checking ruby version...')
-        ruby_version = execute_shell(['ruby', '--version'], suppress_errors=True)
-        if ruby_version:
-            versions_info.append(f"ruby: {ruby_version.strip()}")
-            log.debug('Backed up ruby version')
-    except Exception as e:
-        log.debug('ruby not found: %s', str(e))
-        versions_info.append('ruby: not installed')
-
-    # Check Go version
-    try:
-        log.debug('Checking go version...')
-        go_version = execute_shell(['go', 'version'], suppress_errors=True)
-        if go_version:
-            versions_info.append(f"go: {go_version.strip()}")
-            log.debug('Backed up go version')
-    except Exception as e:
-        log.debug('go not found: %s', str(e))
+    # Check node, npm, python, ruby and go versions
+    for name in ['node', 'npm', 'python3', 'ruby', 'go']:
+        result = results[name]
+        if result.ok:
+            if result.stdout:
+                versions_info.append(f"{name}: {result.stdout}")
+                log.debug('Backed up %s version', name)
+        else:
+            log.debug('%s not found or could not check version: %s', name, result.stderr)
+            versions_info.append(f'{name}: not installed')
 
     # Write versions summary
     versions_file = join(dest, 'versions.txt')
@@ -124,3 +110,17 @@ def restore():
         log.info('.NET Runtimes list saved at: %s', dotnet_runtime_file)
 
     log.info('\nFor node/npm versions, use nvm, asdf, or package_managers module.')
+
+
+def get_backup_sources():
+    # the version lists are generated, nothing is copied
+    return []
+
+
+def get_backup_paths():
+    return [get_runtime_versions_backup_dir()]
+
+
+def get_restore_paths():
+    # informational only, nothing is written on restore
+    return []
@@ -3,6 +3,9 @@ import logging as log
 from utils import copy_dir, ensure_dir_owned_by_user
 import config
 
+# Finder's recent and favorite item stores
+chunked_files = ['*.sfl2', '*.sfl3']
+
 
 def backup():
     log.info('Backing up shared file lists...')
@@ -21,3 +24,15 @@ def restore():
     source = config.get_shared_file_lists_backup_dir()
     copy_dir(source, dest, with_sudo=True)
     ensure_dir_owned_by_user(dest, config.get_user())
+
+
+def get_backup_sources():
+    return [(config.get_shared_file_lists_dir(), config.get_shared_file_lists_backup_dir())]
+
+
+def get_backup_paths():
+    return [config.get_shared_file_lists_backup_dir()]
+
+
+def get_restore_paths():
+    return [config.get_shared_file_lists_dir()]
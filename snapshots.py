@@ -0,0 +1,45 @@
+"""
+Dated snapshots of one machine, laid out as Backup/{machine}/{YYYY-MM-DD}.
+"""
+from os import path, scandir
+import re
+
+SNAPSHOT_NAME = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+# chunks of the machine's snapshots, see chunks.py
+CHUNK_STORE = 'chunks'
+
+
+def list_snapshots(machine_dir):
+    """ Snapshot dirs in machine_dir, oldest first. """
+    try:
+        with scandir(machine_dir) as it:
+            names = [entry.name for entry in it if entry.is_dir() and SNAPSHOT_NAME.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    return [path.join(machine_dir, name) for name in sorted(names)]
+
+
+def get_backup_root(backup_dir):
+    """ The folder holding every machine's snapshots, None when backup_dir isn't dated. """
+    backup_dir = path.normpath(backup_dir)
+    if not SNAPSHOT_NAME.match(path.basename(backup_dir)):
+        return None
+    return path.dirname(path.dirname(backup_dir))
+
+
+def get_chunk_store_dir(backup_dir):
+    """ The machine's chunk store for dated snapshots, a folder inside backup_dir otherwise. """
+    backup_dir = path.normpath(backup_dir)
+    if SNAPSHOT_NAME.match(path.basename(backup_dir)):
+        return path.join(path.dirname(backup_dir), CHUNK_STORE)
+    return path.join(backup_dir, '.macprefs-' + CHUNK_STORE)
+
+
+def find_previous(backup_dir):
+    """ The latest snapshot next to backup_dir older than it, None when there's none or backup_dir isn't dated. """
+    backup_dir = path.normpath(backup_dir)
+    name = path.basename(backup_dir)
+    if not SNAPSHOT_NAME.match(name):
+        return None
+    earlier = [s for s in list_snapshots(path.dirname(backup_dir)) if path.basename(s) < name]
+    return earlier[-1] if earlier else None
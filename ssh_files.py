@@ -25,4 +25,16 @@ def restore():
     copy_dir(
         source, dest, with_sudo=True
     )
-    ensure_dir_owned_by_user(dest, get_user())
\ No newline at end of file
+    ensure_dir_owned_by_user(dest, get_user())
+
+
+def get_backup_sources():
+    return [(get_ssh_user_dir(), get_ssh_backup_dir())]
+
+
+def get_backup_paths():
+    return [get_ssh_backup_dir()]
+
+
+def get_restore_paths():
+    return [get_ssh_user_dir()]
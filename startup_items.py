@@ -54,3 +54,27 @@ def restore_system_daemons_agents():
     dest = config.get_system_launch_daemons_dir()
     copy_dir(source, dest, with_sudo=True)
     ensure_dir_owned_by_user(dest, 'root:wheel', '644')
+
+
+def get_backup_sources():
+    return [
+        (config.get_user_launch_agents_dir(), config.get_user_launch_agents_backup_dir()),
+        (config.get_system_launch_agents_dir(), config.get_system_launch_agents_backup_dir()),
+        (config.get_system_launch_daemons_dir(), config.get_system_launch_daemons_backup_dir()),
+    ]
+
+
+def get_backup_paths():
+    return [
+        config.get_user_launch_agents_backup_dir(),
+        config.get_system_launch_agents_backup_dir(),
+        config.get_system_launch_daemons_backup_dir(),
+    ]
+
+
+def get_restore_paths():
+    return [
+        config.get_user_launch_agents_dir(),
+        config.get_system_launch_agents_dir(),
+        config.get_system_launch_daemons_dir(),
+    ]
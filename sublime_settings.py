@@ -1,14 +1,12 @@
 from os import listdir
 from os.path import exists, join, isdir
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
+from config import get_backup_subdir, get_home_dir, get_user, ensure_exists
 from utils import copy_dir, ensure_dir_owned_by_user
 
 
 def get_sublime_backup_dir():
-    return_val = join(get_macprefs_dir(), 'sublime/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('sublime/')
 
 
 def get_sublime_support_dir():
@@ -92,3 +90,23 @@ def restore():
             log.debug('Restored %s settings', sublime_dir)
 
     log.info('Sublime settings restored. Restart Sublime Text/Merge to apply changes.')
+
+
+def get_backup_sources():
+    support_dir = get_sublime_support_dir()
+    dest = get_sublime_backup_dir()
+    if not exists(support_dir):
+        return []
+    sublime_dirs = [d for d in listdir(support_dir)
+                    if d.startswith(('Sublime Text', 'Sublime Merge')) and isdir(join(support_dir, d))]
+    return [(join(support_dir, d, 'Packages/User/'), join(dest, d, 'Packages/User/')) for d in sublime_dirs]
+
+
+def get_backup_paths():
+    return [get_sublime_backup_dir()]
+
+
+def get_restore_paths():
+    support_dir = get_sublime_support_dir()
+    source = get_sublime_backup_dir()
+    return [join(support_dir, d, 'Packages/User/') for d in listdir(source) if isdir(join(source, d))]
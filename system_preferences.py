@@ -88,3 +88,23 @@ def get_pm_path():
     if not path.exists(pm_path):
         pm_path = path.join('/Library/Preferences/SystemConfiguration/', 'com.apple.PowerManagement.plist')
     return pm_path
+
+
+def get_backup_sources():
+    dest = get_sys_preferences_backup_dir()
+    system_prefs = [
+        'com.apple.TimeMachine.plist',
+        'com.apple.SoftwareUpdate.plist',
+        'com.apple.Bluetooth.plist',
+        'com.apple.NetworkSharing.plist',
+    ]
+    return [(get_pm_path(), dest)] + \
+        [(path.join('/Library/Preferences/', pref_file), dest) for pref_file in system_prefs]
+
+
+def get_backup_paths():
+    return [get_sys_preferences_backup_dir()]
+
+
+def get_restore_paths():
+    return ['/Library/Preferences/']
@@ -0,0 +1,147 @@
+import os
+import pytest
+from mock import patch
+
+import archive
+
+
+def make_staging(tmpdir):
+    staging = tmpdir.mkdir('staging')
+    dotfiles = staging.mkdir('dotfiles')
+    dotfiles.join('.zshrc').write('export A=1\n' * 100)
+    os.chmod(str(dotfiles.join('.zshrc')), 0o600)
+    dotfiles.mkdir('.config').join('starship.toml').write('format = "$all"')
+    os.symlink('.zshrc', str(dotfiles.join('.bashrc')))
+    staging.mkdir('ssh').join('config').write('Host *')
+    staging.join('RESTORE.md').write('guide')
+    return staging
+
+
+def test_archive_round_trip(tmpdir):
+    staging = make_staging(tmpdir)
+    archive_path = str(tmpdir.join('dotfiles.mpa'))
+    archive.write_archive(archive_path, str(staging), ['dotfiles/'], archive.get_codec('zlib'))
+    dest = tmpdir.mkdir('dest')
+    archive.extract_archive(archive_path, str(dest))
+    assert dest.join('dotfiles', '.zshrc').read() == 'export A=1\n' * 100
+    assert os.stat(str(dest.join('dotfiles', '.zshrc'))).st_mode & 0o777 == 0o600
+    assert dest.join('dotfiles', '.config', 'starship.toml').read() == 'format = "$all"'
+    assert os.readlink(str(dest.join('dotfiles', '.bashrc'))) == '.zshrc'
+    assert not dest.join('ssh').exists()
+
+
+def test_extract_reads_only_selected_entries(tmpdir):
+    staging = make_staging(tmpdir)
+    archive_path = str(tmpdir.join('dotfiles.mpa'))
+    archive.write_archive(archive_path, str(staging), ['dotfiles/'], archive.get_codec('zlib'))
+    dest = tmpdir.mkdir('dest')
+    with patch('archive.extract_entry', wraps=archive.extract_entry) as extract_mock:
+        archive.extract_archive(archive_path, str(dest), ['dotfiles/.config'])
+    assert dest.join('dotfiles', '.config', 'starship.toml').exists()
+    assert not dest.join('dotfiles', '.zshrc').exists()
+    assert extract_mock.call_count == 1
+
+
+def test_read_index_rejects_incomplete_archive(tmpdir):
+    staging = make_staging(tmpdir)
+    archive_path = str(tmpdir.join('dotfiles.mpa'))
+    archive.write_archive(archive_path, str(staging), ['dotfiles/'], archive.get_codec('zlib'))
+    with open(archive_path, 'rb+') as f:
+        f.truncate(os.path.getsize(archive_path) - 4)
+    try:
+        archive.read_index(archive_path)
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def test_pack_and_unpack_snapshot(tmpdir):
+    staging = make_staging(tmpdir)
+    snapshot = tmpdir.mkdir('2026-01-01')
+    modules = [('dotfiles', [str(staging.join('dotfiles')) + '/']), ('ssh_files', [str(staging.join('ssh')) + '/'])]
+    archive.pack_snapshot(str(staging), str(snapshot), modules, archive.get_codec('zlib'), jobs=2)
+    assert sorted(os.listdir(str(snapshot))) == ['RESTORE.md', 'archives']
+    assert archive.is_archive_snapshot(str(snapshot))
+    dest = tmpdir.mkdir('restore')
+    archive.unpack_snapshot(str(snapshot), str(dest), ['ssh_files'])
+    assert dest.join('ssh', 'config').read() == 'Host *'
+    assert dest.join('RESTORE.md').read() == 'guide'
+    assert not dest.join('dotfiles').exists()
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'zstd'])
+def test_pack_snapshot_in_parallel_round_trips_every_module(tmpdir, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    staging = tmpdir.mkdir('staging')
+    modules = []
+    for index in range(8):
+        module_dir = staging.mkdir('module{}'.format(index))
+        for file_index in range(20):
+            module_dir.join('file{}'.format(file_index)).write(('module {} file {} '.format(index, file_index)) * 5000)
+        modules.append(('module{}'.format(index), [str(module_dir) + '/']))
+    snapshot = tmpdir.mkdir('2026-01-01')
+    archive.pack_snapshot(str(staging), str(snapshot), modules, archive.get_codec(compression), jobs=4)
+    dest = tmpdir.mkdir('restore')
+    archive.unpack_snapshot(str(snapshot), str(dest), [name for name, _ in modules])
+    for index in range(8):
+        for file_index in range(20):
+            assert dest.join('module{}'.format(index), 'file{}'.format(file_index)).read() == \
+                ('module {} file {} '.format(index, file_index)) * 5000
+
+
+def test_pack_snapshot_leaves_other_modules_out(tmpdir):
+    staging = make_staging(tmpdir)
+    snapshot = tmpdir.mkdir('2026-01-01')
+    modules = [('dotfiles', [str(staging.join('dotfiles')) + '/'])]
+    archive.pack_snapshot(str(staging), str(snapshot), modules, archive.get_codec('zlib'))
+    assert sorted(os.listdir(str(snapshot))) == ['RESTORE.md', 'archives']
+
+
+def test_rotate_staging_dir_starts_empty_mirror(tmpdir):
+    staging = make_staging(tmpdir)
+    previous = archive.rotate_staging_dir(str(staging))
+    assert previous == archive.get_previous_staging_dir(str(staging))
+    assert os.listdir(str(staging)) == []
+    assert tmpdir.join('staging.previous', 'dotfiles').exists()
+    assert archive.rotate_staging_dir(str(staging)) == previous
+    assert os.listdir(previous) == []
+
+
+@patch('config.get_cache_dir')
+def test_dated_snapshots_share_staging_dir(cache_dir_mock, tmpdir):
+    cache_dir_mock.return_value = str(tmpdir)
+    first = archive.get_staging_dir('/backup/mac/2026-01-01')
+    assert first == archive.get_staging_dir('/backup/mac/2026-01-02')
+    assert first != archive.get_staging_dir('/backup/other/2026-01-01')
+    assert not archive.claim_staging_dir(first, '/backup/mac/2026-01-01')
+    assert archive.claim_staging_dir(first, '/backup/mac/2026-01-01')
+    assert not archive.claim_staging_dir(first, '/backup/mac/2026-01-02')
+
+
+def test_dictionary_round_trip(tmpdir):
+    staging = tmpdir.mkdir('staging')
+    prefs = staging.mkdir('preferences')
+    for i in range(20):
+        prefs.join('com.example.app{}.plist'.format(i)).write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<plist version="1.0"><dict><key>Count</key>'
+            '<integer>{}</integer><key>ShowSidebar</key><true/></dict></plist>\n'.format(i))
+    archive_dir = tmpdir.mkdir('archives')
+    archive_path = str(archive_dir.join('preferences.mpa'))
+    archive.write_archive(archive_path, str(staging), ['preferences/'], archive.get_codec('zlib'),
+                          str(archive_dir.join('dictionaries')))
+    index = archive.read_index(archive_path)
+    assert index['dictionary'].startswith('dictionaries/zlib-')
+    assert archive_dir.join(index['dictionary']).exists()
+    dest = tmpdir.mkdir('dest')
+    archive.extract_archive(archive_path, str(dest))
+    assert dest.join('preferences', 'com.example.app7.plist').read() == \
+        prefs.join('com.example.app7.plist').read()
+
+
+def test_train_zlib_dictionary_keeps_shared_substrings():
+    samples = [b'<plist version="1.0"><dict>' + str(i).encode() * 30 for i in range(5)]
+    dictionary = archive.train_zlib_dictionary(samples)
+    assert b'plist version' in dictionary
+    assert b'3333333333' not in dictionary
+    assert archive.train_zlib_dictionary([b'only one sample of text']) is None
@@ -0,0 +1,81 @@
+import json
+import os
+from mock import patch
+
+import atomic
+
+
+@patch('os.sync')
+def test_commit_snapshot_renames_partial_into_place(sync_mock, tmpdir):
+    snapshot = tmpdir.join('2026-01-01')
+    partial = tmpdir.mkdir('.2026-01-01.partial')
+    assert atomic.get_partial_dir(str(snapshot)) == str(partial)
+    partial.mkdir('dotfiles').join('.zshrc').write('export A=1')
+    atomic.commit_snapshot(str(partial), str(snapshot), ['dotfiles'])
+    assert os.listdir(str(tmpdir)) == ['2026-01-01']
+    assert snapshot.join('dotfiles', '.zshrc').read() == 'export A=1'
+    assert atomic.is_complete(str(snapshot))
+    assert json.loads(snapshot.join(atomic.MARKER_NAME).read())['modules'] == ['dotfiles']
+    sync_mock.assert_called_once()
+
+
+@patch('os.sync')
+def test_commit_snapshot_replaces_earlier_backup_of_the_day(sync_mock, tmpdir):
+    snapshot = tmpdir.mkdir('2026-01-01')
+    snapshot.join('old').write('old')
+    partial = tmpdir.mkdir('.2026-01-01.partial')
+    partial.join('new').write('new')
+    atomic.commit_snapshot(str(partial), str(snapshot), [])
+    assert os.listdir(str(tmpdir)) == ['2026-01-01']
+    assert sorted(os.listdir(str(snapshot))) == [atomic.MARKER_NAME, 'new']
+
+
+def test_recover_puts_back_a_snapshot_replaced_by_a_crashed_commit(tmpdir):
+    snapshot = tmpdir.join('2026-01-01')
+    replaced = tmpdir.mkdir('.2026-01-01.replaced')
+    replaced.join('old').write('old')
+    # the crash came between the renames
+    assert atomic.recover(str(snapshot))
+    assert os.listdir(str(tmpdir)) == ['2026-01-01']
+    assert snapshot.join('old').read() == 'old'
+    tmpdir.mkdir('.2026-01-01.replaced').join('older').write('older')
+    # the crash came after the new snapshot was in place
+    assert not atomic.recover(str(snapshot))
+    assert os.listdir(str(tmpdir)) == ['2026-01-01']
+    assert not atomic.recover(str(snapshot))
+
+
+@patch('atomic.fcntl.fcntl')
+@patch('atomic.fcntl.F_FULLFSYNC', 51, create=True)
+def test_barrier_skips_files_it_cannot_open(fcntl_mock, tmpdir):
+    tmpdir.join('readable').write('a')
+    tmpdir.join('unreadable').write('b')
+    fsync_path = atomic.fsync_path
+    synced = []
+
+    def fsync_readable(entry_path):
+        if entry_path.endswith('unreadable'):
+            raise PermissionError(13, 'Permission denied', entry_path)
+        synced.append(os.path.basename(entry_path))
+        fsync_path(entry_path)
+    with patch('atomic.fsync_path', side_effect=fsync_readable):
+        atomic.barrier(str(tmpdir))
+    assert synced == ['readable']
+    fcntl_mock.assert_called_once()
+
+
+def test_snapshot_without_marker_is_not_complete(tmpdir):
+    assert not atomic.is_complete(str(tmpdir))
+
+
+def test_carry_over_links_other_modules_of_the_day(tmpdir):
+    snapshot = tmpdir.mkdir('2026-01-01')
+    snapshot.mkdir('git_config').join('.gitconfig').write('[user]')
+    snapshot.mkdir('dotfiles').join('.zshrc').write('old')
+    partial = tmpdir.mkdir('.2026-01-01.partial')
+    partial.mkdir('dotfiles').join('.zshrc').write('new')
+    atomic.carry_over(str(snapshot), str(partial), ['git_config', 'missing'])
+    assert partial.join('git_config', '.gitconfig').read() == '[user]'
+    assert os.stat(str(partial.join('git_config', '.gitconfig'))).st_nlink == 2
+    assert partial.join('dotfiles', '.zshrc').read() == 'new'
+    assert not partial.join('missing').exists()
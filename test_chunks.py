@@ -0,0 +1,119 @@
+import os
+import random
+from mock import patch
+
+import chunks
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def test_cut_points_survive_an_insertion():
+    data = random_bytes(300 * 1024)
+    edited = data[:100000] + b'new row' + data[100000:]
+    first = chunks.cut_points(data)
+    second = chunks.cut_points(edited)
+    assert sum(first) == len(data)
+    assert all(chunks.MIN_CHUNK <= length <= chunks.MAX_CHUNK for length in first[:-1])
+    # only the chunk with the edit changes, the ones after it line up again
+    assert len(set(first) & set(second)) >= len(first) - 2
+
+
+def test_iter_chunks_matches_cut_points(tmpdir):
+    data = random_bytes(200 * 1024, seed=1)
+    fle = tmpdir.join('db.sqlite')
+    fle.write_binary(data)
+    with patch('chunks.READ_SIZE', 16 * 1024):
+        assert [len(c) for c in chunks.iter_chunks(str(fle))] == chunks.cut_points(data)
+
+
+def test_chunk_file_dedups_and_assembles(tmpdir):
+    store = str(tmpdir.mkdir('chunks'))
+    data = random_bytes(400 * 1024, seed=2)
+    first = tmpdir.mkdir('2026-01-01').join('Accounts4.sqlite')
+    first.write_binary(data)
+    stats = chunks.ChunkStats()
+    chunks.chunk_file(str(first), store, stats)
+    assert not first.exists()
+    assert stats.new_bytes == len(data)
+    second = tmpdir.mkdir('2026-01-02').join('Accounts4.sqlite')
+    second.write_binary(data[:200000] + b'x' + data[200001:])
+    os.chmod(str(second), 0o600)
+    stats = chunks.ChunkStats()
+    chunks.chunk_file(str(second), store, stats)
+    assert stats.saved_bytes > len(data) * 3 // 4
+    dest = str(tmpdir.join('restored.sqlite'))
+    chunks.assemble_file(str(second) + chunks.RECIPE_SUFFIX, dest, store)
+    with open(dest, 'rb') as f:
+        assert f.read() == data[:200000] + b'x' + data[200001:]
+    assert os.stat(dest).st_mode & 0o777 == 0o600
+
+
+def test_chunk_paths_skips_small_and_unlisted_files(tmpdir):
+    accounts = tmpdir.mkdir('Accounts')
+    accounts.join('Accounts4.sqlite').write_binary(random_bytes(chunks.MIN_FILE_SIZE))
+    accounts.join('small.sqlite').write_binary(b'tiny')
+    accounts.join('notes.txt').write_binary(random_bytes(chunks.MIN_FILE_SIZE))
+    chunked = chunks.chunk_paths([str(accounts)], ['*.sqlite'], str(tmpdir.mkdir('chunks')))
+    assert chunked == [str(accounts.join('Accounts4.sqlite'))]
+    assert sorted(os.listdir(str(accounts))) == ['Accounts4.sqlite.macprefs-recipe', 'notes.txt', 'small.sqlite']
+
+
+def test_materialize_rebuilds_files(tmpdir):
+    store = str(tmpdir.mkdir('chunks'))
+    snapshot = tmpdir.mkdir('2026-01-01')
+    snapshot.join('RESTORE.md').write('guide')
+    snapshot.mkdir('.macprefs-modes').join('internet_accounts.json').write('{}')
+    accounts = snapshot.mkdir('Accounts')
+    data = random_bytes(chunks.MIN_FILE_SIZE, seed=3)
+    accounts.join('Accounts4.sqlite').write_binary(data)
+    accounts.join('plain').write('plain')
+    chunks.chunk_paths([str(accounts)], ['*.sqlite'], store)
+    assert chunks.has_recipes([str(accounts)])
+    dest = tmpdir.mkdir('restore')
+    chunks.materialize(str(snapshot), str(dest), [str(accounts) + '/'], store)
+    assert dest.join('Accounts', 'Accounts4.sqlite').read_binary() == data
+    assert dest.join('Accounts', 'plain').read() == 'plain'
+    assert dest.join('RESTORE.md').read() == 'guide'
+    assert dest.join('.macprefs-modes', 'internet_accounts.json').exists()
+
+
+@patch('chunks.iter_chunks')
+def test_unchanged_file_reuses_previous_recipe(iter_chunks_mock, tmpdir):
+    store = str(tmpdir.mkdir('chunks'))
+    data = random_bytes(chunks.MIN_FILE_SIZE, seed=4)
+    iter_chunks_mock.side_effect = lambda p: iter([data[:1000], data[1000:]])
+    previous = tmpdir.mkdir('2026-01-01').mkdir('Accounts')
+    previous.join('Accounts4.sqlite').write_binary(data)
+    chunks.chunk_paths([str(previous)], ['*.sqlite'], store)
+    current = tmpdir.mkdir('2026-01-02').mkdir('Accounts')
+    current.join('Accounts4.sqlite').write_binary(data)
+    stats = chunks.ChunkStats()
+    chunks.chunk_paths([str(current)], ['*.sqlite'], store, stats, str(tmpdir.join('2026-01-02')),
+                       str(tmpdir.join('2026-01-01')))
+    assert iter_chunks_mock.call_count == 1
+    assert stats.saved_bytes == len(data)
+    assert chunks.load_recipe(str(current.join('Accounts4.sqlite')) + chunks.RECIPE_SUFFIX)['chunks'] == \
+        chunks.load_recipe(str(previous.join('Accounts4.sqlite')) + chunks.RECIPE_SUFFIX)['chunks']
+
+
+def test_chunk_file_trusts_size_and_mtime_of_the_previous_recipe(tmpdir):
+    store = str(tmpdir.mkdir('chunks'))
+    data = random_bytes(chunks.MIN_FILE_SIZE, seed=5)
+    previous = tmpdir.mkdir('2026-01-01').join('Accounts4.sqlite')
+    previous.write_binary(data)
+    os.utime(str(previous), (1000000000, 1000000000))
+    chunks.chunk_file(str(previous), store)
+    current = tmpdir.mkdir('2026-01-02').join('Accounts4.sqlite')
+    current.write_binary(data)
+    os.utime(str(current), (1000000000, 1000000000))
+    with patch('chunks.manifest.hash_file') as hash_mock, patch('chunks.iter_chunks') as iter_chunks_mock:
+        chunks.chunk_file(str(current), store, previous_recipe=str(previous) + chunks.RECIPE_SUFFIX)
+    hash_mock.assert_not_called()
+    iter_chunks_mock.assert_not_called()
+    # same size, another mtime and other bytes
+    changed = tmpdir.mkdir('2026-01-03').join('Accounts4.sqlite')
+    changed.write_binary(random_bytes(chunks.MIN_FILE_SIZE, seed=6))
+    recipe = chunks.chunk_file(str(changed), store, previous_recipe=str(current) + chunks.RECIPE_SUFFIX)
+    assert recipe['chunks'] != chunks.load_recipe(str(current) + chunks.RECIPE_SUFFIX)['chunks']
@@ -0,0 +1,69 @@
+import os
+from datetime import date, timedelta
+from mock import patch
+
+import archive
+import chunks
+import compaction
+import retention
+
+
+def make_snapshot(machine, day):
+    snapshot = machine.mkdir(day)
+    snapshot.mkdir('dotfiles').join('.zshrc').write('export DAY=' + day)
+    snapshot.join('RESTORE.md').write('guide')
+    snapshot.mkdir('.macprefs-modes').join('dotfiles.json').write('{}')
+    return snapshot
+
+
+def test_parse_age():
+    assert compaction.parse_age('30d') == timedelta(days=30)
+    assert compaction.parse_age('4w') == timedelta(days=28)
+    try:
+        compaction.parse_age('1y')
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def test_find_old_snapshots_skips_newest_and_packed(tmpdir):
+    machine = tmpdir.mkdir('mac')
+    for day in ['2026-01-01', '2026-01-02', '2026-01-03']:
+        make_snapshot(machine, day)
+    machine.join('2026-01-02').mkdir('archives')
+    old = compaction.find_old_snapshots(str(machine), timedelta(days=1), today=date(2026, 3, 1))
+    assert old == [str(machine.join('2026-01-01'))]
+
+
+@patch('compaction.get_module_paths')
+def test_compact_snapshot_keeps_files_readable(get_module_paths_mock, tmpdir):
+    machine = tmpdir.mkdir('mac')
+    snapshot = make_snapshot(machine, '2026-01-01')
+    get_module_paths_mock.return_value = [('dotfiles', [str(snapshot.join('dotfiles')) + '/'])]
+    files_before, files_after = compaction.compact_snapshot(str(snapshot), archive.get_codec('zlib'))
+    assert (files_before, files_after) == (3, 3)
+    assert sorted(os.listdir(str(machine))) == ['2026-01-01']
+    assert sorted(os.listdir(str(snapshot))) == ['.macprefs-modes', 'RESTORE.md', 'archives']
+    assert compaction.read_file(str(snapshot), 'dotfiles/.zshrc') == b'export DAY=2026-01-01'
+    assert compaction.read_file(str(snapshot), 'dotfiles/missing') is None
+
+
+@patch('compaction.get_module_paths')
+def test_compacted_recipes_keep_their_chunks(get_module_paths_mock, tmpdir):
+    machine = tmpdir.mkdir('mac')
+    store = str(machine.mkdir('chunks'))
+    snapshot = make_snapshot(machine, '2026-01-01')
+    data = os.urandom(chunks.MIN_FILE_SIZE)
+    snapshot.mkdir('Accounts').join('Accounts4.sqlite').write_binary(data)
+    chunks.chunk_paths([str(snapshot.join('Accounts'))], ['*.sqlite'], store)
+    get_module_paths_mock.return_value = [('internet_accounts', [str(snapshot.join('Accounts')) + '/'])]
+    compaction.compact_snapshot(str(snapshot), archive.get_codec('zlib'))
+    assert compaction.read_file(str(snapshot), 'Accounts/Accounts4.sqlite') == data
+    assert retention.get_unused_chunks(store, [str(snapshot)]) == []
+
+
+def test_get_module_paths_only_lists_backed_up_modules(tmpdir):
+    snapshot = make_snapshot(tmpdir.mkdir('mac'), '2026-01-01')
+    modules = dict((name, paths) for name, paths in compaction.get_module_paths(str(snapshot)) if paths)
+    assert list(modules) == ['dotfiles']
+    assert sorted(os.listdir(str(snapshot))) == ['.macprefs-modes', 'RESTORE.md', 'dotfiles']
@@ -26,6 +26,34 @@ def test_get_macprefs_dir_creates_if_not_exists(exists_mock, makedirs_mock):
     makedirs_mock.assert_called_once()
 
 
+def test_backup_context_is_resolved_once(tmpdir):
+    os.environ['MACPREFS_BACKUP_DIR'] = str(tmpdir.join('backup'))
+    try:
+        context = config.BackupContext.resolve()
+    finally:
+        del os.environ['MACPREFS_BACKUP_DIR']
+    config.set_context(context)
+    try:
+        assert not tmpdir.join('backup').exists()
+        with patch('config.ensure_exists') as ensure_mock:
+            ensure_mock.side_effect = lambda dir_path: os.makedirs(dir_path, exist_ok=True)
+            assert config.get_preferences_backup_dir() == str(tmpdir.join('backup', 'preferences')) + '/'
+            config.get_preferences_backup_dir()
+            assert config.get_macprefs_dir() == str(tmpdir.join('backup'))
+        assert ensure_mock.call_count == 2
+    finally:
+        config.set_context(None)
+
+
+def test_backup_context_is_immutable():
+    context = config.BackupContext('/backup', 'mac', '2026-01-01')
+    try:
+        context.backup_dir = '/other'
+        assert False, 'expected AttributeError'
+    except AttributeError:
+        pass
+
+
 def test_get_preferences_dir():
     assert config.get_preferences_dir() == path.join(
         config.get_home_dir(), 'Library/Preferences/')
@@ -47,3 +75,13 @@ def test_get_shared_file_lists_dir():
 def test_get_app_store_preferences_dir():
     assert config.get_app_store_preferences_dir() == path.join(
         config.get_home_dir(), 'Library/Containers/')
+
+
+def test_backup_context_without_create_only_resolves(tmpdir):
+    config.set_context(config.BackupContext(str(tmpdir.join('2030-01-01')), 'mac', '2030-01-01', create=False))
+    try:
+        assert config.get_dotfiles_backup_dir() == str(tmpdir.join('2030-01-01', 'dotfiles')) + '/'
+        assert config.get_macprefs_dir() == str(tmpdir.join('2030-01-01'))
+    finally:
+        config.set_context(None)
+    assert not tmpdir.join('2030-01-01').exists()
@@ -0,0 +1,124 @@
+import os
+import socket
+import stat
+from mock import patch
+
+import copy_engine
+import manifest
+
+
+def write(file_path, content, mode=0o644):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as f:
+        f.write(content)
+    os.chmod(file_path, mode)
+
+
+def test_copy_dir_copies_contents_with_trailing_slash(tmpdir):
+    src = str(tmpdir.join('src'))
+    dest = str(tmpdir.join('dest'))
+    write(os.path.join(src, 'a'), 'a')
+    write(os.path.join(src, 'sub', 'b'), 'bb', 0o755)
+    os.utime(os.path.join(src, 'a'), (1000000000, 1000000000))
+    stats = copy_engine.copy_dir(src + '/', dest + '/')
+    assert stats.copied == 2
+    assert stats.bytes == 3
+    with open(os.path.join(dest, 'sub', 'b')) as f:
+        assert f.read() == 'bb'
+    assert stat.S_IMODE(os.stat(os.path.join(dest, 'sub', 'b')).st_mode) == 0o755
+    assert int(os.stat(os.path.join(dest, 'a')).st_mtime) == 1000000000
+
+
+def test_copy_dir_without_trailing_slash_copies_the_dir(tmpdir):
+    src = str(tmpdir.join('src'))
+    write(os.path.join(src, 'a'), 'a')
+    copy_engine.copy_dir(src, str(tmpdir.join('dest')) + '/')
+    assert os.path.exists(str(tmpdir.join('dest', 'src', 'a')))
+
+
+def test_copy_dir_skips_unchanged_files(tmpdir):
+    src = str(tmpdir.join('src'))
+    dest = str(tmpdir.join('dest'))
+    write(os.path.join(src, 'a'), 'a')
+    copy_engine.copy_dir(src + '/', dest + '/')
+    stats = copy_engine.copy_dir(src + '/', dest + '/')
+    assert stats.copied == 0
+    assert stats.skipped == 1
+
+
+def test_copy_dir_skips_sockets_and_excluded_names(tmpdir):
+    src = str(tmpdir.join('src'))
+    dest = str(tmpdir.join('dest'))
+    write(os.path.join(src, 'agent.sock'), 'x')
+    os.makedirs(src, exist_ok=True)
+    sock = socket.socket(socket.AF_UNIX)
+    sock_path = os.path.join(src, 's')
+    try:
+        sock.bind(sock_path)
+        copy_engine.copy_dir(src + '/', dest + '/')
+    finally:
+        sock.close()
+    assert os.listdir(dest) == []
+
+
+def test_copy_dir_preserves_symlinks(tmpdir):
+    src = str(tmpdir.join('src'))
+    dest = str(tmpdir.join('dest'))
+    write(os.path.join(src, 'a'), 'a')
+    os.symlink('a', os.path.join(src, 'link'))
+    copy_engine.copy_dir(src + '/', dest + '/')
+    assert os.readlink(os.path.join(dest, 'link')) == 'a'
+
+
+def test_copy_file_and_copy_files(tmpdir):
+    write(str(tmpdir.join('one')), '1')
+    write(str(tmpdir.join('two')), '2')
+    dest = str(tmpdir.join('dest')) + '/'
+    copy_engine.copy_files([str(tmpdir.join('one'))], dest)
+    os.makedirs(str(tmpdir.join('dest2')))
+    copy_engine.copy_file(str(tmpdir.join('two')), str(tmpdir.join('dest2')))
+    assert os.path.exists(os.path.join(dest, 'one'))
+    assert os.path.exists(str(tmpdir.join('dest2', 'two')))
+    assert not [f for f in os.listdir(dest) if 'macprefs-tmp' in f]
+
+
+def test_copy_preserves_xattrs(tmpdir):
+    src = str(tmpdir.join('a'))
+    write(src, 'a')
+    try:
+        copy_engine.set_xattr(src, 'user.macprefs', b'value')
+    except OSError:
+        # file system without user xattrs
+        return
+    copy_engine.copy_file(src, str(tmpdir.join('b')))
+    assert copy_engine.get_xattr(str(tmpdir.join('b')), 'user.macprefs') == b'value'
+
+
+def test_copy_dir_links_unchanged_files_to_link_dest(tmpdir):
+    src = str(tmpdir.join('src'))
+    previous = str(tmpdir.join('2026-01-01'))
+    write(os.path.join(src, 'same'), 'same')
+    write(os.path.join(src, 'changed'), 'new')
+    copy_engine.copy_dir(src + '/', previous + '/')
+    write(os.path.join(src, 'changed'), 'newer')
+    dest = str(tmpdir.join('2026-01-02'))
+    stats = copy_engine.copy_dir(src + '/', dest + '/', link_dest=previous)
+    assert stats.linked == 1
+    assert stats.copied == 1
+    assert os.stat(os.path.join(dest, 'same')).st_ino == os.stat(os.path.join(previous, 'same')).st_ino
+    assert os.stat(os.path.join(dest, 'changed')).st_ino != os.stat(os.path.join(previous, 'changed')).st_ino
+    with open(os.path.join(previous, 'changed')) as f:
+        assert f.read() == 'new'
+
+
+@patch('manifest.get_hash_cache')
+def test_copy_dir_links_touched_files_with_same_content(cache_mock, tmpdir):
+    cache_mock.return_value = manifest.HashCache(str(tmpdir.join('hash-cache.json')))
+    src = str(tmpdir.join('src'))
+    previous = str(tmpdir.join('2026-01-01'))
+    write(os.path.join(src, 'touched'), 'same')
+    copy_engine.copy_dir(src + '/', previous + '/')
+    os.utime(os.path.join(src, 'touched'), (1000000000, 1000000000))
+    stats = copy_engine.copy_dir(src + '/', str(tmpdir.join('2026-01-02')) + '/', link_dest=previous)
+    assert stats.linked == 1
+    assert stats.copied == 0
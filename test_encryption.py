@@ -0,0 +1,127 @@
+import os
+import stat
+import pytest
+from mock import patch
+
+import config
+import encryption
+import filters
+import utils
+
+pytest.importorskip('cryptography')
+
+
+def write(file_path, content, mode=0o600):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        f.write(content)
+    os.chmod(file_path, mode)
+
+
+def read(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def key_file(tmpdir):
+    key_path = str(tmpdir.join('key', 'backup.key'))
+    with patch.dict(os.environ, {'MACPREFS_KEY_FILE': key_path}):
+        yield key_path
+
+
+def test_encrypt_dir_round_trips_a_tree(tmpdir, key_file):
+    src = str(tmpdir.join('gnupg'))
+    write(os.path.join(src, 'private-keys-v1.d', 'ABC.key'), b'secret key')
+    write(os.path.join(src, 'pubring.kbx'), b'public', 0o644)
+    write(os.path.join(src, 'empty'), b'')
+    os.symlink('pubring.kbx', os.path.join(src, 'link'))
+    os.utime(os.path.join(src, 'pubring.kbx'), (1000000000, 1000000000))
+    backup = str(tmpdir.join('backup'))
+    stats = encryption.encrypt_dir(src + '/', backup + '/', filters.Matcher([]))
+    assert stats.copied == 3
+    assert stat.S_IMODE(os.stat(key_file).st_mode) == 0o600
+    assert encryption.is_encrypted(backup)
+    assert b'secret key' not in read(os.path.join(backup, 'private-keys-v1.d', 'ABC.key'))
+    restored = str(tmpdir.join('restored'))
+    encryption.decrypt_dir(backup + '/', restored + '/', filters.Matcher([]))
+    assert read(os.path.join(restored, 'private-keys-v1.d', 'ABC.key')) == b'secret key'
+    assert read(os.path.join(restored, 'empty')) == b''
+    assert os.readlink(os.path.join(restored, 'link')) == 'pubring.kbx'
+    assert stat.S_IMODE(os.stat(os.path.join(restored, 'pubring.kbx')).st_mode) == 0o644
+    assert int(os.stat(os.path.join(restored, 'pubring.kbx')).st_mtime) == 1000000000
+    assert not os.path.exists(os.path.join(restored, encryption.MARKER_NAME))
+
+
+def test_encrypt_file_streams_chunks_in_order(tmpdir, key_file):
+    data = os.urandom(encryption.CHUNK_SIZE * 3 + 123)
+    write(str(tmpdir.join('src', 'big')), data)
+    src = str(tmpdir.join('src', 'big'))
+    key = encryption.load_key(create=True)
+    encryption.encrypt_file(src, str(tmpdir.join('big.enc')), key, os.stat(src))
+    assert os.path.getsize(str(tmpdir.join('big.enc'))) == \
+        encryption.HEADER.size + len(data) + 4 * encryption.TAG_SIZE
+    encryption.decrypt_file(str(tmpdir.join('big.enc')), str(tmpdir.join('big')), key)
+    assert read(str(tmpdir.join('big'))) == data
+
+
+def test_decrypt_file_detects_tampering_and_truncation(tmpdir, key_file):
+    data = os.urandom(encryption.CHUNK_SIZE + 10)
+    src = str(tmpdir.join('src'))
+    write(src, data)
+    key = encryption.load_key(create=True)
+    encrypted = str(tmpdir.join('enc'))
+    encryption.encrypt_file(src, encrypted, key, os.stat(src))
+    sealed = read(encrypted)
+    tampered = bytearray(sealed)
+    tampered[encryption.HEADER.size + 5] ^= 1
+    # the first chunk alone, as if the file was cut at a chunk boundary
+    truncated = sealed[:encryption.HEADER.size + encryption.CHUNK_SIZE + encryption.TAG_SIZE]
+    for content in [bytes(tampered), truncated]:
+        write(encrypted, content)
+        with pytest.raises(ValueError):
+            encryption.decrypt_file(encrypted, str(tmpdir.join('out')), key)
+        assert not os.path.exists(str(tmpdir.join('out')))
+
+
+def test_decrypt_dir_refuses_another_key(tmpdir, key_file):
+    write(str(tmpdir.join('src', 'credentials')), b'aws')
+    encryption.encrypt_dir(str(tmpdir.join('src')) + '/', str(tmpdir.join('backup')) + '/')
+    os.remove(key_file)
+    encryption.load_key(create=True)
+    with pytest.raises(ValueError):
+        encryption.decrypt_dir(str(tmpdir.join('backup')) + '/', str(tmpdir.join('restored')) + '/')
+
+
+def test_encrypt_dir_links_files_unchanged_since_previous_snapshot(tmpdir, key_file):
+    src = str(tmpdir.join('ssh'))
+    write(os.path.join(src, 'id_ed25519'), b'key')
+    write(os.path.join(src, 'known_hosts'), b'host')
+    previous = str(tmpdir.join('2026-01-01', 'ssh'))
+    encryption.encrypt_dir(src + '/', previous + '/')
+    write(os.path.join(src, 'known_hosts'), b'host2')
+    current = str(tmpdir.join('2026-01-02', 'ssh'))
+    stats = encryption.encrypt_dir(src + '/', current + '/', link_dest=previous)
+    assert stats.linked == 1
+    assert stats.copied == 1
+    assert os.path.samefile(os.path.join(current, 'id_ed25519'), os.path.join(previous, 'id_ed25519'))
+    assert encryption.encrypt_dir(src + '/', current + '/', link_dest=previous).skipped == 2
+
+
+def test_copy_dir_encrypts_modules_that_ask_for_it(tmpdir, key_file):
+    home = str(tmpdir.join('home', '.aws'))
+    write(os.path.join(home, 'credentials'), b'[default]')
+    backup = tmpdir.mkdir('backup')
+    dest = str(backup.join('cloud_credentials', 'aws')) + '/'
+    config.set_context(config.BackupContext(str(backup), 'mac', '2026-01-02'))
+    filters.set_config({'modules': {'cloud_credentials': {'encrypt': True}}})
+    try:
+        filters.filter_task('cloud_credentials', lambda: utils.copy_dir(home + '/', dest))()
+        assert encryption.is_encrypted(dest)
+        restored = str(tmpdir.join('restored'))
+        utils.copy_dir(dest, restored + '/', with_sudo=True)
+        assert read(os.path.join(restored, 'credentials')) == b'[default]'
+        assert utils.pop_copy_source(restored + '/') == dest
+    finally:
+        filters.set_config(None)
+        config.set_context(None)
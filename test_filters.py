@@ -0,0 +1,110 @@
+import os
+from mock import patch
+
+import filters
+
+
+def test_matcher_excludes_names_and_paths():
+    matcher = filters.Matcher(['*.sock', 'Cache', 'Library/Logs'], home_dir='/home/')
+    assert matcher.is_excluded('/home/.gnupg/S.gpg-agent.sock')
+    assert matcher.is_excluded('/home/Library/Application Support/Code/Cache/')
+    assert matcher.is_excluded('/home/Library/Logs')
+    assert not matcher.is_excluded('/home/Library/Preferences/Cache.plist')
+    assert not matcher.is_excluded('/home/.zshrc')
+
+
+def test_matcher_excludes_files_over_max_size(tmpdir):
+    big = tmpdir.join('big')
+    big.write('x' * 2048)
+    small = tmpdir.join('small')
+    small.write('x')
+    matcher = filters.Matcher([], max_size=1024)
+    assert matcher.filter_files([str(big), str(small)]) == [str(small)]
+    # directories are never too big
+    assert not matcher.is_excluded(str(tmpdir))
+
+
+def test_rsync_args_anchor_paths_at_the_transfer_root():
+    matcher = filters.Matcher(['*.sock', '/src/a/b', '/elsewhere/c'], max_size=10)
+    assert matcher.rsync_args('/src/') == ['--exclude=*.sock', '--exclude=/a/b', '--max-size=10']
+    assert matcher.rsync_args('/src') == ['--exclude=*.sock', '--exclude=/src/a/b', '--max-size=10']
+
+
+def test_matcher_wildcards_stop_at_slashes_like_rsync():
+    matcher = filters.Matcher(['Library/*/Cache', 'Code/**/logs', '[!.]tmp?', '[]x]'], home_dir='/home/')
+    assert matcher.is_excluded('/home/Library/Safari/Cache')
+    assert not matcher.is_excluded('/home/Library/Containers/com.app/Cache')
+    assert matcher.is_excluded('/home/Code/User/workspaceStorage/logs')
+    assert matcher.is_excluded('/home/a/xtmp1')
+    assert not matcher.is_excluded('/home/a/.tmp1')
+    assert matcher.is_excluded('/home/]')
+
+
+def test_get_matcher_ignores_config_rules_outside_of_modules():
+    filters.set_config({'defaults': {'exclude': ['.DS_Store'], 'max_size': 1}})
+    try:
+        matcher = filters.get_matcher()
+        assert matcher.excludes == filters.DEFAULT_EXCLUDES
+        assert matcher.max_size is None
+        assert filters.get_matcher('dotfiles').max_size == 1
+    finally:
+        filters.set_config(None)
+
+
+def test_parse_size():
+    assert filters.parse_size('200MB') == 200 * 1024 * 1024
+    assert filters.parse_size('1.5 K') == 1536
+    assert filters.parse_size(10) == 10
+    try:
+        filters.parse_size('lots')
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def test_get_matcher_adds_module_rules_to_defaults():
+    filters.set_config({
+        'defaults': {'exclude': ['*.sock'], 'max_size': '1KB'},
+        'modules': {'vscode_settings': {'exclude': ['History'], 'max_size': 2048}},
+    })
+    try:
+        vscode = filters.get_matcher('vscode_settings')
+        assert vscode.excludes == ['*.sock', 'History']
+        assert vscode.max_size == 2048
+        assert filters.get_matcher('dotfiles').max_size == 1024
+        assert filters.get_matcher('vscode_settings') is vscode
+    finally:
+        filters.set_config(None)
+
+
+def test_filter_task_selects_module_matcher():
+    filters.set_config({'modules': {'dotfiles': {'exclude': ['.viminfo']}}})
+    seen = []
+    try:
+        filters.filter_task('dotfiles', lambda: seen.append(filters.get_matcher()))()
+        seen.append(filters.get_matcher())
+    finally:
+        filters.set_config(None)
+    assert seen[0].excludes == filters.DEFAULT_EXCLUDES + ['.viminfo']
+    assert seen[1].excludes == filters.DEFAULT_EXCLUDES
+
+
+def test_get_includes_defaults_to_built_in_list():
+    filters.set_config({'modules': {'env_configs': {'include': ['nvim']}}})
+    try:
+        assert filters.get_includes('env_configs', ['gh']) == ['nvim']
+        assert filters.get_includes('jetbrains_settings', ['keymaps']) == ['keymaps']
+    finally:
+        filters.set_config(None)
+
+
+def test_load_config_reads_toml(tmpdir):
+    config_file = tmpdir.join('config.toml')
+    config_file.write('[modules.vscode_settings]\nexclude = ["History"]\nmax_size = "10MB"\n')
+    with patch.dict(os.environ, {'MACPREFS_CONFIG': str(config_file)}):
+        config = filters.load_config(filters.get_config_path())
+    assert config == {'modules': {'vscode_settings': {'exclude': ['History'], 'max_size': '10MB'}}}
+
+
+def test_load_config_without_file_is_empty(tmpdir):
+    assert filters.load_config(str(tmpdir.join('missing.toml'))) == {}
@@ -0,0 +1,48 @@
+from mock import MagicMock
+
+import journal
+
+
+def test_journal_records_outcomes(tmpdir):
+    journal_path = journal.get_journal_path(str(tmpdir))
+    good = MagicMock()
+    bad = MagicMock(side_effect=ValueError('boom'))
+    tasks = journal.journal_tasks([('good', good), ('bad', bad)], journal_path)
+    tasks[0][1]()
+    try:
+        tasks[1][1]()
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+    assert journal.load_completed(journal_path) == {'good'}
+
+
+def test_skip_completed_only_keeps_failed_or_missing_modules(tmpdir):
+    journal_path = journal.get_journal_path(str(tmpdir))
+    journal.record(journal_path, 'done', 'ok')
+    journal.record(journal_path, 'failed', 'failed', 'boom')
+    tasks = [('done', MagicMock()), ('failed', MagicMock()), ('missing', MagicMock())]
+    remaining = journal.skip_completed(tasks, journal_path)
+    assert [name for name, _ in remaining] == ['failed', 'missing']
+
+
+def test_latest_outcome_wins(tmpdir):
+    journal_path = journal.get_journal_path(str(tmpdir))
+    journal.record(journal_path, 'a', 'failed', 'boom')
+    journal.record(journal_path, 'a', 'ok')
+    assert journal.load_completed(journal_path) == {'a'}
+
+
+def test_load_completed_ignores_truncated_lines(tmpdir):
+    journal_path = journal.get_journal_path(str(tmpdir))
+    journal.record(journal_path, 'a', 'ok')
+    with open(journal_path, 'a') as f:
+        f.write('{"module": "b", "sta')
+    assert journal.load_completed(journal_path) == {'a'}
+
+
+def test_reset_removes_journal(tmpdir):
+    journal_path = journal.get_journal_path(str(tmpdir))
+    journal.record(journal_path, 'a', 'ok')
+    journal.reset(journal_path)
+    assert journal.load_completed(journal_path) == set()
@@ -19,6 +19,18 @@ def test_invoke_help(mock_stdout):
         assert_correct_std_out(e, mock_stdout)
 
 
+@patch('config.BackupContext.resolve')
+@patch('sys.stdout', new_callable=StringIO)
+def test_help_does_not_resolve_backup_dir(mock_stdout, resolve_mock):
+    try:
+        sys.argv = ['macprefs', '--version']
+        macprefs.main()
+        assert False, 'expected SystemExit'
+    except SystemExit as e:
+        assert e.code == 0
+    resolve_mock.assert_not_called()
+
+
 @patch('macprefs.invoke_func')
 def test_main_invokes_backup(invoke_func_mock):
     sys.argv = ['macprefs', 'backup']
@@ -0,0 +1,96 @@
+import json
+import os
+from mock import patch
+
+import manifest
+
+
+def test_write_manifest_records_every_file(tmpdir):
+    snapshot = tmpdir.mkdir('2026-01-01')
+    snapshot.mkdir('dotfiles').join('.zshrc').write('export A=1')
+    snapshot.join('RESTORE.md').write('guide')
+    snapshot.join('.macprefs-journal.jsonl').write('')
+    os.symlink('RESTORE.md', str(snapshot.join('link')))
+    cache = manifest.HashCache(str(tmpdir.join('hash-cache.json')))
+    manifest.write_manifest(str(snapshot), cache)
+    entries = manifest.load_manifest(str(snapshot))
+    assert sorted(entries) == ['RESTORE.md', 'dotfiles/.zshrc', 'link']
+    zshrc = entries['dotfiles/.zshrc']
+    assert zshrc['size'] == 10
+    assert zshrc['hash'] == manifest.hash_file(str(snapshot.join('dotfiles', '.zshrc')))
+    assert zshrc['inode'] == os.stat(str(snapshot.join('dotfiles', '.zshrc'))).st_ino
+    assert set(zshrc) == {'path', 'size', 'mtime', 'inode', 'mode', 'hash'}
+
+
+@patch('manifest.hash_file')
+def test_hash_cache_skips_unchanged_files(hash_mock, tmpdir):
+    hash_mock.return_value = 'abc'
+    fle = tmpdir.join('file')
+    fle.write('content')
+    cache_path = str(tmpdir.join('hash-cache.json'))
+    cache = manifest.HashCache(cache_path)
+    cache.get_hash(str(fle))
+    cache.save()
+    # a new run reads the saved cache
+    assert manifest.HashCache(cache_path).get_hash(str(fle)) == 'abc'
+    hash_mock.assert_called_once()
+
+
+def test_hash_cache_seeded_from_previous_manifest_skips_linked_files(tmpdir):
+    previous = tmpdir.mkdir('2026-01-01')
+    previous.mkdir('dotfiles').join('.zshrc').write('export A=1')
+    manifest.write_manifest(str(previous), manifest.HashCache(str(tmpdir.join('lost-cache.json'))))
+    current = tmpdir.mkdir('2026-01-02').mkdir('dotfiles')
+    os.link(str(previous.join('dotfiles', '.zshrc')), str(current.join('.zshrc')))
+    cache = manifest.HashCache(str(tmpdir.join('hash-cache.json')))
+    assert cache.seed(str(previous)) == 1
+    assert cache.seed(str(tmpdir.join('2026-01-03'))) == 0
+    expected = manifest.load_manifest(str(previous))['dotfiles/.zshrc']['hash']
+    with patch('manifest.hash_file') as hash_mock:
+        assert cache.get_hash(str(current.join('.zshrc'))) == expected
+        hash_mock.assert_not_called()
+
+
+@patch('manifest.hash_file')
+def test_hash_cache_rehashes_modified_files(hash_mock, tmpdir):
+    hash_mock.return_value = 'abc'
+    fle = tmpdir.join('file')
+    fle.write('content')
+    cache = manifest.HashCache(str(tmpdir.join('hash-cache.json')))
+    cache.get_hash(str(fle))
+    os.utime(str(fle), (1000000000, 1000000000))
+    cache.get_hash(str(fle))
+    assert hash_mock.call_count == 2
+
+
+def test_hash_cache_drops_unused_entries(tmpdir):
+    cache_path = tmpdir.join('hash-cache.json')
+    cache_path.write(json.dumps({'1:2': [1, 1, 'old', 0]}))
+    cache = manifest.HashCache(str(cache_path))
+    cache.save()
+    assert json.loads(cache_path.read()) == {}
+
+
+@patch('manifest.get_hash_cache')
+def test_same_content_compares_hashes(cache_mock, tmpdir):
+    cache_mock.return_value = manifest.HashCache(str(tmpdir.join('hash-cache.json')))
+    tmpdir.join('a').write('same')
+    tmpdir.join('b').write('same')
+    tmpdir.join('c').write('diff')
+    paths = [str(tmpdir.join(name)) for name in 'abc']
+    sts = [os.stat(p) for p in paths]
+    assert manifest.same_content(paths[0], sts[0], paths[1], sts[1])
+    assert not manifest.same_content(paths[0], sts[0], paths[2], sts[2])
+
+
+def test_merge_manifest_adds_entries_below_prefixes(tmpdir):
+    earlier = tmpdir.mkdir('earlier')
+    earlier.mkdir('git_config').join('.gitconfig').write('[user]')
+    earlier.mkdir('dotfiles').join('.bashrc').write('deleted since')
+    current = tmpdir.mkdir('current')
+    current.mkdir('dotfiles').join('.zshrc').write('export A=1')
+    cache = manifest.HashCache(str(tmpdir.join('hash-cache.json')))
+    manifest.write_manifest(str(earlier), cache)
+    manifest.write_manifest(str(current), cache)
+    manifest.merge_manifest(str(current), str(earlier), ['git_config'])
+    assert sorted(manifest.load_manifest(str(current))) == ['dotfiles/.zshrc', 'git_config/.gitconfig']
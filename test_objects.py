@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import time
+
+import archive
+import manifest
+import objects
+import retention
+
+
+def make_staging(tmpdir, name, zshrc):
+    staging = tmpdir.mkdir(name)
+    dotfiles = staging.mkdir('dotfiles')
+    dotfiles.join('.zshrc').write(zshrc)
+    dotfiles.join('.vimrc').write('set number')
+    os.chmod(str(dotfiles.join('.vimrc')), 0o600)
+    os.symlink('.zshrc', str(dotfiles.join('.bashrc')))
+    staging.join('RESTORE.md').write('guide')
+    staging.mkdir('.macprefs-modes').join('dotfiles.json').write('{}')
+    manifest.write_manifest(str(staging), manifest.HashCache(str(tmpdir.join(name + '-cache.json'))))
+    return staging
+
+
+def test_store_snapshot_shares_objects_across_machines(tmpdir):
+    store = str(tmpdir.join('Backup', 'objects'))
+    first = tmpdir.join('Backup', 'mac1').ensure('2026-01-01', dir=True)
+    second = tmpdir.join('Backup', 'mac2').ensure('2026-01-01', dir=True)
+    stats = objects.store_snapshot(str(make_staging(tmpdir, 's1', 'export A=1')), str(first), store)
+    assert stats.new_files == stats.files == 3
+    staging = make_staging(tmpdir, 's2', 'export A=2')
+    staging.join(archive.STAGING_MARKER).write(str(second))
+    stats = objects.store_snapshot(str(staging), str(second), store)
+    # only the .zshrc differs
+    assert stats.new_files == 1
+    assert objects.is_object_snapshot(str(second))
+    assert sorted(os.listdir(str(second))) == ['.macprefs-manifest.jsonl', '.macprefs-modes', '.macprefs-objects',
+                                               'RESTORE.md']
+    assert objects.get_store_dir(str(second)) == store
+
+
+def test_materialize_restores_selected_paths(tmpdir):
+    store = str(tmpdir.join('Backup', 'objects'))
+    snapshot = tmpdir.join('Backup', 'mac').ensure('2026-01-01', dir=True)
+    objects.store_snapshot(str(make_staging(tmpdir, 'staging', 'export A=1')), str(snapshot), store)
+    dest = tmpdir.mkdir('restore')
+    objects.materialize(str(snapshot), str(dest), [str(snapshot.join('dotfiles')) + '/'], store)
+    assert dest.join('dotfiles', '.zshrc').read() == 'export A=1'
+    assert os.stat(str(dest.join('dotfiles', '.vimrc'))).st_mode & 0o777 == 0o600
+    assert os.readlink(str(dest.join('dotfiles', '.bashrc'))) == '.zshrc'
+    assert dest.join('.macprefs-modes', 'dotfiles.json').exists()
+
+
+def test_prune_objects_keeps_objects_other_machines_use(tmpdir):
+    backup = tmpdir.mkdir('Backup')
+    store = str(backup.join('objects'))
+    old = backup.join('mac1').ensure('2026-01-01', dir=True)
+    objects.store_snapshot(str(make_staging(tmpdir, 's1', 'old')), str(old), store)
+    new = backup.join('mac1').ensure('2026-01-02', dir=True)
+    objects.store_snapshot(str(make_staging(tmpdir, 's2', 'new')), str(new), store)
+    other = backup.join('mac2').ensure('2026-01-01', dir=True)
+    objects.store_snapshot(str(make_staging(tmpdir, 's3', 'other')), str(other), store)
+    age_objects(store, objects.GRACE_PERIOD + 60)
+    reports = [retention.prune_machine(str(backup.join('mac1')), daily=1, weekly=0, monthly=0, dry_run=True)]
+    # first found unused now
+    assert retention.prune_objects(str(backup), reports) == []
+    assert list(objects.load_unused(store)) == [hashlib.sha256(b'old').hexdigest()]
+    age_unused(store, objects.GRACE_PERIOD + 60)
+    unused = retention.prune_objects(str(backup), reports, dry_run=True)
+    assert [manifest.hash_file(p) for p, _ in unused] == [hashlib.sha256(b'old').hexdigest()]
+    assert os.path.exists(unused[0][0])
+    retention.prune_objects(str(backup), reports)
+    assert not os.path.exists(unused[0][0])
+    assert objects.load_unused(store) == {}
+
+
+def test_unused_objects_within_grace_period_are_kept(tmpdir):
+    store = str(tmpdir.join('objects'))
+    snapshot = tmpdir.mkdir('2026-01-01')
+    objects.store_snapshot(str(make_staging(tmpdir, 's1', 'synced before its manifest')), str(snapshot), store)
+    unused_since = {}
+    assert objects.get_unused_objects(store, [], unused_since) == []
+    age_objects(store, objects.GRACE_PERIOD + 60)
+    # only found unused just now
+    assert objects.get_unused_objects(store, [], unused_since) == []
+    assert len(unused_since) == 3
+    unused_since = dict((digest, since - objects.GRACE_PERIOD - 60) for digest, since in unused_since.items())
+    assert len(objects.get_unused_objects(store, [], unused_since)) == 3
+    assert objects.get_unused_objects(store, [str(snapshot)], unused_since) == []
+    assert unused_since == {}
+
+
+def test_store_snapshot_leaves_existing_objects_alone(tmpdir):
+    store = str(tmpdir.join('Backup', 'objects'))
+    first = tmpdir.join('Backup', 'mac1').ensure('2026-01-01', dir=True)
+    objects.store_snapshot(str(make_staging(tmpdir, 's1', 'export A=1')), str(first), store)
+    age_objects(store, 60)
+    before = dict((p, os.stat(p).st_mtime) for p in list_objects(store))
+    second = tmpdir.join('Backup', 'mac2').ensure('2026-01-01', dir=True)
+    stats = objects.store_snapshot(str(make_staging(tmpdir, 's2', 'export A=1')), str(second), store)
+    assert stats.new_files == 0
+    assert dict((p, os.stat(p).st_mtime) for p in list_objects(store)) == before
+
+
+def test_objects_reused_after_being_found_unused_get_a_new_grace_period(tmpdir):
+    backup = tmpdir.mkdir('Backup')
+    store = str(backup.join('objects'))
+    old = backup.join('mac1').ensure('2026-01-01', dir=True)
+    objects.store_snapshot(str(make_staging(tmpdir, 's1', 'export A=1')), str(old), store)
+    age_objects(store, objects.GRACE_PERIOD + 60)
+    old.remove()
+    assert retention.prune_objects(str(backup), []) == []
+    age_unused(store, objects.GRACE_PERIOD + 60)
+    # mac2 reuses the objects, its manifest hasn't synced when mac1 prunes again
+    staging = make_staging(tmpdir, 's2', 'export A=1')
+    stats = objects.store_snapshot(str(staging), str(tmpdir.mkdir('unsynced')), store)
+    assert stats.new_files == 0
+    assert retention.prune_objects(str(backup), []) == []
+    assert len(list_objects(store)) == 3
+
+
+def test_prune_objects_keeps_objects_of_partial_backups(tmpdir):
+    backup = tmpdir.mkdir('Backup')
+    store = str(backup.join('objects'))
+    partial = backup.join('mac1').ensure('.2026-01-01.partial', dir=True)
+    objects.store_snapshot(str(make_staging(tmpdir, 's1', 'export A=1')), str(partial), store)
+    age_objects(store, objects.GRACE_PERIOD + 60)
+    assert retention.prune_objects(str(backup), []) == []
+    assert objects.load_unused(store) == {}
+
+
+def list_objects(store):
+    return [os.path.join(dirpath, name) for dirpath, _, filenames in os.walk(store)
+            for name in filenames if not name.startswith('.')]
+
+
+def age_unused(store, seconds):
+    unused_since = dict((digest, since - seconds) for digest, since in objects.load_unused(store).items())
+    with open(os.path.join(store, objects.UNUSED_NAME), 'w') as f:
+        json.dump(unused_since, f)
+
+
+def age_objects(store, seconds):
+    then = time.time() - seconds
+    for dirpath, _, filenames in os.walk(store):
+        for name in filenames:
+            os.utime(os.path.join(dirpath, name), (then, then))
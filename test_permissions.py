@@ -0,0 +1,51 @@
+import json
+import os
+from mock import patch
+
+import permissions
+
+
+def test_record_modes(tmpdir):
+    backup_dir = tmpdir.mkdir('backup')
+    ssh = backup_dir.mkdir('ssh')
+    key = ssh.join('id_rsa')
+    key.write('')
+    os.chmod(str(key), 0o600)
+    os.chmod(str(ssh), 0o700)
+    permissions.record_modes(str(backup_dir), 'ssh_files', [str(ssh) + '/'])
+    with open(str(backup_dir.join('.macprefs-modes', 'ssh_files.json'))) as f:
+        modes = json.load(f)
+    assert modes == {'ssh': 0o700, 'ssh/id_rsa': 0o600}
+
+
+def test_load_modes_returns_absolute_paths(tmpdir):
+    backup_dir = tmpdir.mkdir('backup')
+    backup_dir.mkdir('.macprefs-modes').join('ssh_files.json').write(json.dumps({'ssh/config': 0o644}))
+    modes = permissions.load_modes(str(backup_dir))
+    assert modes == {str(backup_dir.join('ssh', 'config')): 0o644}
+
+
+def test_get_dir_entries_uses_recorded_modes(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.join('config').write('')
+    source.join('id_rsa').write('')
+    modes = {str(source.join('config')): 0o644}
+    entries = permissions.get_dir_entries('/dest', str(source) + '/', modes, '600')
+    assert sorted(entries) == [('/dest', 0o711), ('/dest/config', 0o644), ('/dest/id_rsa', 0o600)]
+
+
+@patch('permissions.resolve_owner')
+@patch('permissions.os.chmod')
+@patch('permissions.os.lchown')
+def test_apply_plan_fixes_owner_and_mode_in_one_pass(chown_mock, chmod_mock, owner_mock, tmpdir):
+    owner_mock.return_value = (501, 20)
+    chown_mock.side_effect = lambda entry_path, uid, gid: os.lstat(entry_path)
+    fle = tmpdir.join('file')
+    fle.write('')
+    plan_path = permissions.write_plan('clint:staff', [(str(fle), 0o600), (str(tmpdir.join('gone')), 0o600)])
+    try:
+        assert permissions.apply_plan(plan_path) == 1
+    finally:
+        os.remove(plan_path)
+    owner_mock.assert_called_with('clint:staff')
+    chmod_mock.assert_called_once_with(str(fle), 0o600)
@@ -0,0 +1,71 @@
+import os
+
+import filters
+import planner
+
+
+def write(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as f:
+        f.write(content)
+
+
+def test_plan_modules_counts_files_and_bytes(tmpdir):
+    src = str(tmpdir.join('src'))
+    dest = str(tmpdir.join('dest'))
+    write(os.path.join(src, 'a.plist'), '1234')
+    write(os.path.join(src, 'big', 'b.plist'), '12345678')
+    write(os.path.join(src, 'big', 'deeper', 'c.plist'), '12')
+    plans = planner.plan_modules([('prefs', [(src + '/', dest + '/')])])
+    assert plans[0].files == 3
+    assert plans[0].bytes == 14
+    assert plans[0].changed == 3
+    assert plans[0].dirs[os.path.join(src, 'big')] == 10
+
+
+def test_plan_modules_compares_against_snapshot(tmpdir):
+    src = str(tmpdir.join('src'))
+    dest = str(tmpdir.join('dest'))
+    write(os.path.join(src, 'same'), 'same')
+    write(os.path.join(src, 'different'), 'new content')
+    write(os.path.join(dest, 'same'), 'same')
+    write(os.path.join(dest, 'different'), 'old')
+    st = os.stat(os.path.join(src, 'same'))
+    os.utime(os.path.join(dest, 'same'), (st.st_atime, st.st_mtime))
+    plans = planner.plan_modules([('prefs', [(src + '/', dest + '/')])])
+    assert plans[0].files == 2
+    assert plans[0].changed == 1
+
+
+def test_plan_modules_handles_files_and_missing_sources(tmpdir):
+    src_file = str(tmpdir.join('.gitconfig'))
+    write(src_file, 'abc')
+    sources = [(src_file, str(tmpdir.join('dest'))), (str(tmpdir.join('missing')), str(tmpdir))]
+    plans = planner.plan_modules([('git_config', sources), ('empty', [])])
+    assert plans[0].files == 1
+    assert plans[0].bytes == 3
+    assert plans[1].files == 0
+
+
+def test_format_plan_lists_largest_sources(tmpdir):
+    plan = planner.ModulePlan('alfred_settings')
+    plan.files = 2
+    plan.bytes = 3 * 1024 * 1024
+    plan.dirs = {'/node_modules': 3 * 1024 * 1024}
+    report = planner.format_plan([plan])
+    assert '3.0 MB' in report
+    assert '/node_modules' in report
+
+
+def test_plan_modules_applies_module_filters(tmpdir):
+    src = str(tmpdir.join('src'))
+    write(os.path.join(src, 'keep.json'), '12')
+    write(os.path.join(src, 'Cache', 'blob'), '1234')
+    write(os.path.join(src, 'agent.sock'), '')
+    filters.set_config({'modules': {'vscode_settings': {'exclude': ['Cache']}}})
+    try:
+        plans = planner.plan_modules([('vscode_settings', [(src + '/', str(tmpdir.join('dest')) + '/')])])
+    finally:
+        filters.set_config(None)
+    assert plans[0].files == 1
+    assert plans[0].bytes == 2
@@ -0,0 +1,56 @@
+import os
+import sys
+from mock import patch
+
+import probe_cache
+
+
+def test_fingerprint_changes_with_watched_dir(tmpdir):
+    command = [sys.executable, '--version']
+    before = probe_cache.fingerprint(command, [str(tmpdir)])
+    assert before == probe_cache.fingerprint(command, [str(tmpdir)])
+    tmpdir.join('new_extension').write('')
+    os.utime(str(tmpdir), ns=(0, 0))
+    assert before != probe_cache.fingerprint(command, [str(tmpdir)])
+
+
+def test_fingerprint_is_none_when_binary_is_missing():
+    assert probe_cache.fingerprint(['macprefs-no-such-binary']) is None
+
+
+def test_fingerprint_is_none_for_version_manager_shims(tmpdir):
+    shim = tmpdir.mkdir('shims').join('python3')
+    shim.write('#!/bin/sh\nexec pyenv exec python3 "$@"\n')
+    os.chmod(str(shim), 0o755)
+    assert probe_cache.fingerprint([str(shim), '--version']) is None
+
+
+def test_cache_persists_entries(tmpdir):
+    cache_path = str(tmpdir.join('probe-cache.json'))
+    probe_cache.ProbeCache(cache_path).put('key', 'v1.0')
+    assert probe_cache.ProbeCache(cache_path).get('key') == 'v1.0'
+
+
+@patch('probe_cache.time.time')
+def test_cache_expires_entries(time_mock, tmpdir):
+    cache = probe_cache.ProbeCache(str(tmpdir.join('probe-cache.json')), ttl=10)
+    time_mock.return_value = 100
+    cache.put('key', 'v1.0')
+    time_mock.return_value = 111
+    assert cache.get('key') is None
+
+
+@patch('probe_cache.time.time')
+def test_cache_evicts_least_recently_used(time_mock, tmpdir):
+    cache = probe_cache.ProbeCache(str(tmpdir.join('probe-cache.json')), max_entries=2)
+    time_mock.return_value = 1
+    cache.put('a', 'a')
+    time_mock.return_value = 2
+    cache.put('b', 'b')
+    time_mock.return_value = 3
+    cache.get('a')
+    time_mock.return_value = 4
+    cache.put('c', 'c')
+    assert cache.get('a') == 'a'
+    assert cache.get('b') is None
+    assert cache.get('c') == 'c'
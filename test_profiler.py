@@ -0,0 +1,94 @@
+import json
+import os
+from mock import patch, MagicMock
+
+import profiler
+
+
+def test_profile_tasks_records_each_module():
+    profiles = []
+    calls = []
+    tasks = profiler.profile_tasks([('a', lambda: calls.append('a'))], profiles)
+    tasks[0][1]()
+    assert calls == ['a']
+    assert len(profiles) == 1
+    assert profiles[0].name == 'a'
+    assert profiles[0].wall_time >= 0
+    assert profiles[0].process_peak_rss > 0
+    assert profiles[0].rss_increase >= 0
+    assert profiles[0].bytes_written is None
+
+
+def test_profile_tasks_counts_child_processes():
+    profiles = []
+
+    def task():
+        profiler.count_child_process()
+        profiler.count_child_process()
+
+    profiler.profile_tasks([('a', task)], profiles)[0][1]()
+    assert profiles[0].child_processes == 2
+    # counting outside a profiled module is a no-op
+    profiler.count_child_process()
+    assert profiles[0].child_processes == 2
+
+
+def test_profile_tasks_measures_bytes_written(tmpdir):
+    profiles = []
+    folder = str(tmpdir)
+
+    def task():
+        with open(os.path.join(folder, 'file'), 'w') as f:
+            f.write('1234')
+
+    profiler.profile_tasks([('a', task)], profiles, lambda name: [folder])[0][1]()
+    assert profiles[0].bytes_written == 4
+
+
+def test_profile_tasks_records_failed_modules():
+    profiles = []
+
+    def task():
+        raise ValueError('boom')
+
+    try:
+        profiler.profile_tasks([('a', task)], profiles)[0][1]()
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+    assert len(profiles) == 1
+
+
+@patch('profiler.resource.getrusage')
+def test_profile_tasks_reports_rss_increase_per_module(getrusage_mock):
+    usage = {'self': 100}
+    getrusage_mock.side_effect = lambda who: MagicMock(
+        ru_maxrss=usage['self'] if who == profiler.resource.RUSAGE_SELF else 0, ru_utime=0, ru_stime=0)
+
+    def heavy():
+        usage['self'] = 300
+
+    profiles = []
+    tasks = profiler.profile_tasks([('heavy', heavy), ('light', lambda: None)], profiles)
+    for _, task in tasks:
+        task()
+    assert [p.rss_increase for p in profiles] == [profiler.max_rss_bytes(200), 0]
+    assert [p.process_peak_rss for p in profiles] == [profiler.max_rss_bytes(300)] * 2
+
+
+@patch('profiler.sys.platform', 'linux')
+def test_max_rss_bytes_converts_kilobytes():
+    assert profiler.max_rss_bytes(2) == 2048
+
+
+def test_report_is_sorted_by_wall_time(tmpdir):
+    fast = profiler.ModuleProfile('fast')
+    slow = profiler.ModuleProfile('slow')
+    slow.wall_time = 5
+    report = profiler.format_report([fast, slow])
+    assert report.index('slow') < report.index('fast')
+    report_path = str(tmpdir.join('profile.json'))
+    profiler.save_report([fast, slow], report_path)
+    with open(report_path) as f:
+        saved = json.load(f)
+    assert [row['module'] for row in saved] == ['slow', 'fast']
@@ -0,0 +1,36 @@
+import subprocess
+import sys
+from mock import patch
+
+import registry
+
+
+def test_get_selected_keeps_registry_order():
+    assert registry.get_selected(['dotfiles', 'startup_items']) == ['startup_items', 'dotfiles']
+
+
+def test_get_selected_returns_all_when_nothing_chosen():
+    assert registry.get_selected([]) == registry.preference_choices
+    assert registry.get_selected(None) == registry.preference_choices
+
+
+def test_get_module_rejects_unknown_names():
+    try:
+        registry.get_module('os')
+        assert False, 'expected ValueError'
+    except ValueError as e:
+        assert 'os' in str(e)
+
+
+@patch('dotfiles.backup')
+def test_get_tasks_calls_module_action(backup_mock):
+    tasks = registry.get_tasks(['dotfiles'], 'backup')
+    assert [name for name, _ in tasks] == ['dotfiles']
+    tasks[0][1]()
+    backup_mock.assert_called_once()
+
+
+def test_loading_macprefs_does_not_import_modules():
+    code = ('import sys, utils; utils.execute_module("macprefs", "macprefs"); '
+            'assert "dotfiles" not in sys.modules and "restore_readme" not in sys.modules')
+    subprocess.check_call([sys.executable, '-c', code])
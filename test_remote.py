@@ -0,0 +1,146 @@
+import os
+import shutil
+import stat
+import pytest
+from mock import patch
+
+import atomic
+import config
+import manifest
+import remote
+import utils
+
+pytest.importorskip('boto3')
+moto_server = pytest.importorskip('moto.server')
+
+BUCKET = 'backups'
+
+
+@pytest.fixture(scope='module')
+def endpoint():
+    # a local S3 stand-in speaking the real protocol over HTTP
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield 'http://{}:{}'.format(host, port)
+    server.stop()
+
+
+@pytest.fixture
+def client(endpoint):
+    env = {'MACPREFS_S3_ENDPOINT': endpoint, 'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test',
+           'AWS_DEFAULT_REGION': 'us-east-1'}
+    with patch.dict(os.environ, env):
+        s3 = remote.create_client()
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET):
+            for item in page.get('Contents', []):
+                s3.delete_object(Bucket=BUCKET, Key=item['Key'])
+        s3.delete_bucket(Bucket=BUCKET)
+
+
+def write(file_path, content, mode=0o644):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        f.write(content)
+    os.chmod(file_path, mode)
+
+
+def stage(tmpdir, name, files, mtime=None):
+    """ A staging mirror holding files and the snapshot files an upload takes from it. """
+    staging_dir = str(tmpdir.join(name, 'staging'))
+    output_dir = str(tmpdir.join(name, 'output'))
+    for rel_path, content in files.items():
+        write(os.path.join(staging_dir, rel_path), content, 0o600)
+        if mtime is not None:
+            os.utime(os.path.join(staging_dir, rel_path), (mtime, mtime))
+    os.makedirs(output_dir)
+    manifest.write_manifest(staging_dir, manifest.HashCache(str(tmpdir.join('hash-cache.json'))))
+    shutil.copy2(os.path.join(staging_dir, manifest.MANIFEST_NAME), output_dir)
+    atomic.write_marker(output_dir, ['dotfiles'])
+    return staging_dir, output_dir
+
+
+def test_parse_url_splits_bucket_and_prefix():
+    assert remote.parse_url('s3://backups/macprefs/mac/2026-01-02/') == ('backups', 'macprefs/mac/2026-01-02')
+    assert remote.get_root_prefix('macprefs/mac/2026-01-02') == 'macprefs'
+    with pytest.raises(ValueError):
+        remote.parse_url('s3:///macprefs')
+
+
+@patch('config.socket.gethostname', return_value='mac.local')
+def test_backup_dir_urls_name_the_backup_root(_):
+    with patch.dict(os.environ, {'MACPREFS_BACKUP_DIR': 's3://backups/macprefs/'}):
+        backup_dir, machine_name, today = config.resolve_backup_dir()
+    assert backup_dir == 's3://backups/macprefs/mac/' + today
+
+
+def test_upload_snapshot_skips_objects_already_in_the_bucket(tmpdir, client):
+    files = {'dotfiles/.zshrc': b'export A=1', 'dotfiles/.vimrc': b'set nu'}
+    staging_dir, output_dir = stage(tmpdir, 'first', files)
+    stats = remote.Target('s3://backups/macprefs/mac/2026-01-01', client).upload_snapshot(staging_dir, output_dir)
+    assert (stats.files, stats.new_files) == (2, 2)
+    files['dotfiles/.gitconfig'] = b'[user]'
+    staging_dir, output_dir = stage(tmpdir, 'second', files)
+    stats = remote.Target('s3://backups/macprefs/other/2026-01-02', client).upload_snapshot(staging_dir, output_dir)
+    # objects are shared by every machine
+    assert (stats.files, stats.new_files, stats.new_bytes) == (3, 1, 6)
+    keys = remote.Target('s3://backups/macprefs/other/2026-01-02', client).list_keys('macprefs/other/2026-01-02')
+    assert sorted(keys) == [atomic.MARKER_NAME, manifest.MANIFEST_NAME]
+
+
+@patch('remote.MULTIPART_CHUNKSIZE', 5 * 1024 * 1024)
+@patch('remote.MULTIPART_THRESHOLD', 5 * 1024 * 1024)
+def test_upload_snapshot_sends_large_files_in_parts(tmpdir, client):
+    data = os.urandom(12 * 1024 * 1024)
+    staging_dir, output_dir = stage(tmpdir, 'large', {'alfred/Alfred.alfredpreferences': data})
+    target = remote.Target('s3://backups/macprefs/mac/2026-01-01', client)
+    target.upload_snapshot(staging_dir, output_dir)
+    key = target.get_object_key(manifest.hash_file(os.path.join(staging_dir, 'alfred/Alfred.alfredpreferences')))
+    head = client.head_object(Bucket=BUCKET, Key=key)
+    # multipart uploads have an ETag of the parts' MD5s followed by the number of parts
+    assert head['ETag'].strip('"').endswith('-3')
+    assert client.get_object(Bucket=BUCKET, Key=key)['Body'].read() == data
+
+
+def test_download_snapshot_fetches_only_the_selected_paths(tmpdir, client):
+    staging_dir, output_dir = stage(tmpdir, 'backup', {'dotfiles/.zshrc': b'export A=1', 'fonts/font.ttf': b'font'},
+                                    1000000000)
+    target = remote.Target('s3://backups/macprefs/mac/2026-01-01', client)
+    target.upload_snapshot(staging_dir, output_dir)
+    restored = str(tmpdir.mkdir('restored'))
+    target.download_snapshot(restored, ['dotfiles'])
+    zshrc = os.path.join(restored, 'dotfiles/.zshrc')
+    with open(zshrc, 'rb') as f:
+        assert f.read() == b'export A=1'
+    assert stat.S_IMODE(os.stat(zshrc).st_mode) == 0o600
+    assert int(os.stat(zshrc).st_mtime) == 1000000000
+    assert not os.path.exists(os.path.join(restored, 'fonts'))
+
+
+def test_download_snapshot_needs_a_complete_snapshot(tmpdir, client):
+    staging_dir, output_dir = stage(tmpdir, 'backup', {'dotfiles/.zshrc': b'export A=1'})
+    os.remove(os.path.join(output_dir, atomic.MARKER_NAME))
+    target = remote.Target('s3://backups/macprefs/mac/2026-01-01', client)
+    target.upload_snapshot(staging_dir, output_dir)
+    with pytest.raises(ValueError):
+        target.download_snapshot(str(tmpdir.mkdir('restored')), ['dotfiles'])
+
+
+def test_restore_with_profile_saves_the_report_locally(tmpdir, client, monkeypatch):
+    staging_dir, output_dir = stage(tmpdir, 'backup', {'dotfiles/.zshrc': b'export A=1'})
+    url = 's3://backups/macprefs/mac/2026-01-01'
+    remote.Target(url, client).upload_snapshot(staging_dir, output_dir)
+    macprefs = utils.execute_module('macprefs', 'macprefs')
+    cache_dir = str(tmpdir.join('cache'))
+    monkeypatch.chdir(str(tmpdir.mkdir('cwd')))
+    monkeypatch.setenv('MACPREFS_CACHE_DIR', cache_dir)
+    config.set_context(config.BackupContext(url, 'mac', '2026-01-01'))
+    try:
+        with patch.object(macprefs, 'run_restore', return_value=[]):
+            macprefs.restore(['dotfiles'], 1, True)
+    finally:
+        config.set_context(None)
+    assert os.path.exists(os.path.join(cache_dir, 'profile-restore.json'))
+    assert os.listdir(str(tmpdir.join('cwd'))) == []
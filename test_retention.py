@@ -0,0 +1,99 @@
+import os
+import time
+from os import path
+
+import atomic
+import chunks
+import compaction
+import retention
+
+
+def names(snapshot_dirs):
+    return sorted(path.basename(s) for s in snapshot_dirs)
+
+
+def age_chunks(store, seconds=8 * 24 * 60 * 60):
+    """ Makes the chunks in store look like they were stored `seconds` ago. """
+    then = time.time() - seconds
+    for dirpath, _, filenames in os.walk(store):
+        for name in filenames:
+            os.utime(path.join(dirpath, name), (then, then))
+
+
+def test_select_keep_applies_daily_weekly_and_monthly_rules():
+    days = ['2026-01-{:02d}'.format(d) for d in range(1, 32)] + ['2025-11-15', '2025-12-20']
+    kept = retention.select_keep(['/b/mac/' + d for d in days], daily=3, weekly=2, monthly=3)
+    # the last 3 days, the newest of the last 2 ISO weeks and of the last 3 months
+    assert names(kept) == ['2025-11-15', '2025-12-20', '2026-01-25', '2026-01-29', '2026-01-30', '2026-01-31']
+
+
+def test_select_keep_always_keeps_newest():
+    assert names(retention.select_keep(['/b/mac/2026-01-01', '/b/mac/2026-01-02'], 0, 0, 0)) == ['2026-01-02']
+
+
+def test_measure_deletions_counts_shared_files_once(tmpdir):
+    first = tmpdir.mkdir('2026-01-01')
+    second = tmpdir.mkdir('2026-01-02')
+    kept = tmpdir.mkdir('2026-01-03')
+    first.join('shared').write('x' * 10000)
+    os.link(str(first.join('shared')), str(second.join('shared')))
+    first.join('kept').write('y' * 10000)
+    os.link(str(first.join('kept')), str(kept.join('kept')))
+    block = retention.disk_usage(os.lstat(str(first.join('shared'))))
+    freed = dict(retention.measure_deletions([str(first), str(second)]))
+    # the shared file is freed by deleting its last link, the kept one never
+    assert freed[str(first)] == 0
+    assert freed[str(second)] == block
+
+
+def test_prune_machine_dry_run_deletes_nothing(tmpdir):
+    machine = tmpdir.mkdir('mac')
+    for day in ['2026-01-01', '2026-01-02', '2026-01-03']:
+        machine.mkdir(day).join('file').write(day)
+    report = retention.prune_machine(str(machine), daily=1, weekly=0, monthly=0, dry_run=True)
+    assert [name for name, _ in report['deleted']] == ['2026-01-01', '2026-01-02']
+    assert sorted(os.listdir(str(machine))) == ['2026-01-01', '2026-01-02', '2026-01-03']
+    retention.prune_machine(str(machine), daily=1, weekly=0, monthly=0)
+    assert os.listdir(str(machine)) == ['2026-01-03']
+
+
+def test_prune_machine_removes_unused_chunks(tmpdir):
+    machine = tmpdir.mkdir('mac')
+    store = str(machine.mkdir('chunks'))
+    old = machine.mkdir('2026-01-01')
+    old.join('old.sqlite').write_binary(os.urandom(chunks.MIN_FILE_SIZE))
+    chunks.chunk_file(str(old.join('old.sqlite')), store)
+    new = machine.mkdir('2026-01-02')
+    new.join('new.sqlite').write_binary(os.urandom(chunks.MIN_FILE_SIZE))
+    recipe = chunks.chunk_file(str(new.join('new.sqlite')), store)
+    # chunks stored within the grace period are kept
+    assert retention.prune_machine(str(machine), daily=1, weekly=0, monthly=0, dry_run=True)['chunks'] == 0
+    age_chunks(store)
+    report = retention.prune_machine(str(machine), daily=1, weekly=0, monthly=0)
+    assert report['chunks'] > 0
+    left = sorted(name for _, _, filenames in os.walk(store) for name in filenames)
+    assert left == sorted(chunk_hash for chunk_hash, _ in recipe['chunks'])
+
+
+def test_prune_machine_keeps_chunks_of_a_partial_backup(tmpdir):
+    machine = tmpdir.mkdir('mac')
+    store = str(machine.mkdir('chunks'))
+    data = os.urandom(chunks.MIN_FILE_SIZE)
+    old = machine.mkdir('2026-01-01')
+    old.join('db.sqlite').write_binary(data)
+    chunks.chunk_file(str(old.join('db.sqlite')), store)
+    machine.mkdir('2026-01-02').join('file').write('kept')
+    # a backup that crashed after chunking the same database
+    snapshot_dir = str(machine.join('2026-01-03'))
+    partial = atomic.get_partial_dir(snapshot_dir)
+    os.makedirs(partial)
+    with open(path.join(partial, 'db.sqlite'), 'wb') as f:
+        f.write(data)
+    chunks.chunk_file(path.join(partial, 'db.sqlite'), store)
+    age_chunks(store)
+    report = retention.prune_machine(str(machine), daily=1, weekly=0, monthly=0)
+    assert [name for name, _ in report['deleted']] == ['2026-01-01']
+    assert report['chunks'] == 0
+    # backup --resume commits the partial folder
+    atomic.commit_snapshot(partial, snapshot_dir, [])
+    assert compaction.read_file(snapshot_dir, 'db.sqlite') == data
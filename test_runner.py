@@ -0,0 +1,119 @@
+import logging as log
+import threading
+from mock import MagicMock
+
+import runner
+
+
+def test_run_modules_runs_serially_by_default():
+    calls = []
+    tasks = [('a', lambda: calls.append('a')), ('b', lambda: calls.append('b'))]
+    runner.run_modules(tasks)
+    assert calls == ['a', 'b']
+
+
+def test_run_modules_runs_in_parallel():
+    barrier = threading.Barrier(2, timeout=5)
+    tasks = [('a', barrier.wait), ('b', barrier.wait)]
+    # would time out if the tasks weren't running at the same time
+    runner.run_modules(tasks, jobs=2)
+
+
+def test_run_modules_raises_failure_after_all_modules_finish():
+    good = MagicMock()
+    bad = MagicMock(side_effect=ValueError('boom'))
+    try:
+        runner.run_modules([('bad', bad), ('good', good)], jobs=2)
+        assert False, 'expected ValueError'
+    except ValueError as e:
+        assert 'boom' in str(e)
+    good.assert_called_once()
+
+
+def test_run_modules_groups_output_per_module():
+    records = []
+    handler = MagicMock()
+    handler.level = log.NOTSET
+    handler.handle.side_effect = lambda record: records.append(record.getMessage())
+    root = log.getLogger()
+    old_handlers = root.handlers
+    old_level = root.level
+    root.handlers = [handler]
+    root.setLevel(log.INFO)
+    a_logged = threading.Event()
+    b_done = threading.Event()
+
+    def task_a():
+        log.info('a1')
+        a_logged.set()
+        b_done.wait(5)
+        log.info('a2')
+
+    def task_b():
+        a_logged.wait(5)
+        log.info('b1')
+        b_done.set()
+
+    try:
+        runner.run_modules([('a', task_a), ('b', task_b)], jobs=2)
+    finally:
+        root.handlers = old_handlers
+        root.setLevel(old_level)
+    assert records.index('a2') == records.index('a1') + 1
+    assert root.handlers == old_handlers
+
+
+def test_run_modules_waits_for_prerequisites():
+    calls = []
+    tasks = [('b', lambda: calls.append('b')), ('a', lambda: calls.append('a'))]
+    runner.run_modules(tasks, jobs=2, prerequisites={'b': {'a'}})
+    assert calls == ['a', 'b']
+
+
+def test_run_modules_orders_serial_runs_by_prerequisites():
+    calls = []
+    tasks = [('b', lambda: calls.append('b')), ('a', lambda: calls.append('a'))]
+    runner.run_modules(tasks, prerequisites={'b': {'a'}})
+    assert calls == ['a', 'b']
+
+
+def test_run_modules_skips_dependents_of_failed_modules():
+    dependent = MagicMock()
+    bad = MagicMock(side_effect=ValueError('boom'))
+    try:
+        runner.run_modules([('bad', bad), ('dependent', dependent)], jobs=2,
+                           prerequisites={'dependent': {'bad'}})
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+    dependent.assert_not_called()
+
+
+def test_run_modules_detects_cycles():
+    tasks = [('a', MagicMock()), ('b', MagicMock())]
+    try:
+        runner.run_modules(tasks, prerequisites={'a': {'b'}, 'b': {'a'}})
+        assert False, 'expected ValueError'
+    except ValueError as e:
+        assert 'Circular' in str(e)
+
+
+def test_build_prerequisites_serializes_overlapping_paths():
+    names = ['preferences', 'git_config', 'alfred_settings', 'dotfiles']
+    paths = {
+        'preferences': ['/home/Library/Preferences/'],
+        'git_config': ['/home/.gitconfig'],
+        'alfred_settings': ['/home/Library/Preferences/com.runningwithcrayons.Alfred.plist'],
+        'dotfiles': ['/home/.gitconfig', '/home/.zshrc'],
+    }
+    result = runner.build_prerequisites(names, {'git_config': ['preferences']}, paths)
+    assert result['preferences'] == set()
+    assert result['git_config'] == {'preferences'}
+    assert result['alfred_settings'] == {'preferences'}
+    assert result['dotfiles'] == {'git_config'}
+
+
+def test_paths_overlap():
+    assert runner.paths_overlap(['/a/b/'], ['/a/b/c'])
+    assert runner.paths_overlap(['/a/b'], ['/a/b/'])
+    assert not runner.paths_overlap(['/a/b'], ['/a/bc'])
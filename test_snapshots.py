@@ -0,0 +1,18 @@
+import snapshots
+
+
+def test_find_previous_returns_latest_earlier_snapshot(tmpdir):
+    machine = tmpdir.mkdir('mac')
+    for name in ['2026-01-01', '2026-01-03', '2026-01-05', 'notes']:
+        machine.mkdir(name)
+    assert snapshots.find_previous(str(machine.join('2026-01-04'))) == str(machine.join('2026-01-03'))
+    assert snapshots.find_previous(str(machine.join('2026-01-01'))) is None
+
+
+def test_find_previous_ignores_undated_backup_dirs(tmpdir):
+    tmpdir.mkdir('2026-01-01')
+    assert snapshots.find_previous(str(tmpdir.join('custom'))) is None
+
+
+def test_list_snapshots_of_missing_machine_is_empty(tmpdir):
+    assert snapshots.list_snapshots(str(tmpdir.join('missing'))) == []
@@ -1,9 +1,13 @@
 from subprocess import CalledProcessError
 import logging as log
+import os
+import sys
 from mock import patch
 
 import utils
 import config
+import probe_cache
+import filters
 
 
 @patch('utils.check_output')
@@ -33,6 +37,81 @@ def test_execute_shell_handles_errors(check_output_mock):
 def check_output_error_func(command, shell, cwd, stderr):
     raise CalledProcessError(0, command)
 
+
+@patch('utils.log.info')
+def test_execute_shell_streams_output(info_mock):
+    command = [sys.executable, '-c', 'print("one"); print("two")']
+    output = utils.execute_shell(command, stream=True)
+    assert output == 'one\ntwo'
+    info_mock.assert_any_call('one')
+    info_mock.assert_any_call('two')
+
+
+@patch('utils.STREAM_TAIL_LINES', 2)
+def test_execute_shell_keeps_tail_of_failed_stream():
+    command = [sys.executable, '-c', 'import sys; print("1\\n2\\n3"); sys.exit(3)']
+    try:
+        utils.execute_shell(command, stream=True, keep_output=False)
+        assert False, 'expected CalledProcessError'
+    except CalledProcessError as err:
+        assert err.returncode == 3
+        assert err.output == '2\n3'
+
+@patch('utils.get_probe_cache')
+@patch('utils.execute_shell')
+def test_execute_cached_skips_process_on_hit(shell_mock, cache_mock, tmpdir):
+    cache_mock.return_value = probe_cache.ProbeCache(str(tmpdir.join('probe-cache.json')))
+    shell_mock.return_value = 'Python 3'
+    command = [sys.executable, '--version']
+    assert utils.execute_cached(command) == 'Python 3'
+    assert utils.execute_cached(command) == 'Python 3'
+    shell_mock.assert_called_once_with(command)
+
+
+@patch('utils.get_probe_cache')
+@patch('utils.execute_shell')
+def test_execute_cached_does_not_cache_errors(shell_mock, cache_mock, tmpdir):
+    cache_mock.return_value = probe_cache.ProbeCache(str(tmpdir.join('probe-cache.json')))
+    shell_mock.side_effect = CalledProcessError(1, 'cmd', b'failed')
+    command = [sys.executable, '--version']
+    assert utils.execute_cached(command, suppress_errors=True) == 'failed'
+    assert utils.execute_cached(command, suppress_errors=True) == 'failed'
+    assert shell_mock.call_count == 2
+
+
+def test_run_commands_returns_results_in_order():
+    results = utils.run_commands([
+        [sys.executable, '-c', 'import time; time.sleep(0.2); print("slow")'],
+        [sys.executable, '-c', 'import sys; sys.stderr.write("fast"); sys.exit(2)'],
+    ])
+    assert [r.returncode for r in results] == [0, 2]
+    assert results[0].stdout == 'slow'
+    assert results[1].stderr == 'fast'
+    assert results[0].duration >= 0.2
+
+
+def test_run_commands_reports_missing_binaries():
+    result = utils.run_commands([['macprefs-no-such-binary']])[0]
+    assert result.returncode is None
+    assert not result.ok
+
+
+def test_run_commands_kills_commands_that_time_out():
+    result = utils.run_commands([[sys.executable, '-c', 'import time; time.sleep(10)']], timeout=0.2)[0]
+    assert result.returncode is None
+    assert result.stderr == 'timed out'
+
+
+@patch('utils.get_probe_cache')
+def test_run_commands_uses_probe_cache(cache_mock, tmpdir):
+    cache_mock.return_value = probe_cache.ProbeCache(str(tmpdir.join('probe-cache.json')))
+    command = [sys.executable, '-c', 'print("v1")']
+    assert not utils.run_commands([command], cached=True)[0].cached
+    result = utils.run_commands([command], cached=True)[0]
+    assert result.cached
+    assert result.stdout == 'v1'
+
+
 @patch('utils.log.root.getEffectiveLevel')
 @patch('utils.execute_shell')
 def test_copy_dir(execute_shell_mock, level_mock):
@@ -56,11 +135,17 @@ def test_copy_files(execute_shell_mock, log_mock):
     log_mock.return_value = log.DEBUG
     files = ['asdf']
     dest = "asdf2"
+    execute_shell_mock.return_value = ''
     utils.copy_files(files, dest)
     print(log_mock.mock_calls)
-    execute_shell_mock.assert_called_with(
-        ['rsync', '-a', '-vv'] + files + [dest]
-    )
+    # pylint: disable=unused-variable
+    args, kwargs = execute_shell_mock.call_args
+    command = args[0]
+    assert command[:5] == ['rsync', '-a', '-r', '--no-relative', '--from0']
+    assert command[5].startswith('--files-from=')
+    assert command[-3:] == ['-vv', '/', dest]
+    # the file list is passed in a file, not on argv
+    assert 'asdf' not in command
 
 
 @patch('utils.execute_shell')
@@ -90,26 +175,43 @@ def test_ensure_subdirs_listable(execute_shell_mock):
     )
 
 
-@patch('utils.ensure_subdirs_listable')
-@patch('utils.change_owner')
-@patch('utils.change_mode')
-def test_ensure_dir_owned_by_user(chmod_mock, chown_mock, listable_mock):
-    dest = config.get_ssh_user_dir
-    utils.ensure_dir_owned_by_user(dest, 'clint')
-    chmod_mock.assert_called_with(dest, '600')
-    chown_mock.assert_called_with(dest, 'clint')
-    listable_mock.assert_called_with(dest)
+@patch('utils.fix_permissions')
+def test_ensure_dir_owned_by_user(fix_mock, tmpdir):
+    dest = tmpdir.mkdir('dest')
+    dest.join('file').write('')
+    utils.ensure_dir_owned_by_user(str(dest), 'clint')
+    fix_mock.assert_called_with('clint', [(str(dest), 0o711), (str(dest.join('file')), 0o600)])
+
 
+@patch('utils.fix_permissions')
+def test_ensure_dir_owned_by_user_only_fixes_restored_files(fix_mock, tmpdir):
+    source = tmpdir.mkdir('source')
+    source.join('restored').write('')
+    dest = tmpdir.mkdir('dest')
+    dest.join('restored').write('')
+    dest.join('untouched').write('')
+    utils.remember_copy(str(source) + '/', str(dest))
+    utils.ensure_dir_owned_by_user(str(dest), 'clint')
+    paths = [entry[0] for entry in fix_mock.call_args[0][1]]
+    assert paths == [str(dest), str(dest.join('restored'))]
 
-@patch('utils.change_owner_for_files')
-@patch('utils.change_mode_for_files')
-def test_ensure_files_owned_by_user(mode_mock, owner_mock):
+
+@patch('utils.fix_permissions')
+def test_ensure_files_owned_by_user(fix_mock):
     files = ['.no_file']
     mode = '622'
     user = config.get_user()
     utils.ensure_files_owned_by_user(user, files, mode)
-    mode_mock.assert_called_with(files, mode)
-    owner_mock.assert_called_with(files, user)
+    fix_mock.assert_called_with(user, [('.no_file', 0o622)])
+
+
+@patch('utils.execute_shell')
+def test_fix_permissions_runs_one_sudo_process(shell_mock):
+    utils.fix_permissions('clint', [('/a', 0o600), ('/b', 0o700)])
+    shell_mock.assert_called_once()
+    command = shell_mock.call_args[0][0]
+    assert command[0] == 'sudo'
+    assert command[2].endswith('permissions.py')
 
 
 @patch('utils.execute_shell')
@@ -147,3 +249,137 @@ def test_copy_file(shell_mock, level_mock):
     shell_mock.assert_called_with(
         ['rsync', '-a', '-vv', fle, dest]
     )
+
+
+@patch('utils.copy_engine.copy_dir')
+@patch('utils.execute_shell')
+def test_copy_dir_uses_python_engine(execute_shell_mock, engine_mock):
+    utils.set_copy_engine('python')
+    try:
+        utils.copy_dir('src', 'dest')
+        utils.copy_dir('src', 'dest', with_sudo=True)
+    finally:
+        utils.set_copy_engine('rsync')
+    engine_mock.assert_called_once_with('src', 'dest', filters.get_matcher(), None)
+    # sudo copies still go through rsync
+    execute_shell_mock.assert_called_once()
+
+
+@patch('utils.execute_shell')
+def test_copy_dir_passes_filters_to_rsync(execute_shell_mock):
+    filters.set_config({'modules': {'vscode_settings': {'exclude': ['History', '/home/Code/User/workspaceStorage'],
+                                                        'max_size': '1MB'}}})
+    try:
+        filters.filter_task('vscode_settings', lambda: utils.copy_dir('/home/Code/', '/backup/vscode/'))()
+    finally:
+        filters.set_config(None)
+    command = execute_shell_mock.call_args[0][0]
+    assert command[:8] == ['rsync', '-a', '--exclude=*.sock', '--exclude=*.socket', '--exclude=History',
+                           '--exclude=/User/workspaceStorage', '--max-size=1048576', '/home/Code/']
+
+
+def test_get_link_dest_maps_backup_folders_to_previous_snapshot(tmpdir):
+    previous = tmpdir.mkdir('2026-01-01')
+    previous.mkdir('preferences')
+    current = tmpdir.mkdir('2026-01-02')
+    config.set_context(config.BackupContext(str(current), 'mac', '2026-01-02', str(previous)))
+    try:
+        assert utils.get_link_dest(str(current.join('preferences')) + '/') == str(previous.join('preferences'))
+        assert utils.get_link_dest(str(current.join('fonts'))) is None
+        assert utils.get_link_dest(str(tmpdir.join('home'))) is None
+    finally:
+        config.set_context(None)
+
+
+@patch('config.socket.gethostname', return_value='mac.local')
+def test_is_in_backup_does_not_create_the_snapshot(_, tmpdir):
+    with patch.dict(os.environ, {'MACPREFS_BACKUP_DIR': str(tmpdir.join('Backup'))}):
+        backup_dir = config.resolve_backup_dir()[0]
+        assert utils.is_in_backup(os.path.join(backup_dir, 'dotfiles'))
+        assert not utils.is_in_backup(str(tmpdir.join('home')))
+    assert not tmpdir.join('Backup').exists()
+
+
+@patch('utils.rsync_files')
+def test_copy_batch_coalesces_copies_per_destination(rsync_mock):
+    rsync_mock.return_value = {'a'}
+    with utils.copy_batch() as batch:
+        utils.queue_copy('/src/a', 'dest1')
+        utils.queue_copy('/src/b', 'dest1')
+        utils.queue_copy('/src/c', 'dest2')
+        rsync_mock.assert_not_called()
+    assert rsync_mock.call_count == 2
+    rsync_mock.assert_any_call(['/src/a', '/src/b'], 'dest1')
+    rsync_mock.assert_any_call(['/src/c'], 'dest2')
+    assert batch.queue == {}
+
+
+@patch('utils.rsync_files')
+def test_copy_batch_reports_results_per_file(rsync_mock):
+    rsync_mock.return_value = {'a'}
+    batch = utils.CopyBatch()
+    batch.add('/src/a', 'dest')
+    batch.add('/src/b', 'dest')
+    assert batch.flush() == {'/src/a': 'copied', '/src/b': 'up to date'}
+
+
+@patch('utils.log.error')
+@patch('utils.rsync_files')
+def test_copy_batch_reports_failed_files(rsync_mock, error_mock):
+    rsync_mock.side_effect = [CalledProcessError(23, 'rsync', b'a\n'), {'c'}]
+    batch = utils.CopyBatch()
+    batch.add('/src/a', 'dest')
+    batch.add('/src/b', 'dest')
+    batch.add('/src/c', 'dest2')
+    try:
+        batch.flush()
+        assert False, 'expected CalledProcessError'
+    except CalledProcessError:
+        pass
+    # rsync listed a as transferred before failing, and the other destination was still copied
+    error_mock.assert_called_once_with('Could not copy %s', '/src/b')
+    assert rsync_mock.call_count == 2
+
+
+@patch('utils.execute_shell')
+def test_copy_files_copies_directories_recursively(execute_shell_mock, tmpdir):
+    tmpdir.mkdir('colors').join('theme.json').write('{}')
+    tmpdir.join('settings.json').write('{}')
+    listed = []
+
+    def read_files_from(command):
+        files_from = [arg for arg in command if arg.startswith('--files-from=')][0].split('=', 1)[1]
+        with open(files_from, 'rb') as f:
+            listed.extend(f.read().split(b'\0'))
+        return ''
+    execute_shell_mock.side_effect = read_files_from
+    utils.rsync_files([str(tmpdir.join('colors')), str(tmpdir.join('settings.json'))], 'dest')
+    command = execute_shell_mock.call_args[0][0]
+    assert '-r' in command
+    assert listed == [os.fsencode(str(tmpdir.join('colors'))), os.fsencode(str(tmpdir.join('settings.json')))]
+
+
+@patch('utils.copy_file')
+def test_queue_copy_copies_immediately_outside_a_batch(copy_mock):
+    utils.queue_copy('a', 'dest')
+    copy_mock.assert_called_once_with('a', 'dest')
+
+
+@patch('utils.rsync_files')
+def test_flush_copies_flushes_current_batch(rsync_mock):
+    rsync_mock.return_value = set()
+    with utils.copy_batch():
+        utils.queue_copy('/src/a', 'dest')
+        assert utils.flush_copies() == {'/src/a': 'up to date'}
+    rsync_mock.assert_called_once()
+
+
+@patch('utils.get_probe_cache')
+def test_run_commands_watches_paths_per_command(cache_mock, tmpdir):
+    cache_mock.return_value = probe_cache.ProbeCache(str(tmpdir.join('probe-cache.json')))
+    command = [sys.executable, '-c', 'print("v1")']
+    watched = tmpdir.mkdir('sdk')
+    utils.run_commands([command], cached=True, watch=lambda c: [str(watched)])
+    watched.mkdir('8.0.100')
+    os.utime(str(watched), ns=(0, 0))
+    assert not utils.run_commands([command], cached=True, watch=lambda c: [str(watched)])[0].cached
@@ -1,14 +1,43 @@
-from subprocess import CalledProcessError, check_output, STDOUT
+from subprocess import CalledProcessError, check_output, Popen, PIPE, STDOUT
+from collections import deque
+from contextlib import contextmanager
+from os import environ
+import asyncio
+import os
 import sys
-import importlib
+import tempfile
+import threading
+import time
+import importlib.util
+import importlib.machinery
 import logging as log
+from profiler import count_child_process
+import copy_engine
+import encryption
+import filters
+import permissions
+import probe_cache
+import config
 
+# 'rsync' or 'python' (see copy_engine.py), sudo copies always use rsync
+copy_engine_name = environ.get('MACPREFS_COPY_ENGINE', 'rsync')
+# lines of a streamed command's output kept for its error message
+STREAM_TAIL_LINES = 100
 
-def execute_shell(command, is_shell=False, cwd='.', suppress_errors=False):
+
+def execute_shell(command, is_shell=False, cwd='.', suppress_errors=False, stream=False, keep_output=True):
+    """
+    Runs command and returns its output. With stream=True the output is
+    logged line by line while the command runs; only the last lines are
+    kept (and returned) unless keep_output is set.
+    """
     output = ''
     log.debug('\n--- executing shell command ----\n')
     log.debug('setting working dir to: %s', cwd)
     log.debug('command: %s', str(command))
+    count_child_process()
+    if stream:
+        return stream_shell(command, is_shell, cwd, suppress_errors, keep_output)
     try:
         output = check_output(command, shell=is_shell,
                               cwd=cwd, stderr=STDOUT).strip().decode('utf-8')
@@ -27,42 +56,378 @@ def execute_shell(command, is_shell=False, cwd='.', suppress_errors=False):
     return output
 
 
+def stream_shell(command, is_shell, cwd, suppress_errors, keep_output):
+    lines = []
+    tail = deque(maxlen=STREAM_TAIL_LINES)
+    with Popen(command, shell=is_shell, cwd=cwd, stdout=PIPE, stderr=STDOUT) as process:
+        for raw_line in process.stdout:
+            line = raw_line.decode('utf-8', 'replace').rstrip('\n')
+            log.info(line)
+            tail.append(line)
+            if keep_output:
+                lines.append(line)
+        returncode = process.wait()
+    log.debug('\n---- shell execution finished ---\n')
+    output = '\n'.join(lines if keep_output else tail).strip()
+    if returncode != 0:
+        log.error('Error Info:\nerror code = %s\ncmd %s\nlast lines of output:\n%s',
+                  returncode, command, '\n'.join(tail))
+        if not suppress_errors:
+            raise CalledProcessError(returncode, command, output)
+    return output
+
+
+_probe_cache = None
+_probe_cache_lock = threading.Lock()
+
+
+def get_probe_cache():
+    global _probe_cache
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            _probe_cache = probe_cache.ProbeCache(config.get_probe_cache_path())
+        return _probe_cache
+
+
+def execute_cached(command, watch=None, suppress_errors=False):
+    """
+    execute_shell for probes whose output only changes when the tool is
+    upgraded or a `watch`ed directory changes. Successful output is cached
+    on disk (see probe_cache.py) and reused without starting a process.
+    """
+    key = probe_cache.fingerprint(command, watch)
+    if key is None:
+        # not installed (execute_shell reports it) or a version manager shim
+        return execute_shell(command, suppress_errors=suppress_errors)
+    cache = get_probe_cache()
+    output = cache.get(key)
+    if output is not None:
+        log.debug('cached output of %s = %s', str(command), output)
+        return output
+    try:
+        output = execute_shell(command)
+    except CalledProcessError as err:
+        if not suppress_errors:
+            raise
+        output = err.output
+        if isinstance(output, bytes):
+            output = output.decode('ascii')
+        return output
+    cache.put(key, output)
+    return output
+
+
+class CommandResult:
+    """ Outcome of one command started by run_commands. returncode is None when it couldn't run. """
+
+    def __init__(self, command, returncode, stdout='', stderr='', duration=0.0, cached=False):
+        self.command = command
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+def run_commands(commands, limit=8, timeout=60, cached=False, watch=None):
+    """
+    Runs independent commands concurrently, at most `limit` at a time, and
+    returns a CommandResult for each in the same order. Commands running
+    longer than `timeout` seconds are killed. With cached=True successful
+    output is reused like execute_cached does. `watch` is a list of paths
+    for every command or a function returning the paths for a command.
+    """
+    return asyncio.run(run_commands_async(commands, limit, timeout, cached, watch))
+
+
+async def run_commands_async(commands, limit, timeout, cached, watch):
+    semaphore = asyncio.Semaphore(limit)
+    return await asyncio.gather(*[run_command(command, semaphore, timeout, cached, watch) for command in commands])
+
+
+async def run_command(command, semaphore, timeout, cached, watch):
+    if callable(watch):
+        watch = watch(command)
+    key = probe_cache.fingerprint(command, watch) if cached else None
+    if key is not None:
+        output = get_probe_cache().get(key)
+        if output is not None:
+            log.debug('cached output of %s = %s', str(command), output)
+            return CommandResult(command, 0, output, cached=True)
+    async with semaphore:
+        log.debug('command: %s', str(command))
+        count_child_process()
+        start = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as err:
+            log.debug('could not start %s: %s', str(command), str(err))
+            return CommandResult(command, None, stderr=str(err))
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            log.error('%s timed out after %s seconds', str(command), timeout)
+            return CommandResult(command, None, stderr='timed out', duration=time.perf_counter() - start)
+    result = CommandResult(command, process.returncode, stdout.decode('utf-8', 'replace').strip(),
+                           stderr.decode('utf-8', 'replace').strip(), time.perf_counter() - start)
+    log.debug('%s exited with %s after %.2fs', str(command), result.returncode, result.duration)
+    if key is not None and result.ok:
+        get_probe_cache().put(key, result.stdout)
+    return result
+
+
+def set_copy_engine(name):
+    global copy_engine_name
+    copy_engine_name = name
+
+
+def use_python_engine(with_sudo=False):
+    return copy_engine_name == 'python' and not with_sudo
+
+
+def log_copy_stats(stats, dest):
+    log.debug('copied %s files (%s bytes), %s up to date, %s linked, to %s',
+              stats.copied, stats.bytes, stats.skipped, stats.linked, dest)
+
+
+def get_link_dest(dest):
+    """
+    Where dest, a folder in the backup, is in the previous snapshot, so
+    unchanged files can be hard linked to it. None for anything else.
+    """
+    previous = config.get_previous_snapshot_dir()
+    if previous is None or not is_in_backup(dest):
+        return None
+    relative = os.path.relpath(os.path.abspath(dest), config.get_backup_location())
+    link_dest = os.path.normpath(os.path.join(previous, relative))
+    return link_dest if os.path.isdir(link_dest) else None
+
+
+def is_in_backup(dest):
+    # resolved without creating today's snapshot, dest may be anywhere
+    relative = os.path.relpath(os.path.abspath(dest), config.get_backup_location())
+    return relative != '..' and not relative.startswith('../')
+
+
+def link_dest_args(link_dest):
+    return [] if link_dest is None else ['--link-dest=' + link_dest]
+
+
+# paths written by copies on this thread, mapped to their source, so restores can
+# look up the modes recorded for the backed up files
+_restored = threading.local()
+
+
+def remember_copy(src, written):
+    if not hasattr(_restored, 'sources'):
+        _restored.sources = {}
+    _restored.sources[os.path.normpath(written)] = src
+
+
+def pop_copy_source(path):
+    return getattr(_restored, 'sources', {}).pop(os.path.normpath(path), None)
+
+
 def copy_dir(src, dest, with_sudo=False):
+    matcher = filters.get_matcher()
+    if encryption.is_encrypted(src.rstrip('/') or '/'):
+        # decrypted as the user, ensure_*_owned_by_user gives it the recorded modes
+        remember_copy(src, dest if src.endswith('/') else os.path.join(dest, os.path.basename(src)))
+        log_copy_stats(encryption.decrypt_dir(src, dest, matcher), dest)
+        return
+    link_dest = None if with_sudo else get_link_dest(dest)
+    if encryption.is_enabled(filters.get_current_name()) and is_in_backup(dest):
+        log_copy_stats(encryption.encrypt_dir(src, dest, matcher, link_dest), dest)
+        return
+    if use_python_engine(with_sudo):
+        log_copy_stats(copy_engine.copy_dir(src, dest, matcher, link_dest), dest)
+        return
     extra_args = []
     if log.root.getEffectiveLevel() == log.DEBUG:
         extra_args = ['-vv']
-    # Exclude socket files which rsync can't copy
-    command = ['rsync', '-a', '--exclude=*.sock', '--exclude=*.socket'] + extra_args + [src, dest]
+    # Excludes socket files which rsync can't copy, and whatever the config file excludes
+    command = ['rsync', '-a'] + matcher.rsync_args(src) + link_dest_args(link_dest) + extra_args + [src, dest]
     if with_sudo:
         command = ['sudo'] + command
-    execute_shell(command)
+        remember_copy(src, dest if src.endswith('/') else os.path.join(dest, os.path.basename(src)))
+    # -vv lists every file, show it as it happens instead of holding it in memory
+    execute_shell(command, stream=bool(extra_args), keep_output=False)
 
 
 def copy_files(files, dest):
+    files = filters.get_matcher().filter_files(files)
+    if not files:
+        return
+    for fle in files:
+        remember_copy(fle, os.path.join(dest, os.path.basename(fle)))
+    if use_python_engine():
+        log_copy_stats(copy_engine.copy_files(files, dest, get_link_dest(dest)), dest)
+        return
+    rsync_files(files, dest)
+
+
+def rsync_files(files, dest):
+    """
+    Copy any number of files into dest with a single rsync. The file list is
+    passed with --files-from instead of argv so it can't hit ARG_MAX.
+    Returns the names rsync reports as transferred.
+    """
+    # -a doesn't imply -r with --files-from, directories would be copied empty
     extra_args = []
     if log.root.getEffectiveLevel() == log.DEBUG:
         extra_args = ['-vv']
-    command = ['rsync', '-a'] + extra_args + files + [dest]
-    execute_shell(command)
+    with tempfile.NamedTemporaryFile('wb', prefix='macprefs-files-', delete=False) as f:
+        f.write(b'\0'.join(os.fsencode(os.path.abspath(fle)) for fle in files))
+        files_from = f.name
+    try:
+        command = ['rsync', '-a', '-r', '--no-relative', '--from0', '--files-from=' + files_from,
+                   '--out-format=%n'] + link_dest_args(get_link_dest(dest)) + extra_args + ['/', dest]
+        output = execute_shell(command)
+    finally:
+        os.remove(files_from)
+    return set(output.splitlines())
+
+
+class CopyBatch:
+    """
+    Queues copy_file calls and copies them with one rsync per destination
+    when flushed. Results are reported per file as 'copied', 'up to date'
+    or 'failed'.
+    """
+
+    def __init__(self):
+        self.queue = {}
+
+    def add(self, fle, dest):
+        remember_copy(fle, os.path.join(dest, os.path.basename(fle)))
+        self.queue.setdefault(dest, []).append(fle)
+
+    def flush(self):
+        results = {}
+        errors = []
+        queue, self.queue = self.queue, {}
+        for dest, files in queue.items():
+            try:
+                copied = rsync_files(files, dest)
+            except CalledProcessError as err:
+                errors.append(err)
+                output = err.output or b''
+                if isinstance(output, bytes):
+                    output = output.decode('utf-8', 'replace')
+                copied = set(output.splitlines())
+                for fle in files:
+                    results[fle] = 'copied' if os.path.basename(fle) in copied else 'failed'
+                continue
+            for fle in files:
+                results[fle] = 'copied' if os.path.basename(fle) in copied else 'up to date'
+        for fle, result in results.items():
+            if result == 'failed':
+                log.error('Could not copy %s', fle)
+            else:
+                log.debug('%s: %s', fle, result)
+        if errors:
+            raise errors[0]
+        return results
+
+
+_batches = threading.local()
+
+
+@contextmanager
+def copy_batch():
+    """ Queue the queue_copy calls made on this thread and copy them when the block ends. """
+    batch = CopyBatch()
+    previous = getattr(_batches, 'current', None)
+    _batches.current = batch
+    try:
+        yield batch
+        batch.flush()
+    finally:
+        _batches.current = previous
+
+
+def queue_copy(fle, dest):
+    """ Like copy_file, but coalesced into one rsync per destination inside copy_batch(). """
+    batch = getattr(_batches, 'current', None)
+    if batch is None or use_python_engine():
+        copy_file(fle, dest)
+    elif filters.get_matcher().is_excluded(fle):
+        log.debug('Excluded %s', fle)
+    else:
+        batch.add(fle, dest)
+
+
+def flush_copies():
+    """ Copy everything queued so far, e.g. before fixing the ownership of the copies. """
+    batch = getattr(_batches, 'current', None)
+    if batch is not None:
+        return batch.flush()
+    return {}
+
+
+def batch_tasks(tasks):
+    """ Wrap (name, func) tasks so each module's queued copies are flushed when it finishes. """
+    return [(name, batch_task(func)) for name, func in tasks]
+
+
+def batch_task(func):
+    def run():
+        with copy_batch():
+            func()
+    return run
 
 
 def copy_file(fle, dest):
+    if filters.get_matcher().is_excluded(fle):
+        log.debug('Excluded %s', fle)
+        return
+    remember_copy(fle, os.path.join(dest, os.path.basename(fle)) if os.path.isdir(dest) else dest)
+    link_dest = get_link_dest(dest) if os.path.isdir(dest) else None
+    if use_python_engine():
+        log_copy_stats(copy_engine.copy_file(fle, dest, link_dest), dest)
+        return
     extra_args = []
     if log.root.getEffectiveLevel() == log.DEBUG:
         extra_args = ['-vv']
-    command = ['rsync', '-a'] + extra_args + [fle, dest]
+    command = ['rsync', '-a'] + link_dest_args(link_dest) + extra_args + [fle, dest]
     execute_shell(command)
 
 
 def ensure_dir_owned_by_user(path, user, mode='600'):
-    change_mode(path, mode)
-    change_owner(path, user)
-    ensure_subdirs_listable(path)
+    """
+    Give `user` everything a restore copied into `path`, with the modes
+    recorded at backup time (`mode` for anything not recorded, directories
+    kept listable), in one privileged pass.
+    """
+    modes = permissions.load_modes(config.get_macprefs_dir())
+    entries = permissions.get_dir_entries(path, pop_copy_source(path), modes, mode)
+    fix_permissions(user, entries)
 
 
 def ensure_files_owned_by_user(user, files, mode='600'):
-    change_mode_for_files(files, mode)
-    change_owner_for_files(files, user)
+    modes = permissions.load_modes(config.get_macprefs_dir())
+    entries = permissions.get_file_entries(files, getattr(_restored, 'sources', {}), modes, mode)
+    fix_permissions(user, entries)
+
+
+def fix_permissions(owner, entries):
+    """ chown and chmod all (path, mode) entries with a single sudo process. """
+    if not entries:
+        return
+    plan_path = permissions.write_plan(owner, entries)
+    try:
+        result = execute_shell(permissions.get_fix_command(plan_path))
+    finally:
+        os.remove(plan_path)
+    if not is_none_or_empty_string(result):
+        log.debug(result)
 
 
 def change_owner_for_files(files, user):
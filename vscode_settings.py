@@ -1,13 +1,14 @@
 from os.path import exists, join
 import logging as log
-from config import get_macprefs_dir, get_home_dir, get_user, ensure_exists
-from utils import copy_file, ensure_files_owned_by_user, execute_shell
+from config import get_backup_subdir, get_home_dir, get_user, ensure_exists
+from utils import queue_copy, flush_copies, copy_dir, ensure_files_owned_by_user, execute_cached
+
+# Homebrew (and with it the `code` command) has to be installed before extensions can be installed
+restore_dependencies = ['package_managers']
 
 
 def get_vscode_backup_dir():
-    return_val = join(get_macprefs_dir(), 'vscode/')
-    ensure_exists(return_val)
-    return return_val
+    return get_backup_subdir('vscode/')
 
 
 def get_vscode_user_dir():
@@ -27,13 +28,13 @@ def backup():
     # Backup settings.json
     settings_file = join(source_dir, 'settings.json')
     if exists(settings_file):
-        copy_file(settings_file, dest)
+        queue_copy(settings_file, dest)
         log.debug('Backed up settings.json')
 
     # Backup keybindings.json
     keybindings_file = join(source_dir, 'keybindings.json')
     if exists(keybindings_file):
-        copy_file(keybindings_file, dest)
+        queue_copy(keybindings_file, dest)
         log.debug('Backed up keybindings.json')
 
     # Backup snippets directory
@@ -41,12 +42,14 @@ def backup():
     if exists(snippets_dir):
         snippets_dest = join(dest, 'snippets/')
         ensure_exists(snippets_dest)
-        execute_shell(['rsync', '-a', snippets_dir, snippets_dest])
+        copy_dir(snippets_dir, snippets_dest)
         log.debug('Backed up snippets/')
 
     # Backup extensions list
     try:
-        extensions = execute_shell(['code', '--list-extensions'], suppress_errors=True)
+        # only changes when an extension is (un)installed or VS Code is updated
+        extensions = execute_cached(['code', '--list-extensions'], watch=[join(get_home_dir(), '.vscode/extensions')],
+                                    suppress_errors=True)
         extensions_file = join(dest, 'extensions.txt')
         with open(extensions_file, 'w') as f:
             f.write(extensions)
@@ -71,7 +74,7 @@ def restore():
     settings_source = join(source, 'settings.json')
     if exists(settings_source):
         settings_dest = join(dest_dir, 'settings.json')
-        copy_file(settings_source, dest_dir)
+        queue_copy(settings_source, dest_dir)
         files_to_fix.append(settings_dest)
         log.debug('Restored settings.json')
 
@@ -79,7 +82,7 @@ def restore():
     keybindings_source = join(source, 'keybindings.json')
     if exists(keybindings_source):
         keybindings_dest = join(dest_dir, 'keybindings.json')
-        copy_file(keybindings_source, dest_dir)
+        queue_copy(keybindings_source, dest_dir)
         files_to_fix.append(keybindings_dest)
         log.debug('Restored keybindings.json')
 
@@ -87,7 +90,8 @@ def restore():
     snippets_source = join(source, 'snippets/')
     if exists(snippets_source):
         snippets_dest = join(dest_dir, 'snippets/')
-        execute_shell(['rsync', '-a', snippets_source, dest_dir])
+        ensure_exists(snippets_dest)
+        copy_dir(snippets_source, snippets_dest)
         log.debug('Restored snippets/')
 
     # Restore extensions (informational)
@@ -99,4 +103,23 @@ def restore():
 
     # Fix ownership
     if files_to_fix:
+        flush_copies()
         ensure_files_owned_by_user(get_user(), files_to_fix)
+
+
+def get_backup_sources():
+    source_dir = get_vscode_user_dir()
+    dest = get_vscode_backup_dir()
+    return [
+        (join(source_dir, 'settings.json'), dest),
+        (join(source_dir, 'keybindings.json'), dest),
+        (join(source_dir, 'snippets/'), join(dest, 'snippets/')),
+    ]
+
+
+def get_backup_paths():
+    return [get_vscode_backup_dir()]
+
+
+def get_restore_paths():
+    return [get_vscode_user_dir()]